@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+"""Merge the doors of several remote controllers, one /stream connection each, into a single /cfg, /upd and /stream."""
+import base64
+import json
+import logging
+
+import controller as Controller
+import door as Doors
+import static_assets as StaticAssets
+
+from twisted.internet import reactor, defer, protocol, task
+from twisted.web import server
+from twisted.web.client import Agent, HTTPConnectionPool, readBody
+from twisted.web.http_headers import Headers
+from twisted.web.resource import Resource
+
+STALE_AFTER = 45  # secs without data, the remotes send a keepalive every 15
+MAX_BACKOFF = 60
+
+
+class RemoteDoor(object):
+    """a door of a remote controller, ids are prefixed with the controller name"""
+
+    def __init__(self, remote, doorId, name, state, tis):
+        self.remote = remote
+        self.remote_id = doorId
+        self.id = "%s_%s" % (remote.name, doorId)
+        self.name = "%s %s" % (remote.name, name)
+        self.state_pin = None
+        self.state = state
+        self.version = 0
+        self.tis = {state: tis}
+
+
+class EventStream(protocol.Protocol):
+    """text/event-stream body, calls on_event(data) per event and on_data() for anything received"""
+
+    def __init__(self, on_event, on_data, finished):
+        self.on_event = on_event
+        self.on_data = on_data
+        self.finished = finished
+        self.buffer = ''
+
+    def dataReceived(self, data):
+        self.on_data()
+        self.buffer += data.replace('\r\n', '\n')
+        while '\n\n' in self.buffer:
+            event, self.buffer = self.buffer.split('\n\n', 1)
+            lines = [l[5:].lstrip(' ') for l in event.split('\n') if l.startswith('data:')]
+            if lines:
+                self.on_event('\n'.join(lines))
+
+    def connectionLost(self, reason):
+        self.finished.callback(None)
+
+
+class RemoteController(object):
+    def __init__(self, aggregator, config, agent, clock=reactor):
+        self.aggregator = aggregator
+        self.agent = agent
+        self.clock = clock
+        self.name = config['name']
+        self.url = config['url'].rstrip('/')
+        self.headers = Headers()
+        if config.get('username'):
+            self.headers.addRawHeader('Authorization', 'Basic ' + base64.b64encode(
+                "%s:%s" % (config['username'], config.get('password', ''))))
+        self.doors = {}
+        self.stream = None
+        self.connected = False
+        self.last_seen = None
+        self.last_error = None
+        self.version = None
+        self.failures = 0
+        self.reconnects = 0
+        self.reconnect = None
+        self.stopped = False
+
+    def start(self):
+        self.stopped = False
+        d = self.agent.request('GET', self.url + '/cfg', self.headers)
+        d.addCallback(self.check_response)
+        d.addCallback(readBody)
+        d.addCallback(self.on_config)
+        d.addCallback(lambda x: self.agent.request('GET', self.url + '/stream', self.headers))
+        d.addCallback(self.check_response)
+        d.addCallback(self.on_stream)
+        d.addErrback(self.on_error)
+
+    def check_response(self, response):
+        if response.code != 200:
+            raise Exception("%s %d" % (self.url, response.code))
+        return response
+
+    def on_config(self, body):
+        for (doorId, name, state, tis) in json.loads(body):
+            if doorId not in self.doors:
+                self.doors[doorId] = self.aggregator.add_door(RemoteDoor(self, doorId, name, state, tis))
+
+    def on_stream(self, response):
+        logging.info("Aggregator connected to %s (%s)" % (self.name, self.url))
+        self.connected = True
+        self.failures = 0
+        self.last_error = None
+        self.on_data()
+        finished = defer.Deferred()
+        self.stream = EventStream(self.on_event, self.on_data, finished)
+        response.deliverBody(self.stream)
+        finished.addCallback(lambda x: self.on_lost("stream closed"))
+
+    def on_data(self):
+        self.last_seen = self.clock.seconds()
+
+    def on_event(self, data):
+        event = json.loads(data)
+        self.version = event.get('version')
+        updates = []
+        for (doorId, state, tis) in event['update']:
+            door = self.doors.get(doorId)
+            if door == None:
+                self.doors[doorId] = self.aggregator.add_door(RemoteDoor(self, doorId, doorId, state, tis))
+                continue
+            elif door.state != state or door.tis.get(state) != tis:
+                door.state = state
+                door.tis[state] = tis
+            else:
+                continue
+            updates.append(door)
+        self.aggregator.doors_changed(updates)
+
+    def on_error(self, f):
+        self.on_lost(f.getErrorMessage())
+
+    def on_lost(self, reason):
+        if self.stopped:
+            return
+        logging.warning("Aggregator lost %s (%s): %s" % (self.name, self.url, reason))
+        self.connected = False
+        self.stream = None
+        self.last_error = reason
+        self.failures += 1
+        self.reconnects += 1
+        self.reconnect = self.clock.callLater(min(MAX_BACKOFF, 2 ** self.failures), self.start)
+
+    def stop(self):
+        self.stopped = True
+        self.connected = False
+        if self.reconnect != None and self.reconnect.active():
+            self.reconnect.cancel()
+        if self.stream != None:
+            self.stream.transport.stopProducing()
+            self.stream = None
+
+    """drop a connection that went quiet, the reconnect follows from on_lost"""
+    def check_stale(self, stale_after):
+        if self.connected and self.clock.seconds() - self.last_seen > stale_after:
+            self.stream.transport.stopProducing()
+
+    def health(self):
+        return {'name': self.name, 'url': self.url, 'connected': self.connected,
+                'last_seen': self.last_seen, 'last_error': self.last_error, 'version': self.version,
+                'reconnects': self.reconnects, 'doors': len(self.doors)}
+
+
+class HealthHandler(Resource):
+    isLeaf = True
+    def __init__(self, aggregator):
+        Resource.__init__(self)
+        self.aggregator = aggregator
+
+    def render(self, request):
+        request.setHeader('Content-Type', 'application/json')
+        return json.dumps([r.health() for r in self.aggregator.remotes])
+
+
+class Aggregator(object):
+    """stands in for Controller behind ConfigHandler, UpdateHandler and StreamHandler"""
+
+    def __init__(self, config, clock=reactor, agent=None):
+        self.config = config
+        self.clock = clock
+        self.port = config['site']['port']
+        c = config['aggregator']
+        self.stale_after = c.get('stale_after', STALE_AFTER)
+        self.pool = None
+        if agent == None:
+            self.pool = HTTPConnectionPool(reactor)
+            self.pool.maxPersistentPerHost = 1
+            agent = Agent(reactor, pool=self.pool)
+        self.doors = []
+        self.registry = Doors.DoorRegistry([])
+        self.remotes = [RemoteController(self, r, agent, clock) for r in c['controllers']]
+        self.updateHandler = Controller.UpdateHandler(self)
+        self.streamHandler = Controller.StreamHandler(self)
+
+    def add_door(self, door):
+        self.doors.append(door)
+        self.registry.add(door)
+        self.publish([door])
+        return door
+
+    def doors_changed(self, doors):
+        for door in doors:
+            self.registry.touch(door)
+        self.publish(doors)
+
+    def publish(self, doors):
+        if doors:
+            updates = [(d.id, d.state, d.tis.get(d.state)) for d in doors]
+            self.updateHandler.publish(updates)
+            self.streamHandler.publish(updates)
+
+    def get_updates(self, lastupdate):
+        return [(d.id, d.state, d.tis.get(d.state)) for d in self.doors if d.tis.get(d.state) >= lastupdate]
+
+    def get_changes(self, version):
+        return [(d.id, d.state, d.tis.get(d.state)) for d in self.registry.changed_since(version)]
+
+    def check_stale(self):
+        for remote in self.remotes:
+            remote.check_stale(self.stale_after)
+
+    def site(self):
+        root = StaticAssets.StaticAssets('www')
+        root.putChild('upd', self.updateHandler)
+        root.putChild('stream', self.streamHandler)
+        root.putChild('cfg', Controller.gzipped(Controller.ConfigHandler(self)))
+        root.putChild('health', HealthHandler(self))
+        return server.Site(root)
+
+    """connect to every remote controller"""
+    def start(self):
+        for remote in self.remotes:
+            remote.start()
+        self.stale_check = task.LoopingCall(self.check_stale)
+        self.stale_check.clock = self.clock
+        self.stale_check.start(self.stale_after / 3.0, now=False)
+
+    def stop(self):
+        if self.stale_check.running:
+            self.stale_check.stop()
+        for remote in self.remotes:
+            remote.stop()
+        if self.pool != None:
+            return self.pool.closeCachedConnections()
+        return defer.succeed(None)
+
+    def run(self):
+        reactor.listenTCP(self.port, self.site())  # @UndefinedVariable
+        self.start()
+        reactor.run()  # @UndefinedVariable
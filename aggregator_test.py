@@ -0,0 +1,255 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import aggregator as Aggregator
+import controller as Controller
+import utils as Utils
+
+from twisted.internet import defer, reactor, task
+from twisted.python.failure import Failure
+from twisted.trial import unittest as trial
+from twisted.web.client import Agent, ResponseDone, readBody
+from twisted.web.test.requesthelper import DummyRequest
+
+
+class FakeTransport(object):
+    def __init__(self, protocol):
+        self.protocol = protocol
+
+    def stopProducing(self):
+        self.protocol.connectionLost(None)
+
+
+class FakeResponse(object):
+    phrase = 'OK'
+
+    def __init__(self, code, body='', done=False):
+        self.code = code
+        self.body = body
+        self.done = done
+        self.protocol = None
+
+    def deliverBody(self, protocol):
+        self.protocol = protocol
+        protocol.transport = FakeTransport(protocol)
+        if self.body:
+            protocol.dataReceived(self.body)
+        if self.done:
+            protocol.connectionLost(Failure(ResponseDone()))
+
+
+class FakeSite(object):
+    """a remote controller, doors as in its /cfg"""
+
+    def __init__(self, doors):
+        self.doors = doors
+        self.up = True
+        self.streams = []
+
+    def push(self, update, version):
+        for response in self.streams:
+            response.protocol.dataReceived("data: %s\n\n" % json.dumps({'timestamp': 0, 'version': version, 'update': update}))
+
+    def close(self):
+        for response in self.streams:
+            response.protocol.connectionLost(None)
+        self.streams = []
+
+
+class FakeAgent(object):
+    def __init__(self, sites):
+        self.sites = sites
+        self.requests = []
+
+    def request(self, method, uri, headers=None):
+        self.requests.append(uri)
+        url, path = uri.rsplit('/', 1)
+        site = self.sites[url]
+        if not site.up:
+            return defer.fail(Exception("connection refused"))
+        if path == 'cfg':
+            return defer.succeed(FakeResponse(200, json.dumps(site.doors), done=True))
+        response = FakeResponse(200, "retry: 10000\n")
+        site.streams.append(response)
+        return defer.succeed(response)
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.home = FakeSite([["left", "Left", "closed", 100], ["right", "Right", "open", 200]])
+        self.cabin = FakeSite([["left", "Shed", "closed", 300]])
+        self.agent = FakeAgent({"http://home": self.home, "http://cabin": self.cabin})
+        config = {'site': {'port': 0},
+                  'aggregator': {'stale_after': 45, 'controllers': [
+                      {'name': 'home', 'url': 'http://home/'},
+                      {'name': 'cabin', 'url': 'http://cabin', 'username': 'u', 'password': 'p'}]}}
+        self.aggregator = Aggregator.Aggregator(config, self.clock, self.agent)
+        for remote in self.aggregator.remotes:
+            remote.start()
+
+    def testMergedConfig(self):
+        self.assertEqual(["home_left", "home_right", "cabin_left"], [d.id for d in self.aggregator.doors])
+        self.assertEqual("cabin Shed", self.aggregator.registry.get("cabin_left").name)
+        self.assertEqual(1, len(self.home.streams))
+
+    def testStreamUpdatesDelta(self):
+        version = self.aggregator.registry.version
+        self.home.push([["left", "opening", 500]], 7)
+        self.home.push([["right", "open", 200]], 8)  # no change
+        self.assertEqual([("home_left", "opening", 500)], self.aggregator.get_changes(version))
+        self.assertEqual(8, self.aggregator.remotes[0].version)
+
+    def testLongPollCompleted(self):
+        request = DummyRequest(['upd'])
+        request.args = {'cursor': [str(self.aggregator.registry.version)]}
+        self.aggregator.updateHandler.render(request)
+        self.cabin.push([["left", "open", 600]], 2)
+        response = json.loads(request.written[0])
+        self.assertEqual([["cabin_left", "open", 600]], response['update'])
+        self.assertEqual(self.aggregator.registry.version, response['version'])
+
+    def testReconnectWithBackoff(self):
+        self.cabin.up = False
+        self.cabin.close()
+        health = self.aggregator.remotes[1].health()
+        self.assertFalse(health['connected'])
+        self.assertEqual("stream closed", health['last_error'])
+        self.clock.advance(2)  # fails, next attempt in 4 secs
+        self.assertEqual("connection refused", self.aggregator.remotes[1].last_error)
+        self.cabin.up = True
+        self.clock.advance(4)
+        self.assertTrue(self.aggregator.remotes[1].connected)
+        self.assertEqual(3, len(self.aggregator.doors))
+
+    def testStaleConnectionDropped(self):
+        self.clock.advance(30)
+        self.home.push([], 9)
+        self.clock.advance(20)
+        self.aggregator.check_stale()
+        self.assertTrue(self.aggregator.remotes[0].connected)
+        self.assertFalse(self.aggregator.remotes[1].connected)
+
+    def testHealth(self):
+        request = DummyRequest(['health'])
+        health = json.loads(Aggregator.HealthHandler(self.aggregator).render(request))
+        self.assertEqual(["home", "cabin"], [h['name'] for h in health])
+        self.assertEqual([2, 1], [h['doors'] for h in health])
+
+def controller_config(path, name):
+    return {
+        "site": {"port": 0, "port_secure": 0},
+        "config": {"use_https": False, "use_auth": False, "use_alerts": False, "motion_pin": None, "temperature_pin": 4,
+                   "times": {"to_close_door": 0, "to_open_door": 0, "to_report_open": 600, "to_report_still_open": 3600,
+                             "to_force_close": None},
+                   "checkpoint": {"path": os.path.join(path, name + "State.json")}},
+        "alerts": {"when_opened": True, "when_closed": True, "on_days_of_week": "", "from_time": "", "to_time": "",
+                   "alert_type": ""},
+        "mqtt": {"server": "localhost", "username": "", "password": "", "queue_path": os.path.join(path, name + "Queue"),
+                 "topics": {"garage": "garage/action", "temperature": "temperature/action",
+                            "day_temperature": "day_temperature/action"}},
+        "weatherapi": {"url": "", "key": ""},
+        "db": {"path": os.path.join(path, "gdc")},
+        "doors": {"left": {"id": "Left", "relay_pin": 23, "state_pin": 24, "closed_value": 0},
+                  "right": {"id": "Right", "relay_pin": 17, "state_pin": 18, "closed_value": 0}}
+    }
+
+
+class LocalControllersTest(trial.TestCase):
+    """a real Aggregator in front of two controllers in debug mode, over http on localhost"""
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.fileCache = Utils.gfileCache
+        Utils.gfileCache = os.path.join(self.dir, "garageCache")
+        self.controllers = {}
+        self.ports = {}
+        remotes = []
+        for name in ("home", "cabin"):
+            c = Controller.Controller(controller_config(self.dir, name), debugging=True)
+            self.controllers[name] = c
+            self.ports[name] = reactor.listenTCP(0, c.site(), interface="127.0.0.1")
+            remotes.append({'name': name, 'url': "http://127.0.0.1:%d" % (self.ports[name].getHost().port)})
+        self.aggregator = Aggregator.Aggregator({'site': {'port': 0}, 'aggregator': {'controllers': remotes}})
+        self.port = reactor.listenTCP(0, self.aggregator.site(), interface="127.0.0.1")
+        self.aggregator.start()
+        return self.wait_for(lambda: all(r.connected for r in self.aggregator.remotes))
+
+    @defer.inlineCallbacks
+    def tearDown(self):
+        yield self.aggregator.stop()
+        for c in self.controllers.values():
+            c.checkpoint.stop()
+        yield self.wait_for(lambda: all(c.streamHandler.streams == [] for c in self.controllers.values()))
+        yield self.port.stopListening()
+        for port in self.ports.values():
+            yield port.stopListening()
+        Utils.gfileCache = self.fileCache
+        shutil.rmtree(self.dir)
+
+    def wait_for(self, condition, timeout=5.0):
+        d = defer.Deferred()
+        deadline = reactor.seconds() + timeout
+
+        def check():
+            if condition():
+                d.callback(None)
+            elif reactor.seconds() > deadline:
+                d.errback(AssertionError("timed out waiting for %s" % (condition)))
+            else:
+                reactor.callLater(0.01, check)
+        check()
+        return d
+
+    @defer.inlineCallbacks
+    def get(self, path):
+        response = yield Agent(reactor).request('GET', "http://127.0.0.1:%d/%s" % (self.port.getHost().port, path))
+        body = yield readBody(response)
+        defer.returnValue(json.loads(body))
+
+    @defer.inlineCallbacks
+    def testMergedConfigAndDeltas(self):
+        doors = yield self.get("cfg")
+        self.assertEqual(["cabin_left", "cabin_right", "home_left", "home_right"], sorted(d[0] for d in doors))
+        self.assertEqual(["closed"] * 4, [d[2] for d in doors])
+
+        since = yield self.get("cfg?since=0")
+        version = since['version']
+        home = self.controllers["home"]
+        door = home.get_door("left")
+        door.toggle_relay()
+        home.check_door_status(door)
+        yield self.wait_for(lambda: self.aggregator.get_changes(version) != [])
+
+        upd = yield self.get("upd?cursor=%d" % (version))
+        self.assertEqual([["home_left", door.state, door.tis[door.state]]], upd['update'])
+        self.assertTrue(upd['version'] > version)
+
+        health = yield self.get("health")
+        self.assertEqual([True, True], [h['connected'] for h in health])
+        self.assertEqual([2, 2], [h['doors'] for h in health])
+
+    @defer.inlineCallbacks
+    def testControllerStops(self):
+        yield self.ports["cabin"].stopListening()
+        for request in list(self.controllers["cabin"].streamHandler.streams):
+            request.channel.transport.loseConnection()
+        cabin = self.aggregator.remotes[1]
+        yield self.wait_for(lambda: not cabin.connected)
+
+        health = yield self.get("health")
+        self.assertEqual([True, False], [h['connected'] for h in health])
+        self.assertEqual("stream closed", health[1]['last_error'])
+        self.assertEqual(1, health[1]['reconnects'])
+        # the last known state of its doors is still served
+        doors = yield self.get("cfg")
+        self.assertEqual(4, len(doors))
+
+#
+# python aggregator_test.py -v
+#
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+"""Queued alert dispatcher, fans out to every configured channel over persistent connections."""
+import json
+import logging
+import socket
+import threading
+import urllib
+import metrics as Metrics
+import startup as Startup
+
+from twisted.internet import reactor
+
+# only imported once the first alert goes out
+httplib = Startup.LazyModule('httplib')
+smtplib = Startup.LazyModule('smtplib')
+mime_text = Startup.LazyModule('email.mime.text')
+
+SEND_SECONDS = Metrics.histogram('gdc_alert_send_seconds', 'Time to deliver an alert', ('channel',))
+SEND_FAILURES = Metrics.counter('gdc_alert_send_failures_total', 'Failed alert deliveries, retries included', ('channel',))
+
+SEND_TIMEOUT = 20
+
+
+class SmtpChannel(object):
+    name = 'smtp'
+    params = ("smtphost", "smtpport", "smtp_tls", "username", "password", "to_email")
+
+    def __init__(self, config):
+        self.config = config
+        self.server = None
+        self.lock = threading.Lock()
+
+    def connect(self):
+        config = self.config
+        server = smtplib.SMTP(config["smtphost"], config["smtpport"], timeout=SEND_TIMEOUT)
+        if (config["smtp_tls"] == True) :
+            server.starttls()
+            server.login(config["username"], config["password"])
+        self.server = server
+
+    def close(self):
+        if self.server == None:
+            return
+        try:
+            self.server.quit()
+        except:
+            self.server.close()
+        self.server = None
+
+    def deliver(self, message):
+        if self.server == None:
+            self.connect()
+        self.server.sendmail('from', self.config["to_email"], mime_text.MIMEText(message).as_string())
+
+    def send(self, message):
+        with self.lock:
+            try:
+                self.deliver(message)
+            except (smtplib.SMTPServerDisconnected, socket.error):
+                # the server dropped the idle session, log in again once
+                self.close()
+                self.deliver(message)
+
+
+class HttpsChannel(object):
+    host = None
+
+    def __init__(self, config):
+        self.config = config
+        self.conn = None
+        self.lock = threading.Lock()
+
+    def close(self):
+        if self.conn != None:
+            self.conn.close()
+            self.conn = None
+
+    def post(self, path, body, headers):
+        if self.conn == None:
+            self.conn = httplib.HTTPSConnection(self.host, 443, timeout=SEND_TIMEOUT)
+        self.conn.request("POST", path, body, headers)
+        response = self.conn.getresponse()
+        data = response.read()  # drain so the connection can be reused
+        if response.status != 200:
+            raise IOError("%s %s: %s" % (self.name, response.status, data))
+
+    def send(self, message):
+        with self.lock:
+            path, body, headers = self.build(message)
+            try:
+                self.post(path, body, headers)
+            except (httplib.HTTPException, socket.error):
+                # stale keep-alive connection, reconnect once
+                self.close()
+                self.post(path, body, headers)
+
+
+class PushoverChannel(HttpsChannel):
+    name = 'pushover'
+    params = ("user_key", "api_key")
+    host = "api.pushover.net"
+
+    def build(self, message):
+        return ("/1/messages.json",
+                urllib.urlencode({
+                    "token": self.config["api_key"],
+                    "user": self.config["user_key"],
+                    "title": 'Garage',
+                    "sound": 'pushover',
+                    "message": message,
+                }), { "Content-type": "application/x-www-form-urlencoded" })
+
+
+class PushbulletChannel(HttpsChannel):
+    name = 'pushbullet'
+    params = ("access_token",)
+    host = "api.pushbullet.com"
+
+    def build(self, message):
+        return ("/v2/pushes",
+                json.dumps({"type": "note", "title": 'Garage', "body": message}),
+                { "Access-Token": self.config["access_token"], "Content-type": "application/json" })
+
+
+CHANNELS = dict((c.name, c) for c in (SmtpChannel, PushoverChannel, PushbulletChannel))
+
+
+def get_channels(config, alert_type):
+    """channels for a comma separated alert_type, skipping the ones missing their config"""
+    channels = []
+    for name in (alert_type or "").split(","):
+        name = name.strip()
+        if name == "":
+            continue
+        if name not in CHANNELS:
+            logging.warning("Unknown alert type %s" % (name))
+            continue
+        c = CHANNELS[name]
+        if name not in config or not set(c.params) <= set(config[name]):
+            logging.warning("Alert type %s is missing its config %s" % (name, c.params))
+            continue
+        channels.append(c(config[name]))
+    return channels
+
+
+class AlertDispatcher(object):
+
+    def __init__(self, channels, workers, window=5.0, retries=3, backoff=2.0, clock=reactor):
+        self.channels = channels
+        self.workers = workers
+        self.window = window
+        self.retries = retries
+        self.backoff = backoff
+        self.clock = clock
+        self.pending = {}  # key -> messages waiting for the coalesce window
+
+    """queue message, messages with the same key within the window go out as one alert"""
+    def send(self, message, key=None):
+        if key in self.pending:
+            self.pending[key].append(message)
+            return
+        self.pending[key] = [message]
+        self.clock.callLater(self.window, self.flush, key)
+
+    def flush(self, key):
+        message = "\n".join(self.pending.pop(key, []))
+        if message == "":
+            return
+        for channel in self.channels:
+            self.deliver(channel, message, 0)
+
+    def deliver(self, channel, message, attempt):
+        d = self.workers.run('alert', self.timed_send, channel, message)
+        d.addErrback(self.failed, channel, message, attempt)
+        return d
+
+    def timed_send(self, channel, message):
+        with SEND_SECONDS.time(channel.name):
+            channel.send(message)
+
+    def failed(self, f, channel, message, attempt):
+        SEND_FAILURES.inc(channel.name)
+        if attempt >= self.retries:
+            logging.error("Error sending %s alert, giving up: %s" % (channel.name, f.getErrorMessage()))
+            return
+        delay = self.backoff * (2 ** attempt)
+        logging.warning("Error sending %s alert, retry in %ds: %s" % (channel.name, delay, f.getErrorMessage()))
+        self.clock.callLater(delay, self.deliver, channel, message, attempt + 1)
@@ -0,0 +1,74 @@
+import unittest
+import alerts as Alerts
+
+from twisted.internet import defer, task
+
+
+class FakeWorkers(object):
+    def run(self, name, f, *args, **kwargs):
+        return defer.maybeDeferred(f, *args, **kwargs)
+
+
+class FakeChannel(object):
+    name = 'fake'
+
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.sent = []
+
+    def send(self, message):
+        if self.failures > 0:
+            self.failures -= 1
+            raise IOError("down")
+        self.sent.append(message)
+
+
+class Test(unittest.TestCase):
+
+    def setup(self, channels):
+        self.clock = task.Clock()
+        return Alerts.AlertDispatcher(channels, FakeWorkers(), 5.0, 3, 2.0, self.clock)
+
+    def testCoalesceSameDoor(self):
+        channels = [FakeChannel(), FakeChannel()]
+        alerts = self.setup(channels)
+        alerts.send("2 Car is open", "right")
+        alerts.send("2 Car is still open", "right")
+        alerts.send("2 Car was closed", "right")
+        alerts.send("1 Car is open", "left")
+        self.clock.advance(5)
+        for channel in channels:
+            self.assertEqual(["2 Car is open\n2 Car is still open\n2 Car was closed", "1 Car is open"], channel.sent)
+
+    def testRetryWithBackoff(self):
+        channel = FakeChannel(2)
+        alerts = self.setup([channel])
+        alerts.send("2 Car is open", "right")
+        self.clock.advance(5)
+        self.assertEqual([], channel.sent)
+        self.clock.advance(2)
+        self.assertEqual([], channel.sent)
+        self.clock.advance(4)
+        self.assertEqual(["2 Car is open"], channel.sent)
+
+    def testGiveUp(self):
+        channel = FakeChannel(10)
+        alerts = self.setup([channel])
+        alerts.send("2 Car is open")
+        self.clock.pump([5, 2, 4, 8, 16, 32])
+        self.assertEqual([], channel.sent)
+        self.assertEqual(6, channel.failures)
+
+    def testGetChannels(self):
+        config = {"smtp": {"smtphost": "smtp.gmail.com"},
+                  "pushover": {"user_key": "u", "api_key": "a"},
+                  "pushbullet": {"access_token": "t"}}
+        channels = Alerts.get_channels(config, "smtp, pushover,pushbullet,sms")
+        self.assertEqual(["pushover", "pushbullet"], [c.name for c in channels])
+        self.assertEqual([], Alerts.get_channels(config, None))
+
+#
+# python alerts_test.py -v
+#
+if __name__ == '__main__':
+    unittest.main()
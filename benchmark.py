@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+"""Benchmark the db_utils queries and http handlers against synthetic gdc_data databases.
+
+ex. python benchmark.py --rows 10000,1000000 --out bench.json --compare bench_previous.json
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import resource
+import sqlite3
+import subprocess
+import sys
+import timeit
+
+import db_schema as db_Schema
+import db_utils as db_Utils
+import utils as Utils
+
+DEFAULT_ROWS = "10000,1000000,10000000"
+DEFAULT_DIR = "/tmp/gdc-bench"
+DOOR_NAME = "2 Car"
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def synthetic_rows(rows, interval):
+    """gdc_data rows ending now: garage and shed temperatures every interval secs,
+    an open/close cycle of the door every 4 hours and one weather day_temperature per day"""
+    per_hour = 2 * 3600.0 / interval + 0.5 + 1 / 24.0
+    now = datetime.datetime.now().replace(microsecond=0)
+    t = now - datetime.timedelta(hours=int(rows / per_hour) + 1)
+    step = datetime.timedelta(seconds=interval)
+    n = 0
+    while n < rows:
+        ts = t.strftime(TIME_FORMAT)
+        temp = 60 + 25 * ((t.hour - 12) / 12.0) ** 2
+        for event, value in (("garage_temperature", temp), ("shed_temperature", temp - 8)):
+            yield (ts, event, '{ "date":"%s", "temperature_f":%.1f, "humidity":40.0 }' % (ts, value), round(value, 1))
+        n += 2
+        if t.minute * 60 + t.second < interval:
+            if t.hour % 4 == 0:
+                closed = (t + datetime.timedelta(minutes=7)).strftime(TIME_FORMAT)
+                yield (ts, DOOR_NAME, Utils.OPENING, 0)
+                yield (closed, DOOR_NAME, Utils.CLOSED, 0)
+                n += 2
+            if t.hour == 0:
+                day = {"date": t.strftime('%Y-%m-%d'), "avghumidity": 40, "avgtemp_f": 55.0, "mintemp_f": 40.0, "maxtemp_f": 70.0}
+                yield (ts, "day_temperature", json.dumps(day), 55.0)
+                n += 1
+        t += step
+
+
+def build_db(path, rows, interval):
+    if os.path.exists(path):
+        return
+    print "Generating %s (%d rows)" % (path, rows)
+    tmp = path + ".tmp"
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    conn = sqlite3.connect(tmp)
+    conn.execute("PRAGMA journal_mode=OFF")
+    conn.execute("PRAGMA synchronous=OFF")
+    db_Schema.create_gdc_data(conn)
+    with conn:
+        conn.executemany("INSERT INTO gdc_data (_time, event, data, value) VALUES (?, ?, ?, ?)",
+                         synthetic_rows(rows, interval))
+    # indexes and rollups are built the way an existing db gets upgraded
+    db_Schema.migrate(conn)
+
+    # todays weather is already stored, so the graph queries make no outbound calls
+    today = datetime.datetime.now().strftime('%Y-%m-%d')
+    with conn:
+        conn.execute("INSERT OR REPLACE INTO gdc_weather_day VALUES (?, ?, ?, 1)",
+                     (today, json.dumps({"date": today, "avgtemp_f": 55.0}), Utils.get_time()))
+    conn.close()
+    os.rename(tmp, path)
+
+
+class BenchController(object):
+    """just enough of controller.Controller for the handlers and queries"""
+
+    def __init__(self):
+        self.weather_max_age = 1e9
+        self.doors = []
+
+
+class BenchRequest(object):
+    def __init__(self):
+        self.args = {}
+        self.headers = {}
+
+    def setHeader(self, name, value):
+        self.headers[name] = value
+
+
+def handler_cases(controller):
+    import controller as ControllerModule
+    import door as Doors
+    # replaced rather than appended to, cases() runs once per database size
+    controller.doors = []
+    for i in range(4):
+        door = Doors.Door("door%d" % (i), {'id': "%d Car" % (i), 'relay_pin': 0, 'state_pin': 0, 'closed_value': 1})
+        door.state = Utils.CLOSED
+        controller.doors.append(door)
+
+    graph = ControllerModule.ClickGraphHandler(controller)
+    temps = ControllerModule.TempsHandler(controller)
+    config = ControllerModule.ConfigHandler(controller)
+    return [
+        # the graph handler's uncached computation, the response cache would hide it
+        ("handler_graph", lambda: graph.graph(["garage_temperature"])),
+        ("handler_temps", lambda: temps.render(BenchRequest())),
+        ("handler_cfg", lambda: config.render(BenchRequest())),
+    ]
+
+
+def cases(controller, handlers):
+    c = [
+        ("query_temperature_data", lambda: db_Utils.query_temperature_data(["garage_temperature"], controller)),
+        ("query_garage_open_close", lambda: db_Utils.query_garage_open_close([DOOR_NAME])),
+        ("query_door_stats", lambda: db_Utils.query_door_stats([DOOR_NAME], 365)),
+        ("query_temperatures", lambda: db_Utils.query_temperatures(["garage_temperature", "shed_temperature"], 75)),
+    ]
+    if handlers:
+        c += handler_cases(controller)
+    return c
+
+
+def percentile(sorted_values, p):
+    return sorted_values[min(len(sorted_values) - 1, int(round(p / 100.0 * (len(sorted_values) - 1))))]
+
+
+def measure(f, iterations):
+    f()  # warm up the connection and statement cache
+    times = []
+    for i in range(iterations):
+        start = timeit.default_timer()
+        f()
+        times.append((timeit.default_timer() - start) * 1000.0)
+    times.sort()
+    return {"iterations": iterations,
+            "p50_ms": percentile(times, 50),
+            "p90_ms": percentile(times, 90),
+            "p99_ms": percentile(times, 99),
+            "max_ms": times[-1],
+            "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+
+
+def run_case(path, name, f, iterations):
+    """run a case in a forked child so its peak memory is its own"""
+    r, w = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(r)
+        try:
+            db_Utils.db.open(path)
+            result = measure(f, iterations)
+        except Exception as e:
+            result = {"error": str(e)}
+        os.write(w, json.dumps(result))
+        os._exit(0)
+
+    os.close(w)
+    data = ""
+    while True:
+        chunk = os.read(r, 65536)
+        if chunk == "":
+            break
+        data += chunk
+    os.close(r)
+    os.waitpid(pid, 0)
+    return json.loads(data)
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"]).strip()
+    except Exception:
+        return None
+
+
+def compare(results, previous, threshold):
+    print "\n%-10s %-26s %10s %10s %8s" % ("rows", "case", "p50 prev", "p50 now", "ratio")
+    regressions = 0
+    for rows, cases in sorted(results["results"].items()):
+        for name, now in sorted(cases.items()):
+            prev = previous.get("results", {}).get(rows, {}).get(name)
+            if prev == None or "p50_ms" not in prev or "p50_ms" not in now:
+                continue
+            ratio = now["p50_ms"] / max(prev["p50_ms"], 0.001)
+            flag = " <-- regression" if ratio > threshold else ""
+            regressions += 1 if flag else 0
+            print "%-10s %-26s %10.2f %10.2f %7.2fx%s" % (rows, name, prev["p50_ms"], now["p50_ms"], ratio, flag)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="gdc database and handler benchmarks")
+    parser.add_argument("--rows", default=DEFAULT_ROWS, help="comma separated db sizes")
+    parser.add_argument("--dir", default=DEFAULT_DIR, help="where the synthetic dbs are kept")
+    parser.add_argument("--interval", type=int, default=600, help="secs between synthetic temperature readings")
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--no-handlers", action="store_true", help="skip the handlers (no twisted/RPi needed)")
+    parser.add_argument("--out", help="write the results as json")
+    parser.add_argument("--compare", help="previous results json to compare against")
+    parser.add_argument("--threshold", type=float, default=1.25, help="p50 ratio reported as a regression")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.dir):
+        os.makedirs(args.dir)
+
+    controller = BenchController()
+    results = {"commit": git_commit(), "time": Utils.get_date_time().strftime(Utils.DATEFORMAT),
+               "python": platform.python_version(), "sqlite": sqlite3.sqlite_version,
+               "machine": platform.machine(), "results": {}}
+
+    for rows in [int(r) for r in args.rows.split(",")]:
+        path = os.path.join(args.dir, "gdc-%d.db" % (rows))
+        build_db(path, rows, args.interval)
+        results["results"][str(rows)] = {}
+        for name, f in cases(controller, not args.no_handlers):
+            result = run_case(path, name, f, args.iterations)
+            results["results"][str(rows)][name] = result
+            if "error" in result:
+                print "%-10d %-26s error %s" % (rows, name, result["error"])
+            else:
+                print "%-10d %-26s p50 %8.2fms p90 %8.2fms p99 %8.2fms peak %7dKB" % (
+                    rows, name, result["p50_ms"], result["p90_ms"], result["p99_ms"], result["peak_rss_kb"])
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            if compare(results, json.load(f), args.threshold) > 0:
+                sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
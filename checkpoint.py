@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+"""Keep the full state of every door in a small json file, so a restart resumes instead of starting over.
+
+Changes within flush_interval are written together, to a temp file that is fsynced and renamed over the
+checkpoint, so a crash leaves the previous or the new checkpoint and never half of one.
+"""
+import json
+import logging
+import os
+import threading
+import time
+
+from twisted.internet import reactor
+
+CHECKPOINT_PATH = 'doorState.json'
+FLUSH_INTERVAL = 1.0
+MAX_AGE = 900  # secs, an older checkpoint is too stale to resume from
+VERSION = 1
+
+
+class DoorCheckpoint(object):
+    def __init__(self, path=CHECKPOINT_PATH, workers=None, flush_interval=FLUSH_INTERVAL, max_age=MAX_AGE,
+                 clock=reactor, now=time.time):
+        self.path = path
+        self.workers = workers  # None writes on the calling thread
+        self.flush_interval = flush_interval
+        self.max_age = max_age
+        self.clock = clock
+        self.now = now
+        self.lock = threading.Lock()
+        self.doors = {}  # door id -> last checkpoint() of the door
+        self.seq = 0  # bumped on every change
+        self.written = 0  # seq of the checkpoint on disk
+        self.pending = None
+
+    """door id -> saved state, empty if there is no checkpoint or it is too old to trust"""
+    def load(self):
+        try:
+            with open(self.path) as f:
+                saved = json.load(f)
+        except IOError:
+            return {}
+        except ValueError as e:
+            logging.warning("Ignoring unreadable door checkpoint %s: %s" % (self.path, e))
+            return {}
+        age = self.now() - saved.get('saved_at', 0)
+        if saved.get('version') != VERSION or age > self.max_age:
+            logging.info("Ignoring door checkpoint %s, %.0fs old" % (self.path, age))
+            return {}
+        return saved['doors']
+
+    """record the door's current state, schedules a write if it changed"""
+    def update(self, door):
+        state = door.checkpoint()
+        if self.doors.get(door.id) == state:
+            return False
+        self.doors[door.id] = state
+        self.seq += 1
+        if self.pending == None or not self.pending.active():
+            self.pending = self.clock.callLater(self.flush_interval, self.flush)
+        return True
+
+    def snapshot(self):
+        return json.dumps({'version': VERSION, 'saved_at': self.now(), 'doors': self.doors}, separators=(',', ':'))
+
+    def flush(self):
+        if self.written == self.seq:
+            return None
+        if self.workers == None:
+            return self.write(self.seq, self.snapshot())
+        d = self.workers.run('checkpoint', self.write, self.seq, self.snapshot())
+        d.addErrback(lambda f: logging.error("Error writing door checkpoint %s: %s" % (self.path, f.getErrorMessage())))
+        return d
+
+    """worker thread, a write that finishes after a newer one is dropped"""
+    def write(self, seq, data):
+        with self.lock:
+            if seq <= self.written:
+                return False
+            tmp = self.path + '.tmp'
+            with open(tmp, 'w') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.rename(tmp, self.path)
+            # the rename itself is only durable once the directory is synced
+            fd = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            self.written = seq
+            return True
+
+    """write what is left now, for the shutdown trigger"""
+    def stop(self):
+        if self.pending != None and self.pending.active():
+            self.pending.cancel()
+        if self.written != self.seq:
+            self.write(self.seq, self.snapshot())
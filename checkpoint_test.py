@@ -0,0 +1,107 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import checkpoint as Checkpoint
+import door as Doors
+import utils as Utils
+
+from twisted.internet import task
+
+DOOR_CONFIG = {'id': '2 Car', 'relay_pin': 23, 'state_pin': 24, 'closed_value': 0}
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self.debugging = Utils.isDebugging
+        Utils.isDebugging = True
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'doorState.json')
+        self.clock = task.Clock()
+        self.time = 1000.0
+
+    def tearDown(self):
+        Utils.isDebugging = self.debugging
+        shutil.rmtree(self.dir)
+
+    def checkpoint(self):
+        return Checkpoint.DoorCheckpoint(self.path, None, 1.0, 900, self.clock, lambda: self.time)
+
+    def door(self, pin_state):
+        door = Doors.Door('right', DOOR_CONFIG)
+        door.test_state_pin = pin_state
+        door.setup(None, 0)
+        return door
+
+    def testWritesBatched(self):
+        c = self.checkpoint()
+        door = self.door(Utils.CLOSED)
+        self.assertTrue(c.update(door))
+        self.assertFalse(c.update(door))
+        door.tis[Utils.CLOSED] = 5
+        self.assertTrue(c.update(door))
+        self.assertFalse(os.path.exists(self.path))
+
+        self.clock.advance(1.0)
+        with open(self.path) as f:
+            saved = json.load(f)
+        self.assertEqual(5, saved['doors']['right']['tis'][Utils.CLOSED])
+        self.assertEqual(2, c.written)
+        self.assertFalse(os.path.exists(self.path + '.tmp'))
+
+    def testStaleWriteDropped(self):
+        c = self.checkpoint()
+        c.update(self.door(Utils.CLOSED))
+        self.assertTrue(c.write(2, '{"new":1}'))
+        self.assertFalse(c.write(1, '{"old":1}'))
+        with open(self.path) as f:
+            self.assertEqual('{"new":1}', f.read())
+
+    def testRestore(self):
+        c = self.checkpoint()
+        door = self.door(Utils.OPEN)
+        door.tis[Utils.OPEN] = 100
+        door.tis[Utils.STILLOPEN] = 200
+        door.send_open_im = False
+        door.send_open_mqtt = False
+        c.update(door)
+        c.stop()
+
+        self.time += 60
+        saved = self.checkpoint().load()
+        restarted = self.door(Utils.OPEN)
+        self.assertTrue(restarted.restore(saved['right']))
+        self.assertEqual(Utils.OPEN, restarted.state)
+        self.assertEqual(100, restarted.tis[Utils.OPEN])
+        self.assertEqual(200, restarted.tis[Utils.STILLOPEN])
+        self.assertFalse(restarted.send_open_im)
+        self.assertFalse(restarted.send_open_mqtt)
+
+    def testDoorMovedWhileDown(self):
+        c = self.checkpoint()
+        door = self.door(Utils.OPEN)
+        c.update(door)
+        c.stop()
+
+        restarted = self.door(Utils.CLOSED)
+        self.assertFalse(restarted.restore(self.checkpoint().load()['right']))
+        self.assertEqual(Utils.CLOSED, restarted.state)
+
+    def testStaleOrMissing(self):
+        self.assertEqual({}, self.checkpoint().load())
+        c = self.checkpoint()
+        c.update(self.door(Utils.CLOSED))
+        c.stop()
+        self.time += 901
+        self.assertEqual({}, self.checkpoint().load())
+        with open(self.path, 'w') as f:
+            f.write('{"version":')
+        self.assertEqual({}, self.checkpoint().load())
+
+#
+# python checkpoint_test.py -v
+#
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+"""Roll old raw temperature readings into hourly aggregates and prune them, off the reactor thread.
+
+Raw readings older than raw_age days become gdc_hourly_temperature rows, hourly rows older than
+hourly_age days are dropped (gdc_daily_temperature keeps every day). Door events are never touched.
+"""
+import datetime
+import logging
+import sqlite3
+import time
+
+import db_schema as db_Schema
+
+from twisted.internet import reactor, task
+
+RAW_AGE = 30  # days
+HOURLY_AGE = 365  # days
+BATCH_SIZE = 1000  # rows per transaction
+PAUSE = 0.05  # secs between transactions, so the ingest writer gets its turn
+INTERVAL = 24 * 60 * 60
+VACUUM_PAGES = 2000  # incremental_vacuum pages per step
+
+
+def is_number(value):
+    try:
+        float(value)
+        return True
+    except (TypeError, ValueError):
+        return False
+
+
+def hourly_rollup(rows):
+    """{hour: [min, max, sum, count]} for (time, value) rows, readings that aren't numbers are skipped"""
+    hours = {}
+    for t, value in rows:
+        if not is_number(value):
+            continue
+        value = float(value)
+        h = hours.get(t[:13])
+        if h == None:
+            hours[t[:13]] = [value, value, value, 1]
+        else:
+            h[0] = min(h[0], value)
+            h[1] = max(h[1], value)
+            h[2] += value
+            h[3] += 1
+    return dict((hour + ":00:00", h) for hour, h in hours.items())
+
+
+class Compactor(object):
+    def __init__(self, path, workers, raw_age=RAW_AGE, hourly_age=HOURLY_AGE, batch_size=BATCH_SIZE,
+                 pause=PAUSE, interval=INTERVAL, clock=reactor, now=datetime.datetime.now):
+        self.path = path
+        self.workers = workers
+        self.raw_age = raw_age
+        self.hourly_age = hourly_age
+        self.batch_size = batch_size
+        self.pause = pause
+        self.interval = interval
+        self.clock = clock
+        self.now = now
+        self.running = False
+
+    def start(self):
+        self.loop = task.LoopingCall(self.run)
+        self.loop.clock = self.clock
+        self.loop.start(self.interval, now=False)
+
+    def run(self):
+        if self.running:
+            return None
+        self.running = True
+        d = self.workers.run('compact', self.compact)
+        d.addErrback(lambda f: logging.error("Error compacting gdc db: %s" % f.getErrorMessage()))
+
+        def done(result):
+            self.running = False
+            return result
+        return d.addBoth(done)
+
+    def cutoff(self, days):
+        return (self.now() - datetime.timedelta(days=days)).strftime('%Y-%m-%d 00:00:00')
+
+    """worker thread, returns (raw rows pruned, hourly rows pruned)"""
+    def compact(self):
+        start = time.time()
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            self.enable_incremental_vacuum(conn)
+            raw = 0
+            for event in self.temperature_events(conn):
+                raw += self.compact_event(conn, event, self.cutoff(self.raw_age))
+            hourly = self.prune_hourly(conn, self.cutoff(self.hourly_age))
+            if raw + hourly > 0:
+                self.vacuum(conn)
+            logging.info("Compacted gdc db in %.1fs: %d raw readings rolled up, %d hourly rows pruned" %
+                         (time.time() - start, raw, hourly))
+            return (raw, hourly)
+        finally:
+            conn.close()
+
+    def enable_incremental_vacuum(self, conn):
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            return
+        # only takes effect with a full VACUUM, once
+        logging.info("Switching gdc db to incremental vacuum, running a full VACUUM once")
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+
+    def temperature_events(self, conn):
+        events = [row[0] for row in conn.execute("SELECT DISTINCT event FROM gdc_data")]
+        return [e for e in events if e != None and e.endswith("_temperature") and e != "day_temperature"]
+
+    def compact_event(self, conn, event, cutoff):
+        cols = db_Schema.gdc_data_columns(conn)
+        select = "SELECT id, _time, %s FROM gdc_data WHERE event = ? AND _time < ? ORDER BY _time LIMIT ?" % (cols[4])
+        total = 0
+        batches = 0
+        while True:
+            # rollup and prune of a batch commit together, so no reading is counted twice or lost
+            with conn:
+                rows = conn.execute(select, (event, cutoff, self.batch_size)).fetchall()
+                if rows == []:
+                    break
+                for hour, (lo, hi, total_value, count) in hourly_rollup([(r[1], r[2]) for r in rows]).items():
+                    conn.execute("INSERT OR IGNORE INTO gdc_hourly_temperature VALUES (?, ?, ?, ?, 0, 0)", (event, hour, lo, hi))
+                    conn.execute("""UPDATE gdc_hourly_temperature
+                        SET min = MIN(min, ?), max = MAX(max, ?), mean = (mean * count + ?) / (count + ?), count = count + ?
+                        WHERE event = ? AND hour = ?""", (lo, hi, total_value, count, count, event, hour))
+                conn.executemany("DELETE FROM gdc_data WHERE id = ?", [(r[0],) for r in rows])
+            total += len(rows)
+            batches += 1
+            if batches % 50 == 0:
+                logging.info("Compacting %s: %d readings before %s rolled up so far" % (event, total, cutoff))
+            time.sleep(self.pause)
+        if total > 0:
+            logging.info("Compacted %s: %d readings before %s rolled up into hours" % (event, total, cutoff))
+        return total
+
+    def prune_hourly(self, conn, cutoff):
+        total = 0
+        while True:
+            with conn:
+                keys = conn.execute("SELECT event, hour FROM gdc_hourly_temperature WHERE hour < ? LIMIT ?",
+                                    (cutoff, self.batch_size)).fetchall()
+                conn.executemany("DELETE FROM gdc_hourly_temperature WHERE event = ? AND hour = ?", keys)
+            if keys == []:
+                return total
+            total += len(keys)
+            time.sleep(self.pause)
+
+    def vacuum(self, conn):
+        before = free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        while free > 0:
+            conn.execute("PRAGMA incremental_vacuum(%d)" % (VACUUM_PAGES)).fetchall()
+            left = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if left >= free:
+                break
+            free = left
+            time.sleep(self.pause)
+        logging.info("Incremental vacuum released %d of %d free pages" % (before - free, before))
@@ -0,0 +1,84 @@
+import datetime
+import os
+import sqlite3
+import tempfile
+import unittest
+import compactor as Compactor
+import db_schema as db_Schema
+
+from twisted.internet import defer
+
+
+class FakeWorkers(object):
+    def run(self, name, f, *args, **kwargs):
+        return defer.maybeDeferred(f, *args, **kwargs)
+
+
+NOW = datetime.datetime(2020, 12, 31, 12, 0, 0)
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+        self.conn = sqlite3.connect(self.path)
+        db_Schema.migrate(self.conn)
+
+    def tearDown(self):
+        self.conn.close()
+        os.remove(self.path)
+
+    def insert(self, rows):
+        with self.conn:
+            self.conn.executemany("INSERT INTO gdc_data (_time, event, data, value) VALUES (?, ?, '', ?)", rows)
+
+    def compact(self, **kwargs):
+        c = Compactor.Compactor(self.path, FakeWorkers(), raw_age=30, hourly_age=365, batch_size=2, pause=0,
+                                now=lambda: NOW, **kwargs)
+        return c.compact()
+
+    def testHourlyRollup(self):
+        rollup = Compactor.hourly_rollup([("2020-10-10 10:05:00", 60), ("2020-10-10 10:55:00", "70.0"),
+                                          ("2020-10-10 10:56:00", "error reading"), ("2020-10-10 11:00:00", 50)])
+        self.assertEqual({"2020-10-10 10:00:00": [60.0, 70.0, 130.0, 2], "2020-10-10 11:00:00": [50.0, 50.0, 50.0, 1]}, rollup)
+
+    def testCompactsOldTemperaturesOnly(self):
+        self.insert([("2020-10-10 10:05:00", "garage_temperature", 60),
+                     ("2020-10-10 10:15:00", "garage_temperature", 62),
+                     ("2020-10-10 10:25:00", "garage_temperature", 64),
+                     ("2020-10-10 11:05:00", "garage_temperature", 70),
+                     ("2020-10-10 10:05:00", "shed_temperature", 50),
+                     ("2020-10-10 10:06:00", "2 Car", 0),
+                     ("2020-10-10 10:07:00", "day_temperature", 55),
+                     ("2020-12-30 10:05:00", "garage_temperature", 40)])
+        self.assertEqual((5, 0), self.compact())
+
+        self.assertEqual([("2 Car",), ("day_temperature",), ("garage_temperature",)],
+                         self.conn.execute("SELECT event FROM gdc_data ORDER BY event").fetchall())
+        self.assertEqual([("garage_temperature", "2020-10-10 10:00:00", 60.0, 64.0, 62.0, 3),
+                          ("garage_temperature", "2020-10-10 11:00:00", 70.0, 70.0, 70.0, 1),
+                          ("shed_temperature", "2020-10-10 10:00:00", 50.0, 50.0, 50.0, 1)],
+                         self.conn.execute("SELECT * FROM gdc_hourly_temperature ORDER BY event, hour").fetchall())
+        # the daily rollup still has every reading
+        self.assertEqual(4, self.conn.execute("SELECT count FROM gdc_daily_temperature WHERE event = 'garage_temperature' "
+                                              "AND day = '2020-10-10'").fetchone()[0])
+        self.assertEqual(2, self.conn.execute("PRAGMA auto_vacuum").fetchone()[0])
+
+    def testHourlyPruned(self):
+        with self.conn:
+            self.conn.executemany("INSERT INTO gdc_hourly_temperature VALUES ('garage_temperature', ?, 1, 1, 1, 1)",
+                                  [("2019-01-01 %02d:00:00" % h,) for h in range(5)] + [("2020-06-01 00:00:00",)])
+        self.assertEqual((0, 5), self.compact())
+        self.assertEqual(1, self.conn.execute("SELECT COUNT(*) FROM gdc_hourly_temperature").fetchone()[0])
+
+    def testRunsOnce(self):
+        c = Compactor.Compactor(self.path, FakeWorkers(), now=lambda: NOW)
+        c.running = True
+        self.assertEqual(None, c.run())
+
+#
+# python compactor_test.py -v
+#
+if __name__ == '__main__':
+    unittest.main()
@@ -1,35 +1,93 @@
 #!/usr/bin/env python
 """Software to monitor and control garage doors via a raspberry pi."""
+import startup as Startup
 import datetime
-import httplib
 import json
 import logging
 import logging.handlers
 import time
-import smtplib
 import sys
 import urllib
-import RPi.GPIO as gpio
 import utils as Utils
 import db_utils as db_Utils
+import db_schema as db_Schema
 import door as Doors
-import requests
+import response_cache as ResponseCache
+import workers as Workers
+import alerts as Alerts
+import mqtt_client as MqttClient
+import log_tail as LogTail
+import event_ring as EventRing
+import static_assets as StaticAssets
+import metrics as Metrics
+import profiler as Profiler
+import export as Export
+import temperature_sampler as TemperatureSampler
+import ingest as Ingest
+import compactor as Compactor
+import checkpoint as Checkpoint
 import threading
 import os
+import signal
 
 from datetime import timedelta
-from email.mime.text import MIMEText
-from fcache.cache import FileCache
-from twisted.cred import portal
-from twisted.internet import reactor, protocol
-from twisted.internet import ssl
+from twisted.cred import checkers, portal
+from twisted.internet import reactor, protocol, defer
 from twisted.internet import task
 from twisted.web import server
 from twisted.web.guard import HTTPAuthSessionWrapper, BasicCredentialFactory
-from twisted.web.static import File
-from twisted.web.resource import Resource, IResource
+from twisted.web.resource import Resource, IResource, EncodingResourceWrapper
 from zope.interface import implements
 
+CHECK_STATUS_SECONDS = Metrics.histogram('gdc_check_status_seconds', 'Time to check the state of every door')
+CHECK_DOOR_STATUS_SECONDS = Metrics.histogram('gdc_check_door_status_seconds', 'Time to check the state of one door')
+MQTT_PUBLISH_SECONDS = Metrics.histogram('gdc_mqtt_publish_seconds', 'Time to hand a message to the mqtt client')
+MQTT_QUEUED = Metrics.counter('gdc_mqtt_queued_total', 'Messages queued while the broker was unreachable')
+
+# imported on first use, after the port is bound
+gpio = Startup.LazyModule('RPi.GPIO')
+requests = Startup.LazyModule('requests')
+
+def gzipped(resource):
+    """gzip the response when the client accepts it"""
+    return EncodingResourceWrapper(resource, [server.GzipEncoderFactory()])
+
+class ResourceRealm(object):
+    """hands the one wrapped resource to every authenticated user"""
+    implements(portal.IRealm)
+
+    def __init__(self, resource):
+        self.resource = resource
+
+    def requestAvatar(self, avatarId, mind, *interfaces):
+        if IResource in interfaces:
+            return (IResource, self.resource, lambda: None)
+        raise NotImplementedError()
+
+def authenticated(resource, username, password):
+    """basic auth in front of resource"""
+    checker = checkers.InMemoryUsernamePasswordDatabaseDontUse(**{str(username): str(password)})
+    return HTTPAuthSessionWrapper(portal.Portal(ResourceRealm(resource), [checker]), [BasicCredentialFactory('gdc')])
+
+def render_deferred(request, d):
+    """finish request with the result of d, returns NOT_DONE_YET for render()"""
+    finished = []
+    request.notifyFinish().addBoth(finished.append)
+
+    def send(body):
+        if not finished:
+            request.write(body)
+            request.finish()
+
+    def error(f):
+        logging.error("Error rendering %s: %s" % (request.uri, f.getErrorMessage()))
+        if not finished:
+            request.setResponseCode(500)
+            request.finish()
+
+    d.addCallbacks(send, error)
+    return server.NOT_DONE_YET
+
 class CloseAllHandler(Resource):
     isLeaf = True
 
@@ -37,6 +95,7 @@ class CloseAllHandler(Resource):
         Resource.__init__(self)
         self.controller = controller
 
+    @Metrics.timed_render
     def render(self, request):
         if self.controller.close_all():
             return ''
@@ -50,12 +109,13 @@ class GetTempHandler(Resource):
         Resource.__init__(self)
         self.controller = controller
 
-    def render(self, request):
-        temp = Utils.get_temperature(Utils.temperature_pin)
-        json_object = json.loads(temp)
-        json_formatted_str = json.dumps(json_object, indent=2)
+    def format(self, current_temp_json):
+        reading = self.controller.sampler.latest
+        if reading != None:
+            json_formatted_str = json.dumps(json.loads(reading.to_json()), indent=2)
+        else:
+            json_formatted_str = "No temperature reading yet"
 
-        current_temp_json = Utils.get_current_temperature_from_weatherapi(requests, controller, "Riverton")
         localtime = str(current_temp_json["current"]["last_updated"])
         feels_like = str(current_temp_json["current"]["feelslike_f"])
         condition = str(current_temp_json["current"]["condition"]["text"])
@@ -73,6 +133,13 @@ class GetTempHandler(Resource):
         curr_weather = '<table><tr><td>As of {}</td></tr><tr><td><b>{}</b></td></tr><tr><td><h2>{}F </h2></td></tr><tr><td><i>Feels like {}F </i>{}</td><td>{}</td></tr><tr><td>Wind:{}mph {}</td><td>Humidity: {}%</td></tr><tr><td>UV: {}</td><td>Visibility: {}miles</td></tr></table>'.format(localtime, locationName+", "+locationState, temp_f, feels_like, condition,im, wind_mph, wind_dir, humidity, uv, vis_miles)
         return "<html><body>%s<pre>Garage</pre><pre>%s</pre><pre>Current Weather</pre><pre>%s</pre></body></html>" % (curr_weather,json_formatted_str,current_temp_json_formatted)
 
+    @Metrics.timed_render
+    def render(self, request):
+        # the garage temperature is the sampler's latest filtered value, only the weather is fetched
+        d = self.controller.workers.run('weather', Utils.get_current_temperature_from_weatherapi, requests, self.controller, "Riverton")
+        d.addCallback(self.format)
+        return render_deferred(request, d)
+
 class TempsHandler(Resource):
     isLeaf = True
 
@@ -80,6 +147,7 @@ class TempsHandler(Resource):
         Resource.__init__(self)
         self.controller = controller
 
+    @Metrics.timed_render
     def render(self, request):
         events = ["garage_temperature", "shed_temperature"]
         data = db_Utils.query_temperatures(events, 75)
@@ -92,24 +160,42 @@ class LogHandler(Resource):
         Resource.__init__(self)
         self.controller = controller
 
-    def tail(self, filepath):
-        data_value = ""
-
-        try:
-            with open(filepath, "rb") as f:
-                loglines = f.readlines()[-60:]
-        except:
-            return "No log file found (%s)" % (filepath)
-
-        # reverse order, most recent at the top
-        for logline in reversed(loglines):
-            data_value += logline
-
-        return data_value
+    def get_arg(self, request, name, default=None):
+        if name in request.args:
+            return request.args[name][0]
+        return default
 
+    """?lines=N&before=<cursor>&level=WARNING&since=<epoch or YYYY-mm-dd HH:MM>, most recent at the top"""
+    @Metrics.timed_render
     def render(self, request):
-        logs = self.tail(self.controller.file_name).replace("<", "&lt")
-        return "<html><body><pre>%s</pre></body></html>" % (logs)
+        filepath = self.controller.file_name
+        try:
+            lines = LogTail.parse_lines(self.get_arg(request, 'lines', 60))
+        except ValueError as e:
+            request.setResponseCode(400)
+            return "Invalid parameter: %s" % (str(e).replace("<", "&lt;"))
+        args = dict((name, self.get_arg(request, name)) for name in ('level', 'since'))
+
+        request.write("<html><body><pre>")
+        cursor = None
+        count = 0
+        try:
+            for cursor, record in LogTail.tail(filepath, lines, self.get_arg(request, 'before'), args['level'], args['since']):
+                request.write("\n".join(record).replace("<", "&lt;") + "\n")
+                count += 1
+        except IOError:
+            request.write("No log file found (%s)" % (filepath))
+        except ValueError as e:
+            request.write("Invalid parameter: %s" % (str(e).replace("<", "&lt;")))
+        request.write("</pre>")
+
+        if count == lines:
+            args = dict((k, v) for (k, v) in args.items() if v != None)
+            args.update({'lines': lines, 'before': cursor})
+            request.write('<a href="log?%s">older</a>' % (urllib.urlencode(args)))
+        request.write("</body></html>")
+        request.finish()
+        return server.NOT_DONE_YET
 
 class ClickHandler(Resource):
     isLeaf = True
@@ -118,6 +204,7 @@ class ClickHandler(Resource):
         Resource.__init__(self)
         self.controller = controller
 
+    @Metrics.timed_render
     def render(self, request):
         d = request.args['id'][0]
         door = self.controller.get_door(d)
@@ -131,12 +218,17 @@ class ClickWeatherHandler(Resource):
         Resource.__init__(self)
         self.controller = controller
 
-    def render(self, request):
-        Utils.query_weather_API(requests, controller)
+    def weather(self):
+        Utils.query_weather_API(requests, self.controller)
         weather_info = db_Utils.query_day_temperature_data() 
         json_object = json.loads(weather_info)
-        json_formatted_str = json.dumps(json_object, indent=2)
-        return json_formatted_str
+        return json.dumps(json_object, indent=2)
+
+    @Metrics.timed_render
+    def render(self, request):
+        compute = lambda: self.controller.workers.run('weather', self.weather)
+        d = self.controller.responseCache.get('weather', self.controller.weather_ttl, compute, ["day_temperature"])
+        return render_deferred(request, d)
         
 class ClickGraphShedHandler(Resource):
     isLeaf = True
@@ -144,11 +236,15 @@ class ClickGraphShedHandler(Resource):
         Resource.__init__(self)
         self.controller = controller
 
+    def graph(self, events):
+        return json.dumps(db_Utils.query_temperature_data(events, self.controller))
+
+    @Metrics.timed_render
     def render(self, request):
         events = ["shed_temperature"]
-        data = db_Utils.query_temperature_data(events, controller) 
         request.setHeader('Content-Type', 'application/json')
-        return json.dumps(data)
+        d = self.controller.responseCache.get('graphshed', self.controller.graph_ttl, lambda: self.controller.workers.run('db', self.graph, events), events)
+        return render_deferred(request, d)
 
 class ClickGraphHandler(Resource):
     isLeaf = True
@@ -157,11 +253,15 @@ class ClickGraphHandler(Resource):
         Resource.__init__(self)
         self.controller = controller
 
+    def graph(self, events):
+        return json.dumps(db_Utils.query_temperature_data(events, self.controller))
+
+    @Metrics.timed_render
     def render(self, request):
         events = ["garage_temperature"]
-        data = db_Utils.query_temperature_data(events, controller) 
         request.setHeader('Content-Type', 'application/json')
-        return json.dumps(data)
+        d = self.controller.responseCache.get('graph', self.controller.graph_ttl, lambda: self.controller.workers.run('db', self.graph, events), events)
+        return render_deferred(request, d)
 
 class ClickOpenCloseHandler(Resource):
     isLeaf = True
@@ -170,10 +270,40 @@ class ClickOpenCloseHandler(Resource):
         Resource.__init__(self)
         self.controller = controller
 
+    @Metrics.timed_render
     def render(self, request):
-        data = db_Utils.query_garage_open_close()
+        try:
+            data = db_Utils.query_garage_open_close([d.name for d in self.controller.doors])
+        except Exception as e:
+            logging.error("Error rendering %s: %s" % (request.uri, e))
+            request.setResponseCode(500)
+            return "Error reading door sessions"
         d = data.replace("<", "&lt")
-        return "<html><body><pre>%s</pre></body></html>" % (d)
+        # the times come back from sqlite as unicode, request.write only takes bytes
+        return ("<html><body><pre>%s</pre></body></html>" % (d)).encode('utf-8')
+
+class DoorStatsHandler(Resource):
+    isLeaf = True
+
+    def __init__ (self, controller):
+        Resource.__init__(self)
+        self.controller = controller
+
+    """?door=<name>&days=30, open/close statistics from gdc_door_session"""
+    @Metrics.timed_render
+    def render(self, request):
+        doors = request.args.get('door', [d.name for d in self.controller.doors])
+        try:
+            days = int(request.args.get('days', [30])[0])
+            if days <= 0:
+                raise ValueError("days must be positive, not %d" % (days))
+        except ValueError as e:
+            request.setResponseCode(400)
+            return str(e)
+        request.setHeader('Content-Type', 'application/json')
+        d = self.controller.workers.run('db', db_Utils.query_door_stats, doors, days)
+        d.addCallback(json.dumps)
+        return render_deferred(request, d)
 
 class ClickMotionTestHandler(Resource):
     isLeaf = True
@@ -188,6 +318,7 @@ class ClickMotionTestHandler(Resource):
                 return True
         return False
 
+    @Metrics.timed_render
     def render(self, request):
         msg = "All doors are closed"
         if self.is_doors_open(self.controller):
@@ -196,17 +327,129 @@ class ClickMotionTestHandler(Resource):
         
         return "<html><body><pre>%s</pre></body></html>" % (msg)
 
+EXPORT_TIERS = {'raw': db_Utils.build_export_sql, 'hourly': db_Utils.build_hourly_export_sql}
+
+class ExportHandler(Resource):
+    isLeaf = True
+    def __init__ (self, controller):
+        Resource.__init__(self)
+        self.controller = controller
+
+    """?event=garage_temperature,shed_temperature&from=2020-01-01&to=2021-01-01 12:00&format=csv|ndjson&tier=raw|hourly,
+    tier=hourly exports the hourly rollups db.compact keeps of readings older than raw_age days"""
+    @Metrics.timed_render
+    def render(self, request):
+        args = request.args
+        format = args.get('format', ['csv'])[0]
+        tier = args.get('tier', ['raw'])[0]
+        events = [e for value in args.get('event', []) for e in value.split(',') if e != '']
+        try:
+            if format not in Export.FORMATS:
+                raise ValueError("invalid format %s" % (format))
+            time_from = Export.parse_time(args.get('from', [None])[0])
+            time_to = Export.parse_time(args.get('to', [None])[0])
+            if tier not in EXPORT_TIERS:
+                raise ValueError("invalid tier %s" % (tier))
+        except ValueError as e:
+            request.setResponseCode(400)
+            return str(e)
+
+        sql, params = EXPORT_TIERS[tier](events, time_from, time_to)
+        f = Export.FORMATS[format]()
+        request.setHeader('Content-Type', f.content_type)
+        if tier == 'raw' and self.controller.compactor != None:
+            # temperature readings before this are only in tier=hourly
+            request.setHeader('X-Downsampled-Before', self.controller.compactor.cutoff(self.controller.compactor.raw_age))
+        request.setHeader('Content-Disposition', 'attachment; filename="gdc.%s"' % (f.extension))
+        Export.ExportProducer(request, db_Utils.db.path, sql, params, f, self.controller.workers,
+                              self.controller.export_chunk_rows).start()
+        return server.NOT_DONE_YET
+
 class ConfigHandler(Resource):
     isLeaf = True
     def __init__ (self, controller):
         Resource.__init__(self)
         self.controller = controller
 
+    """?since=<version> returns only the doors changed after it, with the current version"""
+    @Metrics.timed_render
     def render(self, request):
+        if 'since' in request.args:
+            registry = self.controller.registry
+            try:
+                since = int(request.args['since'][0])
+            except ValueError as e:
+                request.setResponseCode(400)
+                return str(e)
+            # a version from before a restart is ahead of ours, the client needs everything
+            doors = registry.changed_since(since) if since <= registry.version else self.controller.doors
+            request.setHeader('Content-Type', 'application/json')
+            return json.dumps({'version': registry.version,
+                               'doors': [(d.id, d.name, d.state, d.tis.get(d.state)) for d in doors]})
         request.setHeader('Content-Type', 'application/json')
         return json.dumps([(d.id, d.name, d.state, d.tis.get(d.state))
                            for d in self.controller.doors])
 
+class EventsHandler(Resource):
+    isLeaf = True
+    def __init__ (self, controller):
+        Resource.__init__(self)
+        self.controller = controller
+
+    """?since=<seq>, events newer than seq served from memory"""
+    @Metrics.timed_render
+    def render(self, request):
+        try:
+            since = int(request.args.get('since', [0])[0])
+        except ValueError as e:
+            request.setResponseCode(400)
+            return str(e)
+        events = self.controller.events.since(since)
+        request.setHeader('Content-Type', 'application/json')
+        return json.dumps({'seq': self.controller.events.seq, 'events': [e._asdict() for e in events]})
+
+class MetricsHandler(Resource):
+    isLeaf = True
+    def __init__ (self, controller):
+        Resource.__init__(self)
+
+    @Metrics.timed_render
+    def render(self, request):
+        request.setHeader('Content-Type', Metrics.CONTENT_TYPE)
+        return Metrics.REGISTRY.render()
+
+class ProfileHandler(Resource):
+    isLeaf = True
+    def __init__ (self, controller):
+        Resource.__init__(self)
+        self.controller = controller
+
+    """?seconds=N samples every thread for N secs, /profile/<name> downloads a finished profile"""
+    @Metrics.timed_render
+    def render(self, request):
+        profiler = self.controller.profiler
+        name = request.postpath[0] if request.postpath else ''
+        if name != '':
+            if name not in profiler.profiles():
+                request.setResponseCode(404)
+                return "No profile %s" % (name)
+            request.setHeader('Content-Type', 'text/plain')
+            request.setHeader('Content-Disposition', 'attachment; filename="%s"' % (name))
+            with open(os.path.join(profiler.path, name)) as f:
+                return f.read()
+
+        request.setHeader('Content-Type', 'application/json')
+        if 'seconds' in request.args:
+            try:
+                return json.dumps({'started': profiler.start(request.args['seconds'][0])})
+            except ValueError as e:
+                request.setResponseCode(400)
+                return json.dumps({'error': str(e)})
+            except RuntimeError as e:
+                request.setResponseCode(409)
+                return json.dumps({'error': str(e)})
+        return json.dumps({'running': profiler.running(), 'current': profiler.current, 'profiles': profiler.profiles()})
+
 class UptimeHandler(Resource):
     isLeaf = True
     def __init__ (self, controller):
@@ -220,6 +463,7 @@ class UptimeHandler(Resource):
             return "Cannot open uptime file: /proc/uptime"
         return Utils.get_elapsed_time(float(contents[0]))
 
+    @Metrics.timed_render
     def render(self, request):
         request.setHeader('Content-Type', 'application/json')
         return json.dumps("Uptime: " + self.uptime())
@@ -231,15 +475,21 @@ class UpdateHandler(Resource):
         self.delayed_requests = []
         self.controller = controller
 
-    def handle_updates(self):
-        for request in self.delayed_requests:
-            updates = self.controller.get_updates(request.lastupdate)
-            if updates != []:
+    """complete every parked request with updates, only called when a door actually changed"""
+    def publish(self, updates):
+        delayed_requests, self.delayed_requests = self.delayed_requests, []
+        for request in delayed_requests:
+            if hasattr(request, 'cursor'):
+                self.send_updates(request, self.controller.get_changes(request.cursor))
+            else:
                 self.send_updates(request, updates)
-                self.delayed_requests.remove(request)
+
+    def remove(self, request):
+        if request in self.delayed_requests:
+            self.delayed_requests.remove(request)
 
     def format_updates(self, request, update):
-        response = json.dumps({'timestamp': int(Utils.get_time()), 'update':update})
+        response = json.dumps({'timestamp': int(Utils.get_time()), 'version': self.controller.registry.version, 'update':update})
         if hasattr(request, 'jsonpcallback'):
             return request.jsonpcallback +'('+response+')'
         else:
@@ -249,6 +499,7 @@ class UpdateHandler(Resource):
         request.write(self.format_updates(request, updates))
         request.finish()
 
+    @Metrics.timed_render
     def render(self, request):
         # set the request content type
         request.setHeader('Content-Type', 'application/json')
@@ -261,8 +512,10 @@ class UpdateHandler(Resource):
             request.jsonpcallback =  args['callback'][0]
 	    #print "args "+args
 
-        # set lastupdate if it exists
-        if 'lastupdate' in args:
+        # set cursor (registry version) or lastupdate (time) if it exists
+        if 'cursor' in args:
+            request.cursor = int(args['cursor'][0])
+        elif 'lastupdate' in args:
             request.lastupdate = float(args['lastupdate'][0])
             #print "request received " + str(request.lastupdate) + "args " + str(args)
         else:
@@ -270,19 +523,71 @@ class UpdateHandler(Resource):
             #print "request received " + str(request.lastupdate)
 
         # Can we accommodate this request now?
-        updates = self.controller.get_updates(request.lastupdate)
+        if hasattr(request, 'cursor'):
+            updates = self.controller.get_changes(request.cursor)
+        else:
+            updates = self.controller.get_updates(request.lastupdate)
         if updates != []:
 	    #print "updates "+str(updates)
             return self.format_updates(request, updates)
 
-        request.notifyFinish().addErrback(lambda x: self.delayed_requests.remove(request))
+        request.notifyFinish().addErrback(lambda x: self.remove(request))
         self.delayed_requests.append(request)
 
         # tell the client we're not done yet
         return server.NOT_DONE_YET
 
+class StreamHandler(Resource):
+    """Server-Sent Events, one long lived connection per dashboard"""
+    isLeaf = True
+    keepalive_interval = 15
+
+    def __init__(self, controller):
+        Resource.__init__(self)
+        self.controller = controller
+        self.streams = []
+        self.keepalive = task.LoopingCall(self.send_keepalive)
+
+    def format_event(self, updates):
+        return "data: %s\n\n" % (json.dumps({'timestamp': int(Utils.get_time()), 'version': self.controller.registry.version,
+                                                'update': updates}))
+
+    def publish(self, updates):
+        event = self.format_event(updates)
+        for request in self.streams:
+            request.write(event)
+
+    def send_keepalive(self):
+        for request in self.streams:
+            request.write(": keepalive\n\n")
+
+    def remove(self, request):
+        if request in self.streams:
+            self.streams.remove(request)
+        if self.streams == [] and self.keepalive.running:
+            self.keepalive.stop()
+
+    @Metrics.timed_render
+    def render(self, request):
+        request.setHeader('Content-Type', 'text/event-stream')
+        request.setHeader('Cache-Control', 'no-cache')
+
+        # the current state of every door, so a reconnecting client catches up
+        request.write("retry: 10000\n")
+        request.write(self.format_event(self.controller.get_updates(0)))
+
+        request.notifyFinish().addBoth(lambda x: self.remove(request))
+        self.streams.append(request)
+        if not self.keepalive.running:
+            self.keepalive.start(self.keepalive_interval, now=False)
+
+        return server.NOT_DONE_YET
+
 class Controller(object):
-    def __init__(self, config, debugging=False):
+    """with defer_setup the GPIO, db and door setup wait for run() to bind the port"""
+    def __init__(self, config, debugging=False, defer_setup=False):
+        self.startup = Startup.StartupTimer()
+        self.startup.phase('imports')
         Utils.isDebugging = debugging 
         self.config = config
 
@@ -307,6 +612,28 @@ class Controller(object):
         self.time_to_report_still_open = c['to_report_still_open']
         self.time_to_force_close = c['to_force_close']
 
+        # door state pin edge detection, the poll then only catches missed edges
+        c = self.get_config_with_default(self.config['config'], 'door_events', {})
+        self.use_door_events = self.get_config_with_default(c, 'enabled', False)
+        self.door_bouncetime = self.get_config_with_default(c, 'bouncetime', 50)
+        self.door_hysteresis = self.get_config_with_default(c, 'hysteresis', 0.2)
+        self.door_poll_interval = self.get_config_with_default(c, 'fallback_poll', 5.0)
+        self.pending_edges = {}
+
+        # recent door, alert, motion and mqtt activity for /events
+        self.events = EventRing.EventRing(self.get_config_with_default(self.config['config'], 'event_buffer_size', 1000))
+
+        # rendered /graph, /graphshed and /weather responses
+        c = self.get_config_with_default(self.config['config'], 'cache', {})
+        self.graph_ttl = self.get_config_with_default(c, 'graph_ttl', 600)
+        self.weather_ttl = self.get_config_with_default(c, 'weather_ttl', 3600)
+        self.responseCache = ResponseCache.ResponseCache()
+
+        # blocking sensor and network calls run here, never on the reactor thread
+        c = self.get_config_with_default(self.config['config'], 'workers', {})
+        self.workers = Workers.WorkerPool(self.get_config_with_default(c, 'max_threads', 4),
+                                          self.get_config_with_default(c, 'timeouts', {}))
+
         c = self.config['alerts']
         self.when_opened = c['when_opened']
         self.when_closed = c['when_closed']
@@ -328,6 +655,11 @@ class Controller(object):
         c = self.config['weatherapi']
         self.weather_url = c['url']
         self.weather_key = c['key']
+        self.weather_max_age = self.get_config_with_default(c, 'today_max_age', 3600)
+
+        c = self.get_config_with_default(self.config, 'db', {})
+        db_Utils.db.open(self.get_config_with_default(c, 'path', db_Utils.DB_PATH))
+        self.export_chunk_rows = self.get_config_with_default(c, 'export_chunk_rows', Export.CHUNK_ROWS)
 
         for arg in sys.argv:
             if str(arg) == 'debug':
@@ -342,8 +674,57 @@ class Controller(object):
                 self.port = int((arg).split('=')[1])
                 self.port_secure = self.port
 
-        # set up fcache to log last time garage door was opened
-        self.fileCache = FileCache(Utils.gfileCache, flag='cs')
+        # DHT22 sampled every sample_interval, one filtered reading published every emit_interval
+        c = self.get_config_with_default(self.config['config'], 'temperature', {})
+        self.store_temperature = self.get_config_with_default(c, 'store', False)
+        self.sampler = TemperatureSampler.TemperatureSampler(self.read_temperature, self.workers,
+            self.get_config_with_default(c, 'window', TemperatureSampler.WINDOW),
+            self.get_config_with_default(c, 'sample_interval', TemperatureSampler.SAMPLE_INTERVAL),
+            self.get_config_with_default(c, 'emit_interval', TemperatureSampler.EMIT_INTERVAL),
+            self.get_config_with_default(c, 'max_temperature_deviation', TemperatureSampler.MAX_TEMPERATURE_DEVIATION),
+            self.get_config_with_default(c, 'max_humidity_deviation', TemperatureSampler.MAX_HUMIDITY_DEVIATION))
+        self.sampler.listeners.append(self.publish_temp)
+
+        # on demand sampling profiler, /profile or kill -USR1 <pid>
+        c = self.get_config_with_default(self.config['config'], 'profiler', {})
+        self.profile_signal_seconds = self.get_config_with_default(c, 'signal_seconds', 30)
+        self.profiler = Profiler.SamplingProfiler(self.get_config_with_default(c, 'dir', Profiler.PROFILE_DIR),
+                                                  self.get_config_with_default(c, 'interval', Profiler.INTERVAL),
+                                                  self.get_config_with_default(c, 'max_seconds', Profiler.MAX_SECONDS))
+
+        # one mqtt connection for the life of the controller, connected in start()
+        c = self.config['mqtt']
+        self.mqtt = MqttClient.MqttClient(self.mqtt_server, self.mqtt_username, self.mqtt_password,
+                                          self.get_config_with_default(c, 'qos', {}),
+                                          self.get_config_with_default(c, 'port', 1883),
+                                          queue_path=self.get_config_with_default(c, 'queue_path', MqttClient.QUEUE_PATH),
+                                          queue_size=self.get_config_with_default(c, 'queue_size', MqttClient.QUEUE_SIZE))
+
+        # store the garage and temperature messages in gdc_data ourselves, instead of an external subscriber
+        c = self.get_config_with_default(self.get_config_with_default(self.config, 'db', {}), 'ingest', {})
+        self.ingestor = None
+        if self.get_config_with_default(c, 'enabled', False):
+            topics = {self.mqtt_topic_garage: Ingest.DOOR,
+                      self.mqtt_topic_temperature: Ingest.TEMPERATURE,
+                      self.mqtt_topic_day_temperature: Ingest.DAY_TEMPERATURE}
+            topics.update(self.get_config_with_default(c, 'topics', {}))  # ex. "shed_temperature/action": "temperature"
+            self.ingestor = Ingest.Ingestor(db_Utils.db.path, self.workers, topics,
+                                            self.get_config_with_default(c, 'commit_interval', Ingest.COMMIT_INTERVAL),
+                                            self.get_config_with_default(c, 'max_batch', Ingest.MAX_BATCH),
+                                            self.get_config_with_default(c, 'max_queue', Ingest.MAX_QUEUE))
+            self.ingestor.subscribe(self.mqtt)
+            self.ingestor.listeners.append(self.on_ingested)
+
+        # roll old temperature readings into hourly rows, door events are kept as they are
+        c = self.get_config_with_default(self.get_config_with_default(self.config, 'db', {}), 'compact', {})
+        self.compactor = None
+        if self.get_config_with_default(c, 'enabled', False):
+            self.compactor = Compactor.Compactor(db_Utils.db.path, self.workers,
+                                                 self.get_config_with_default(c, 'raw_age', Compactor.RAW_AGE),
+                                                 self.get_config_with_default(c, 'hourly_age', Compactor.HOURLY_AGE),
+                                                 self.get_config_with_default(c, 'batch_size', Compactor.BATCH_SIZE),
+                                                 self.get_config_with_default(c, 'pause', Compactor.PAUSE),
+                                                 self.get_config_with_default(c, 'interval', Compactor.INTERVAL))
 
         # set up logging
         log_fmt = '%(asctime)s %(levelname)-8s %(message)s'
@@ -362,46 +743,97 @@ class Controller(object):
             rotatingHandler.setFormatter(logging.Formatter(log_fmt))
             logging.getLogger('mylogger').addHandler(rotatingHandler)
 
-            gpio.setwarnings(False)
-            gpio.cleanup()
-            gpio.setmode(gpio.BCM)
-
         # Banner
         logging.info("<---Garage Controller starting (port=%s %s) --->" % (self.port_secure, self.debugMsg))
 
         self.updateHandler = UpdateHandler(self)
+        self.streamHandler = StreamHandler(self)
 
+        # door state and timers from before a restart, written as they change
+        c = self.get_config_with_default(config['config'], 'checkpoint', {})
+        self.checkpoint = Checkpoint.DoorCheckpoint(self.get_config_with_default(c, 'path', Checkpoint.CHECKPOINT_PATH), self.workers,
+                                                    self.get_config_with_default(c, 'flush_interval', Checkpoint.FLUSH_INTERVAL),
+                                                    self.get_config_with_default(c, 'max_age', Checkpoint.MAX_AGE))
+
+        # Doors from config file, their pins and state are set up in setup()
+        self.doors = [Doors.Door(x, c) for (x, c) in sorted(config['doors'].items())]
+        self.registry = Doors.DoorRegistry(self.doors)
+
+        # setup alerts, alert_type is a comma separated list of channels
+        c = self.get_config_with_default(config['alerts'], 'dispatch', {})
+        self.alerts = Alerts.AlertDispatcher(Alerts.get_channels(config['alerts'], self.alert_type), self.workers,
+                                             self.get_config_with_default(c, 'coalesce_window', 5.0),
+                                             self.get_config_with_default(c, 'retries', 3),
+                                             self.get_config_with_default(c, 'backoff', 2.0))
+        if self.alerts.channels == []:
+            self.alert_type = None
+            logging.info("No alerts configured")
+
+        self.fileCache = None
         self.initMsg = ""
+        self.is_setup = False
+        self.startup.phase('config')
+        if not defer_setup:
+            self.setup()
+
+    """db migration, GPIO, door state and the initial alert, all on this thread"""
+    def setup(self):
+        self.migrate_db()
+        self.startup.phase('db')
+        self.setup_doors()
+
+    def setup_doors(self):
+        if not Utils.isDebugging:
+            gpio.setwarnings(False)
+            gpio.cleanup()
+            gpio.setmode(gpio.BCM)
+
+        # set up fcache to log last time garage door was opened
+        from fcache.cache import FileCache
+        self.fileCache = FileCache(Utils.gfileCache, flag='cs')
 
         # setup motion sensor
         if self.motion_pin != None and Utils.isDebugging != True:
             gpio.setup(self.motion_pin, gpio.IN)
             gpio.add_event_detect(self.motion_pin, gpio.RISING, callback=self.on_motion, bouncetime=300)
             logging.info("Motion pin = %s" % (self.motion_pin))
-           
-        # setup Doors from config file
-        self.doors = [Doors.Door(x, c) for (x, c) in sorted(config['doors'].items())]
+
+        # a door resumed from the checkpoint gets no "Initial state" alert
+        saved = self.checkpoint.load()
+        resumed = []
         for door in self.doors:
             door.setup(gpio, self.get_time_since_last_open(door.id)) 
-            self.set_initial_text_msg(door) 
-
-        # setup alerts
-        if self.alert_type == 'smtp':
-            self.use_smtp = False
-            smtp_params = ("smtphost", "smtpport", "smtp_tls", "username", "password", "to_email")
-            self.use_smtp = ('smtp' in config['alerts']) and set(smtp_params) <= set(config['alerts']['smtp'])
-        elif self.alert_type == 'pushover':
-            self.pushover_user_key = config['alerts']['pushover']['user_key']
-            self.pushover_api_key = config['alerts']['pushover']['api_key']
-        else:
-            self.alert_type = None
-            logging.info("No alerts configured")
-
-        if Utils.isDebugging:
-            print self.initMsg 
-        else:
-            logging.info(self.initMsg)
-            self.send_msg(self.initMsg) 
+            if door.id in saved and door.restore(saved[door.id]):
+                resumed.append(door.name)
+            else:
+                self.set_initial_text_msg(door) 
+            if self.use_door_events:
+                door.setup_event_detect(self.on_door_edge, self.door_bouncetime)
+            self.door_changed(door)
+        if resumed != []:
+            logging.info("Resumed %s from checkpoint %s" % (", ".join(resumed), self.checkpoint.path))
+
+        if self.initMsg != "":
+            if Utils.isDebugging:
+                print self.initMsg 
+            else:
+                logging.info(self.initMsg)
+                self.send_msg(self.initMsg) 
+        self.is_setup = True
+        self.startup.phase('doors')
+
+    """bring the db schema up to date and check the dashboard queries use its indexes"""
+    def migrate_db(self):
+        try:
+            conn = db_Utils.db.connection()
+            version = db_Schema.migrate(conn)
+            plans = db_Schema.check_query_plans(conn, db_Utils.hot_queries())
+            for name, (ok, plan) in sorted(plans.items()):
+                if not ok:
+                    logging.warning("Query %s does not use an index: %s" % (name, plan))
+            logging.info("DB schema version %d (%s)" % (version, db_Utils.db.path))
+        except Exception as e:
+            logging.error("Error migrating db %s" % e)
 
     def set_time_since_last_open(self, doorName):
         self.fileCache[doorName] = Utils.get_time()
@@ -411,10 +843,39 @@ class Controller(object):
         return(self.fileCache.setdefault(doorName, Utils.get_time()))
 
     def get_door(self, door_id):
-        for door in self.doors:
-            if (door.id == door_id):
-                return door
-        return None
+        return self.registry.get(door_id)
+
+    def get_door_by_pin(self, pin):
+        return self.registry.get_by_pin(pin)
+
+    """gpio edge callback, runs on the gpio thread so hand the edge over to the reactor"""
+    def on_door_edge(self, pin):
+        reactor.callFromThread(self.door_edge, pin)
+
+    """(re)start the hysteresis timer, the door is only checked once its pin has held its level"""
+    def door_edge(self, pin):
+        door = self.get_door_by_pin(pin)
+        if door == None:
+            return
+
+        pending = self.pending_edges.get(door.id)
+        if pending != None and pending.active():
+            pending.cancel()
+        self.pending_edges[door.id] = reactor.callLater(self.door_hysteresis, self.door_edge_settled, door)
+
+    def door_edge_settled(self, door):
+        self.pending_edges.pop(door.id, None)
+        try:
+            self.check_door_status(door)
+        except Exception as e:
+            logging.info("Error door_edge_settled %s" % e)
+            return
+
+        # finish opening/closing on time instead of waiting for the fallback poll
+        if door.state == Utils.OPENING:
+            reactor.callLater(self.time_to_open + 1, self.check_door_status, door)
+        elif door.state == Utils.CLOSING:
+            reactor.callLater(self.time_to_close + 1, self.check_door_status, door)
 
     def resetTimer(self):
         logging.info("Motion resetting timer")
@@ -431,6 +892,8 @@ class Controller(object):
                         cur_dt = Utils.epoch_to_datetime(curr_time).strftime(Utils.TIMEFORMAT)
                         logging.info("Motion detected, reset %s (%s)" % (d.name, cur_dt))
                         d.set_open_state(curr_time)
+                        self.events.add(EventRing.MOTION, d.id, "reset %s" % (d.name), curr_time)
+                        reactor.callFromThread(self.door_changed, d)
 
                         t = threading.Timer(10.0, self.resetTimer)
                         t.start()
@@ -509,6 +972,7 @@ class Controller(object):
             door.set_open_state(curr_time) 
         return message
 
+    @Metrics.timed(CHECK_STATUS_SECONDS)
     def check_status(self):
         try:
             for door in self.doors:
@@ -516,11 +980,13 @@ class Controller(object):
         except Exception as e:
             self.logger.info("Error check_status %s" % e)
 
+    @Metrics.timed(CHECK_DOOR_STATUS_SECONDS)
     def check_door_status(self, door):
         self.logger = logging.getLogger(__name__)
         message = '' 
         curr_time = Utils.get_time()
         pin_state = door.get_state_pin()
+        last_update = (door.state, door.tis.get(door.state))
 
         if pin_state != door.state:
             if door.state != Utils.OPENING and door.state != Utils.CLOSING: 
@@ -540,10 +1006,20 @@ class Controller(object):
 
         if message != "":
             self.logger.info(message)
-            self.send_msg(message)
+            self.send_msg(message, door)
 
-        self.updateHandler.handle_updates()
+        if (door.state, door.tis.get(door.state)) != last_update:
+            self.door_changed(door)
+        self.checkpoint.update(door)
 
+    """push a door's new state to the parked /upd requests and the /stream connections"""
+    def door_changed(self, door):
+        self.registry.touch(door)
+        self.checkpoint.update(door)
+        updates = [(door.id, door.state, door.tis.get(door.state))]
+        self.events.add(EventRing.DOOR, door.id, door.state, door.tis.get(door.state))
+        self.updateHandler.publish(updates)
+        self.streamHandler.publish(updates)
 
     def publish_garage_event(self, door, msg):
         pubMsg = ""
@@ -558,7 +1034,31 @@ class Controller(object):
             pubMsg += door.name+"|"+msg
 
         if pubMsg != "":
-            Utils.publish_MQTT(self.mqtt_server, self.mqtt_topic_garage, pubMsg, self.mqtt_username,self.mqtt_password)
+            self.events.add(EventRing.MQTT, door.id, pubMsg)
+            self.publish_MQTT(self.mqtt_topic_garage, pubMsg)
+
+    def publish_MQTT(self, topic, msg):
+        with MQTT_PUBLISH_SECONDS.time():
+            published = self.mqtt.publish(topic, msg)
+        if not published:
+            MQTT_QUEUED.inc()
+        return published
+
+    def on_ingested(self, events):
+        for event in events:
+            self.responseCache.invalidate_event(event)
+
+    def on_profile_signal(self, signum, frame):
+        reactor.callFromThread(self.start_profile, self.profile_signal_seconds)
+
+    def start_profile(self, seconds):
+        try:
+            self.profiler.start(seconds)
+        except RuntimeError as e:
+            logging.warning("Profile not started: %s" % e)
+
+    def log_failure(self, f, what):
+        logging.error("Error %s: %s" % (what, f.getErrorMessage()))
 
     def can_send_alert(self):
         dt = Utils.get_date_time()
@@ -566,66 +1066,14 @@ class Controller(object):
             return Utils.is_day_of_week(self, dt.weekday()) and Utils.is_time_between(self, dt.time()) 
         return False
 
-    def send_msg(self, message):
+    def send_msg(self, message, door=None):
+        self.events.add(EventRing.ALERT, door.id if door != None else None, message)
         if Utils.isDebugging:
             logging.info("PO - %s" % (message))
             return
 
-        if self.can_send_alert():
-            if self.alert_type == 'smtp': 
-                self.send_text(message)
-            elif self.alert_type == 'pushover':
-                self.send_pushover(message)
-
-    def send_text(self, msg):
-        self.logger = logging.getLogger(__name__)
-
-        if Utils.is_too_early():
-            return
-
-        #logging.info("SM - %s" % (msg))
-        try:
-            if self.use_smtp:
-                config = self.config['alerts']['smtp']
-                server = smtplib.SMTP(config["smtphost"], config["smtpport"])
-                if (config["smtp_tls"] == True) :
-                    server.starttls()
-                    server.login(config["username"], config["password"])
-                    mg = MIMEText(msg)
-                    server.sendmail('from', config["to_email"], mg.as_string())
-        except smtplib.SMTPException as e:
-            self.logger.error("Error: unable to send gmail text %s", e)
-        except:
-            self.logger.error("Main Exception: %s", sys.exc_info()[0])
-        finally:
-            try:
-                server.quit()
-            except smtplib.SMTPServerDisconnected as sd:
-                self.logger.error("sd Error: .quit() failed %s", sd)
-                server.close()
-            except:
-                self.logger.error("final Exception: %s", sys.exc_info()[0])
-
-    def send_pushover(self, message):
-        self.logger = logging.getLogger(__name__)
-
-        if Utils.is_too_early():
-            return
-        try:
-            conn = httplib.HTTPSConnection("api.pushover.net:443")
-            conn.request("POST", "/1/messages.json",
-                urllib.urlencode({
-                    "token": self.pushover_api_key,
-                    "user": self.pushover_user_key,
-                    "title": 'Garage',
-                    "sound": 'pushover',
-                    "message": message,
-                }), { "Content-type": "application/x-www-form-urlencoded" })
-            conn.getresponse()
-        except socket.gaierror as e:
-            self.logger.error("send_pushover Exception2: %s", e)
-        except:
-            self.logger.error("send_pushover Exception: %s", sys.exc_info()[0])
+        if self.can_send_alert() and not Utils.is_too_early():
+            self.alerts.send(message, door.id if door != None else None)
 
     def close_all(self):
         self.logger = logging.getLogger(__name__)
@@ -655,6 +1103,10 @@ class Controller(object):
                 updates.append((d.id, d.state, timeinstate))
         return updates
 
+    """updates for the doors changed after registry version"""
+    def get_changes(self, version):
+        return [(d.id, d.state, d.tis.get(d.state)) for d in self.registry.changed_since(version)]
+
     def get_config_with_default(self, config, param, default):
         if not config:
             return default
@@ -662,49 +1114,117 @@ class Controller(object):
             return default
         return config[param]
 
-    def get_temp(self):
-        msg = Utils.get_temperature(Utils.temperature_pin)
-        if "error reading" in msg:
-            logging.info("Error getting temperature")
-        if msg != "": 
-            Utils.publish_MQTT(self.mqtt_server, self.mqtt_topic_temperature, msg, self.mqtt_username, self.mqtt_password)
-        return msg
+    def read_temperature(self):
+        return Utils.read_dht(Utils.temperature_pin)
+
+    """every reading the sampler emits, hourly by default"""
+    def publish_temp(self, reading):
+        msg = reading.to_json()
+        self.publish_MQTT(self.mqtt_topic_temperature, msg)
+        if self.store_temperature:
+            d = self.workers.run('db', db_Utils.insert_event, self.mqtt_topic_temperature.split('/')[0], msg, reading.temperature_f)
+            d.addErrback(self.log_failure, "store temperature")
+        self.responseCache.invalidate_event("garage_temperature")
+        return reading
 
     def get_weather(self):
         #logging.info("calling weatherAPI")
-        Utils.query_weather_API(requests, controller)
-
-    def run(self):
-        root = File('www')
+        d = self.workers.run('weather', Utils.query_weather_API, requests, self)
+        d.addCallback(lambda _: self.responseCache.invalidate_event("day_temperature"))
+        d.addErrback(self.log_failure, "get_weather")
+        return d
+
+    """the web site, every handler mounted"""
+    def site(self):
+        root = StaticAssets.StaticAssets('www')
         root.putChild('upd', self.updateHandler)
-        root.putChild('cfg', ConfigHandler(self)) # this prints the doors on the webpage
+        root.putChild('stream', self.streamHandler)
+        root.putChild('cfg', gzipped(ConfigHandler(self))) # this prints the doors on the webpage
         root.putChild('upt', UptimeHandler(self))
+        root.putChild('metrics', MetricsHandler(self))
+        c = self.config['site']
+        if self.get_config_with_default(c, 'username', '') != '':
+            root.putChild('profile', authenticated(ProfileHandler(self), c['username'], c['password']))
+        root.putChild('events', gzipped(EventsHandler(self)))
         root.putChild('log', LogHandler(self))
+        root.putChild('export', ExportHandler(self))
         root.putChild('temps', TempsHandler(self))
         root.putChild('gettemp', GetTempHandler(self))
         root.putChild('closeall', CloseAllHandler(self))
         root.putChild('clk', ClickHandler(self))
         root.putChild('openclose', ClickOpenCloseHandler(self))
+        root.putChild('doorstats', gzipped(DoorStatsHandler(self)))
         root.putChild('mot', ClickMotionTestHandler(self))
-        root.putChild('graph', ClickGraphHandler(self))
-        root.putChild('graphshed', ClickGraphShedHandler(self))
-        root.putChild('weather', ClickWeatherHandler(self))
-        task.LoopingCall(self.check_status).start(1.0)
-        task.LoopingCall(self.get_temp).start(1.0*60*60) # every hour
-        task.LoopingCall(self.get_weather).start(1.0*60*60*12) # every 12 hours
+        root.putChild('graph', gzipped(ClickGraphHandler(self)))
+        root.putChild('graphshed', gzipped(ClickGraphShedHandler(self)))
+        root.putChild('weather', gzipped(ClickWeatherHandler(self)))
+        return server.Site(root)
 
-        site = server.Site(root)
+    def run(self):
+        site = self.site()
 
+        # bind first, connections made while the rest starts up wait in the backlog instead of being refused
         if not self.get_config_with_default(self.config['config'], 'use_https', False):
             reactor.listenTCP(self.port, site)  # @UndefinedVariable
         else:
+            from twisted.internet import ssl
             sslContext = ssl.DefaultOpenSSLContextFactory(self.config['site']['ssl_key'], self.config['site']['ssl_cert'])
             reactor.listenSSL(self.port_secure, site, sslContext)  # @UndefinedVariable
+        self.startup.phase('listen')
 
+        reactor.callWhenRunning(self.start)  # @UndefinedVariable
         reactor.run()  # @UndefinedVariable
 
+    """finish a deferred setup, the db migration on a worker so requests are served meanwhile,
+    then start polling, sampling and publishing"""
+    def start(self):
+        self.workers.start()
+        if self.is_setup:
+            d = defer.succeed(None)
+        else:
+            d = self.workers.run('migrate', self.migrate_db)
+            d.addCallback(lambda x: self.startup.phase('db'))
+            d.addCallback(lambda x: self.setup_doors())
+        d.addCallback(lambda x: self.start_services())
+        d.addErrback(self.log_failure, "starting up")
+        return d
+
+    """door monitoring first, then every optional service on its own so one failing doesn't stop the rest"""
+    def start_services(self):
+        if self.use_door_events:
+            task.LoopingCall(self.check_status).start(self.door_poll_interval)
+        else:
+            task.LoopingCall(self.check_status).start(1.0)
+        reactor.addSystemEventTrigger('before', 'shutdown', self.checkpoint.stop)  # @UndefinedVariable
+
+        self.start_service("mqtt", self.mqtt.start, self.mqtt.stop)
+        if self.ingestor != None:
+            self.start_service("ingest", self.ingestor.start, self.ingestor.stop)
+        if self.compactor != None:
+            self.start_service("compactor", self.compactor.start)
+        self.start_service("profiler signal", lambda: signal.signal(signal.SIGUSR1, self.on_profile_signal))
+        self.start_service("temperature sampler", self.sampler.start)
+        self.start_service("weather", lambda: task.LoopingCall(self.get_weather).start(1.0*60*60*12)) # every 12 hours
+        self.startup.phase('services')
+        self.startup.report()
+
+    def start_service(self, name, start, stop=None):
+        try:
+            start()
+        except Exception as e:
+            logging.error("Error starting %s: %s" % (name, e))
+            return False
+        if stop != None:
+            reactor.addSystemEventTrigger('before', 'shutdown', stop)  # @UndefinedVariable
+        return True
+
 if __name__ == '__main__':
     config_file = open('/home/pi/gdc/config.json')
-    controller = Controller(json.load(config_file))
+    config = json.load(config_file)
     config_file.close()
-    controller.run()
+    if 'aggregator' in config:
+        # no doors of its own, merges the remote controllers listed in config.aggregator
+        import aggregator as Aggregator
+        Aggregator.Aggregator(config).run()
+    else:
+        Controller(config, defer_setup=True).run()
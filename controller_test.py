@@ -2,9 +2,16 @@ import unittest
 import json
 import time
 import datetime
+import os
+import tempfile
 import utils as Utils
+import db_schema as db_Schema
+import db_utils as db_Utils
 import door as Doors
 
+from twisted.web import server
+from twisted.web.test.requesthelper import DummyRequest
+
 # This is the class we want to test. So, we need to import it
 import controller as ControllerClass 
 
@@ -87,6 +94,98 @@ class Test(unittest.TestCase):
         c.check_door_status(door)
         self.assertEquals(door.state, "closing")
 
+    def testDoorEdgeSettled(self):
+        c = self.setup()
+        door = c.get_door_by_pin(17)
+        self.assertEquals(door.id, "right")
+        door.state = "closed"
+        c.time_to_open = 5
+        door.toggle_relay()
+        c.door_edge_settled(door)
+        self.assertEquals(door.state, "opening")
+
+    def testDoorChangePublished(self):
+        c = self.setup()
+        door = c.get_door("right")
+        c.time_to_open = 5
+        request = DummyRequest(['upd'])
+        request.args = {'lastupdate': [str(Utils.get_time() + 60)]}
+        self.assertEqual(server.NOT_DONE_YET, c.updateHandler.render(request))
+        c.check_door_status(door)
+        self.assertEqual(0, request.finished)
+        door.toggle_relay()
+        c.check_door_status(door)
+        self.assertEqual(1, request.finished)
+        self.assertEqual("opening", json.loads(request.written[0])['update'][0][1])
+        self.assertEqual([], c.updateHandler.delayed_requests)
+
+    def testEventsRecorded(self):
+        c = self.setup()
+        door = c.get_door("right")
+        c.time_to_open = 5
+        door.toggle_relay()
+        c.check_door_status(door)
+        events = c.events.since(0)
+        self.assertEqual([("mqtt", "right", "2 Car|opening"), ("door", "right", "opening")],
+                         [(e.kind, e.door, e.message) for e in events][-2:])
+        self.assertEqual([], c.events.since(c.events.seq))
+
+    def testEventsSinceInvalid(self):
+        c = self.setup()
+        request = DummyRequest(['events'])
+        request.args = {'since': ['abc']}
+        ControllerClass.EventsHandler(c).render(request)
+        self.assertEqual(400, request.responseCode)
+
+    def testDoorRegistryVersions(self):
+        doors = [Doors.Door("d%d" % i, {'id': "Gate %d" % i, 'relay_pin': i, 'state_pin': 100 + i, 'closed_value': 1})
+                 for i in range(200)]
+        registry = Doors.DoorRegistry(doors)
+        self.assertEqual(200, registry.version)
+        self.assertEqual(doors[42], registry.get("d42"))
+        self.assertEqual(doors[42], registry.get_by_pin(142))
+        self.assertEqual([], registry.changed_since(200))
+
+        registry.touch(doors[7])
+        registry.touch(doors[3])
+        registry.touch(doors[7])
+        self.assertEqual([doors[3], doors[7]], registry.changed_since(200))
+        self.assertEqual([doors[7]], registry.changed_since(202))
+
+    def testUpdateCursor(self):
+        c = self.setup()
+        door = c.get_door("right")
+        c.time_to_open = 5
+        version = c.registry.version
+        request = DummyRequest(['upd'])
+        request.args = {'cursor': [str(version)]}
+        self.assertEqual(server.NOT_DONE_YET, c.updateHandler.render(request))
+        door.toggle_relay()
+        c.check_door_status(door)
+        response = json.loads(request.written[0])
+        self.assertEqual(version + 1, response['version'])
+        self.assertEqual([["right", "opening", door.tis["opening"]]], response['update'])
+
+    def testConfigSince(self):
+        c = self.setup()
+        handler = ControllerClass.ConfigHandler(c)
+        version = c.registry.version
+        request = DummyRequest(['cfg'])
+        request.args = {'since': [str(version)]}
+        self.assertEqual({'version': version, 'doors': []}, json.loads(handler.render(request)))
+
+        # a version from before a restart gets the full list back
+        request = DummyRequest(['cfg'])
+        request.args = {'since': [str(version + 100)]}
+        response = json.loads(handler.render(request))
+        self.assertEqual(version, response['version'])
+        self.assertEqual([d.id for d in c.doors], [d[0] for d in response['doors']])
+
+        request = DummyRequest(['cfg'])
+        request.args = {'since': ['abc']}
+        handler.render(request)
+        self.assertEqual(400, request.responseCode)
+
     def testIsDayOfWeekInvalid(self):
         c = self.setup()
         c.on_days_of_week="Mon,Tue,Wed,Thu,Fri,Sun"
@@ -196,6 +295,76 @@ class Test(unittest.TestCase):
         time_diff = "%s" % (Utils.get_elapsed_time(int(total_secs)))
         self.assertEqual("03:01", time_diff) 
 
+    def testBuildSql(self):
+        sql, params = db_Utils.build_sql(["garage_temperature", "shed_temperature"], 75, "_time", "desc", 180)
+        self.assertEqual("SELECT * FROM gdc_data WHERE event IN (?,?) and _time >= date('now', ?) ORDER BY _time desc LIMIT ?", sql)
+        self.assertEqual(["garage_temperature", "shed_temperature", "-180 days", 75], params)
+        self.assertRaises(ValueError, db_Utils.build_sql, ["2 Car"], 0, "event; drop table gdc_data", "")
+
+    def testIsWeatherDayFresh(self):
+        day = {"date": "2020-10-10", "avgtemp_f": 55.0}
+        self.assertTrue(Utils.is_weather_day_fresh((day, 1000.0, True), 3600, 100000.0))
+        self.assertTrue(Utils.is_weather_day_fresh((day, 1000.0, False), 3600, 4000.0))
+        self.assertFalse(Utils.is_weather_day_fresh((day, 1000.0, False), 3600, 5000.0))
+
+    def testWeatherDayStored(self):
+        class FakeResponse(object):
+            def json(self):
+                return {"forecast": {"forecastday": [{"day": {"avghumidity": 40, "avgtemp_f": 60.0,
+                                                              "mintemp_f": 50.0, "maxtemp_f": 70.0}}]}}
+
+        class FakeRequests(object):
+            def __init__(self):
+                self.urls = []
+
+            def get(self, url, timeout=None):
+                self.urls.append(url)
+                return FakeResponse()
+
+        class FakeController(object):
+            weather_url = "http://api.weatherapi.com/v1/history.json"
+            weather_key = "key"
+            weather_max_age = 3600
+            mqtt_topic_day_temperature = "day_temperature/action"
+
+            def __init__(self):
+                self.published = []
+
+            def publish_MQTT(self, topic, msg):
+                self.published.append(msg)
+
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        db_Utils.db.open(path)
+        get_time = Utils.get_time
+        now = 1000000.0
+        Utils.get_time = lambda: now
+        try:
+            db_Schema.migrate(db_Utils.db.connection())
+            requests = FakeRequests()
+            c = FakeController()
+            today = Utils.get_date_time().strftime('%Y-%m-%d')
+            db_Utils.put_weather_day("2020-10-10", {"date": "2020-10-10", "avgtemp_f": 55.0}, now - 100000, True)
+            db_Utils.put_weather_day(today, {"date": today, "avgtemp_f": 65.0}, now - 60, False)
+
+            # a final past day and a fresh copy of today come from the db
+            self.assertEqual(55.0, Utils.query_weather_API_by_date(requests, c, "2020-10-10")["avgtemp_f"])
+            self.assertEqual(65.0, Utils.query_weather_API_by_date(requests, c, today)["avgtemp_f"])
+            self.assertEqual([], requests.urls)
+
+            # a stale copy of today is fetched and stored again
+            now += 3600
+            self.assertEqual(60.0, Utils.query_weather_API_by_date(requests, c, today)["avgtemp_f"])
+            self.assertEqual(1, len(requests.urls))
+            self.assertTrue(requests.urls[0].endswith("dt=%s" % (today)))
+            day, fetched_at, final = db_Utils.get_weather_day(today)
+            self.assertEqual((60.0, now, False), (day["avgtemp_f"], fetched_at, final))
+            self.assertEqual(1, len(c.published))
+        finally:
+            Utils.get_time = get_time
+            db_Utils.db.close()
+            os.remove(path)
+
     def testSet_initial_text_msg(self): 
         c = self.setup()
         self.assertEqual('Initial state of 2 Car:closed', c.initMsg)
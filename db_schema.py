@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+"""Versioned schema and migrations for the gdc sqlite database."""
+import logging
+
+
+def gdc_data_columns(conn):
+    """names of the (id, _time, event, data, value) columns, the table may have been created by the mqtt subscriber"""
+    return [row[1] for row in conn.execute("PRAGMA table_info(gdc_data)")]
+
+
+def create_gdc_data(conn):
+    conn.execute("""CREATE TABLE IF NOT EXISTS gdc_data (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        _time TEXT,
+        event TEXT,
+        data TEXT,
+        value REAL)""")
+
+
+def create_event_indexes(conn):
+    # every query filters by event and orders by _time or id
+    cols = gdc_data_columns(conn)
+    conn.execute("CREATE INDEX IF NOT EXISTS gdc_data_event_time ON gdc_data(event, _time, %s, %s)" % (cols[3], cols[4]))
+    conn.execute("CREATE INDEX IF NOT EXISTS gdc_data_event_id ON gdc_data(event, id)")
+
+
+# raw temperature readings, day_temperature holds the weather api daily averages
+TEMPERATURE_FILTER = "%(event)s LIKE '%%!_temperature' ESCAPE '!' AND %(event)s != 'day_temperature' AND %(value)s GLOB '*[0-9]*'"
+
+
+def create_daily_temperature(conn):
+    cols = gdc_data_columns(conn)
+    conn.execute("""CREATE TABLE IF NOT EXISTS gdc_daily_temperature (
+        event TEXT NOT NULL,
+        day TEXT NOT NULL,
+        min REAL,
+        max REAL,
+        mean REAL,
+        count INTEGER,
+        PRIMARY KEY (event, day)) WITHOUT ROWID""")
+
+    # maintained on insert, so it stays current whoever writes the readings
+    new_filter = TEMPERATURE_FILTER % {'event': "NEW.event", 'value': "NEW." + cols[4]}
+    value = "CAST(NEW.%s AS REAL)" % (cols[4])
+    conn.execute("""CREATE TRIGGER IF NOT EXISTS gdc_daily_temperature_insert AFTER INSERT ON gdc_data
+        WHEN %(filter)s
+        BEGIN
+            INSERT OR IGNORE INTO gdc_daily_temperature VALUES (NEW.event, date(NEW._time), %(value)s, %(value)s, 0, 0);
+            UPDATE gdc_daily_temperature
+                SET min = MIN(min, %(value)s), max = MAX(max, %(value)s),
+                    mean = (mean * count + %(value)s) / (count + 1), count = count + 1
+                WHERE event = NEW.event AND day = date(NEW._time);
+        END""" % {'filter': new_filter, 'value': value})
+
+    # backfill from the readings already stored
+    value = "CAST(%s AS REAL)" % (cols[4])
+    conn.execute("""INSERT OR REPLACE INTO gdc_daily_temperature
+        SELECT event, date(_time), MIN(%(value)s), MAX(%(value)s), AVG(%(value)s), COUNT(*)
+        FROM gdc_data WHERE %(filter)s GROUP BY event, date(_time)""" %
+                 {'filter': TEMPERATURE_FILTER % {'event': "event", 'value': cols[4]}, 'value': value})
+
+
+def create_weather_day(conn):
+    # weatherapi history per date, final once the date is over and can't change anymore
+    conn.execute("""CREATE TABLE IF NOT EXISTS gdc_weather_day (
+        date TEXT PRIMARY KEY,
+        data TEXT,
+        fetched_at REAL,
+        final INTEGER)""")
+
+
+# door transitions are stored with the door name as event and the state as data
+DOOR_OPENED = ('opening', 'open')
+DOOR_CLOSED = 'closed'
+
+
+def backfill_door_sessions(conn):
+    """replay the door transitions already stored, in the order the triggers would have seen them"""
+    cols = gdc_data_columns(conn)
+    opened = {}
+    sessions = []
+    states = DOOR_OPENED + (DOOR_CLOSED,)
+    for event, t, state in conn.execute("SELECT event, _time, %s FROM gdc_data WHERE %s IN (%s) ORDER BY id" %
+                                        (cols[3], cols[3], ",".join("?" * len(states))), states):
+        if state in DOOR_OPENED:
+            opened.setdefault(event, t)
+        elif event in opened:
+            sessions.append((event, opened.pop(event), t))
+    conn.executemany("""INSERT INTO gdc_door_session (door, opened_at, closed_at, duration)
+        VALUES (?1, ?2, ?3, CAST(strftime('%s', ?3) - strftime('%s', ?2) AS INTEGER))""", sessions)
+    conn.executemany("INSERT INTO gdc_door_session (door, opened_at) VALUES (?, ?)", opened.items())
+
+
+def create_door_sessions(conn):
+    # one row per open/close cycle, closed_at and duration (secs) stay NULL while the door is open
+    cols = gdc_data_columns(conn)
+    conn.execute("""CREATE TABLE IF NOT EXISTS gdc_door_session (
+        id INTEGER PRIMARY KEY,
+        door TEXT NOT NULL,
+        opened_at TEXT NOT NULL,
+        closed_at TEXT,
+        duration INTEGER)""")
+    conn.execute("CREATE INDEX IF NOT EXISTS gdc_door_session_door_opened ON gdc_door_session(door, opened_at, duration, closed_at)")
+
+    # opening then open is one session, the first transition starts it
+    conn.execute("""CREATE TRIGGER IF NOT EXISTS gdc_door_session_opened AFTER INSERT ON gdc_data
+        WHEN NEW.%(state)s IN ('%(opening)s', '%(open)s')
+        BEGIN
+            INSERT INTO gdc_door_session (door, opened_at)
+                SELECT NEW.event, NEW._time
+                WHERE NOT EXISTS (SELECT 1 FROM gdc_door_session WHERE door = NEW.event AND closed_at IS NULL);
+        END""" % {'state': cols[3], 'opening': DOOR_OPENED[0], 'open': DOOR_OPENED[1]})
+    conn.execute("""CREATE TRIGGER IF NOT EXISTS gdc_door_session_closed AFTER INSERT ON gdc_data
+        WHEN NEW.%(state)s = '%(closed)s'
+        BEGIN
+            UPDATE gdc_door_session
+                SET closed_at = NEW._time,
+                    duration = CAST(strftime('%%s', NEW._time) - strftime('%%s', opened_at) AS INTEGER)
+                WHERE door = NEW.event AND closed_at IS NULL;
+        END""" % {'state': cols[3], 'closed': DOOR_CLOSED})
+
+    backfill_door_sessions(conn)
+
+
+def create_hourly_temperature(conn):
+    # raw readings older than the compactor's raw_age end up here, see compactor.py
+    conn.execute("""CREATE TABLE IF NOT EXISTS gdc_hourly_temperature (
+        event TEXT NOT NULL,
+        hour TEXT NOT NULL,
+        min REAL,
+        max REAL,
+        mean REAL,
+        count INTEGER,
+        PRIMARY KEY (event, hour)) WITHOUT ROWID""")
+
+
+# MIGRATIONS[n] moves the schema from version n to n+1, never change one that has shipped
+MIGRATIONS = [
+    create_gdc_data,
+    create_event_indexes,
+    create_daily_temperature,
+    create_weather_day,
+    create_door_sessions,
+    create_hourly_temperature,
+]
+
+TABLES = ("gdc_data", "gdc_daily_temperature", "gdc_door_session", "gdc_hourly_temperature")
+INDEXES = ("gdc_data_event_time", "gdc_data_event_id", "gdc_door_session_door_opened", "PRIMARY KEY")
+
+
+def get_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn):
+    version = get_version(conn)
+    for v in range(version, len(MIGRATIONS)):
+        logging.info("Migrating gdc db schema %d -> %d (%s)" % (v, v + 1, MIGRATIONS[v].__name__))
+        with conn:
+            MIGRATIONS[v](conn)
+            conn.execute("PRAGMA user_version = %d" % (v + 1))
+    return get_version(conn)
+
+
+def get_query_plan(conn, sql, params):
+    return [row[-1] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+
+
+def uses_index(plan):
+    """True if no step of the plan scans one of our tables without one of our indexes"""
+    found = False
+    for detail in plan:
+        if not any(table in detail for table in TABLES):
+            continue
+        if not any(index in detail for index in INDEXES):
+            return False
+        found = True
+    return found
+
+
+def check_query_plans(conn, queries):
+    """returns {name: (uses_index, plan)} for a {name: (sql, params)} dict of queries"""
+    results = {}
+    for name, (sql, params) in queries.items():
+        plan = get_query_plan(conn, sql, params)
+        results[name] = (uses_index(plan), plan)
+    return results
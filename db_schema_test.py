@@ -0,0 +1,151 @@
+import datetime
+import os
+import tempfile
+import unittest
+import sqlite3
+import db_schema as db_Schema
+import db_utils as db_Utils
+import controller as Controller
+
+from twisted.web.test.requesthelper import DummyRequest
+
+
+class FakeDoor(object):
+    def __init__(self, name):
+        self.name = name
+
+
+class FakeController(object):
+    def __init__(self, doors):
+        self.doors = [FakeDoor(name) for name in doors]
+
+
+class Test(unittest.TestCase):
+
+    def setup(self):
+        conn = sqlite3.connect(':memory:')
+        db_Schema.migrate(conn)
+        return conn
+
+    def testMigrate(self):
+        conn = self.setup()
+        self.assertEqual(len(db_Schema.MIGRATIONS), db_Schema.get_version(conn))
+        # running again is a no-op
+        self.assertEqual(len(db_Schema.MIGRATIONS), db_Schema.migrate(conn))
+
+    def testMigrateExistingTable(self):
+        conn = sqlite3.connect(':memory:')
+        conn.execute("CREATE TABLE gdc_data (id INTEGER PRIMARY KEY, _time TEXT, event TEXT, msg TEXT, temp REAL)")
+        conn.execute("INSERT INTO gdc_data (_time, event, msg, temp) VALUES ('2020-10-10 17:31:57', '2 Car', 'opening', 0)")
+        db_Schema.migrate(conn)
+        self.assertEqual(1, conn.execute("SELECT COUNT(*) FROM gdc_data").fetchone()[0])
+
+    def testDailyTemperatureRollup(self):
+        conn = self.setup()
+        rows = [('2020-10-10 01:00:00', 'garage_temperature', '', 50.0),
+                ('2020-10-10 13:00:00', 'garage_temperature', '', 70.0),
+                ('2020-10-10 14:00:00', 'garage_temperature', '', 'error reading'),
+                ('2020-10-10 13:00:00', 'day_temperature', '', 60.0),
+                ('2020-10-10 13:00:00', '2 Car', 'opening', 0)]
+        conn.executemany("INSERT INTO gdc_data (_time, event, data, value) VALUES (?, ?, ?, ?)", rows)
+        self.assertEqual([('garage_temperature', '2020-10-10', 50.0, 70.0, 60.0, 2)],
+                         conn.execute("SELECT * FROM gdc_daily_temperature").fetchall())
+
+    def testDailyTemperatureBackfill(self):
+        conn = sqlite3.connect(':memory:')
+        db_Schema.create_gdc_data(conn)
+        conn.executemany("INSERT INTO gdc_data (_time, event, data, value) VALUES (?, 'shed_temperature', '', ?)",
+                         [('2020-10-10 01:00:00', 40), ('2020-10-10 02:00:00', 44), ('2020-10-11 01:00:00', 30)])
+        db_Schema.migrate(conn)
+        self.assertEqual([('2020-10-10', 40.0, 44.0, 42.0, 2), ('2020-10-11', 30.0, 30.0, 30.0, 1)],
+                         conn.execute("SELECT day, min, max, mean, count FROM gdc_daily_temperature ORDER BY day").fetchall())
+
+    def testDoorSessions(self):
+        conn = self.setup()
+        rows = [('2020-10-10 07:00:00', '2 Car', 'opening', 0),
+                ('2020-10-10 07:00:10', '2 Car', 'open', 0),
+                ('2020-10-10 07:00:20', '1 Car', 'opening', 0),
+                ('2020-10-10 07:05:10', '2 Car', 'closing', 0),
+                ('2020-10-10 07:05:20', '2 Car', 'closed', 0),
+                ('2020-10-10 08:00:00', '2 Car', 'closed', 0),
+                ('2020-10-10 09:00:00', '2 Car', 'open', 0)]
+        conn.executemany("INSERT INTO gdc_data (_time, event, data, value) VALUES (?, ?, ?, ?)", rows)
+        self.assertEqual([('2 Car', '2020-10-10 07:00:00', '2020-10-10 07:05:20', 320),
+                          ('1 Car', '2020-10-10 07:00:20', None, None),
+                          ('2 Car', '2020-10-10 09:00:00', None, None)],
+                         conn.execute("SELECT door, opened_at, closed_at, duration FROM gdc_door_session ORDER BY id").fetchall())
+
+    def testDoorSessionsBackfill(self):
+        conn = sqlite3.connect(':memory:')
+        db_Schema.create_gdc_data(conn)
+        conn.executemany("INSERT INTO gdc_data (_time, event, data, value) VALUES (?, '2 Car', ?, 0)",
+                         [('2020-10-10 07:00:00', 'closed'), ('2020-10-10 07:01:00', 'opening'),
+                          ('2020-10-10 07:03:00', 'closed'), ('2020-10-10 09:00:00', 'opening')])
+        db_Schema.migrate(conn)
+        self.assertEqual([('2020-10-10 07:01:00', '2020-10-10 07:03:00', 120), ('2020-10-10 09:00:00', None, None)],
+                         conn.execute("SELECT opened_at, closed_at, duration FROM gdc_door_session ORDER BY id").fetchall())
+        # the open session is closed by the trigger
+        conn.execute("INSERT INTO gdc_data (_time, event, data, value) VALUES ('2020-10-10 09:00:30', '2 Car', 'closed', 0)")
+        self.assertEqual(30, conn.execute("SELECT duration FROM gdc_door_session WHERE opened_at = '2020-10-10 09:00:00'").fetchone()[0])
+
+    def testDoorStats(self):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        conn = sqlite3.connect(path)
+        db_Schema.migrate(conn)
+        day = (datetime.datetime.now() - datetime.timedelta(days=1)).strftime('%Y-%m-%d')
+        rows = []
+        for hour, minute, secs in ((7, 0, 60), (7, 30, 300), (18, 0, 900)):
+            opened = datetime.datetime.strptime("%s %02d:%02d:00" % (day, hour, minute), '%Y-%m-%d %H:%M:%S')
+            rows += [(opened.strftime('%Y-%m-%d %H:%M:%S'), 'opening'),
+                     ((opened + datetime.timedelta(seconds=secs)).strftime('%Y-%m-%d %H:%M:%S'), 'closed')]
+        with conn:
+            conn.executemany("INSERT INTO gdc_data (_time, event, data, value) VALUES (?, '2 Car', ?, 0)", sorted(rows))
+        conn.close()
+
+        db_Utils.db.open(path)
+        try:
+            stats = db_Utils.query_door_stats(["2 Car", "1 Car"], 7)
+            text = db_Utils.query_garage_open_close(["2 Car"])
+            body = Controller.ClickOpenCloseHandler(FakeController(["2 Car"])).render(DummyRequest(['openclose']))
+        finally:
+            db_Utils.db.close()
+            os.remove(path)
+        s = stats["2 Car"]
+        self.assertEqual(3, s["count"])
+        self.assertEqual(420, s["average"])
+        self.assertEqual([900, 300, 60], [l["duration"] for l in s["longest"]])
+        self.assertEqual(2, s["by_hour"][7])
+        self.assertEqual(180, s["average_by_hour"][7])
+        self.assertEqual(0, stats["1 Car"]["count"])
+        self.assertEqual(6, len(text.splitlines()))
+        self.assertEqual(bytes, type(body))
+        self.assertTrue(text.encode('utf-8') in body)
+        self.assertTrue(text.splitlines()[-1].endswith("closed (%s)" % (db_Utils.Utils.get_elapsed_time(900))))
+
+    def testDoorStatsError(self):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        db_Utils.db.open(path)  # no schema, the query fails
+        try:
+            self.assertRaises(sqlite3.DatabaseError, db_Utils.query_door_stats, ["2 Car"], 7)
+            self.assertRaises(sqlite3.DatabaseError, db_Utils.query_garage_open_close, ["2 Car"])
+        finally:
+            db_Utils.db.close()
+            os.remove(path)
+
+    def testHotQueriesUseIndexes(self):
+        conn = self.setup()
+        for name, (ok, plan) in db_Schema.check_query_plans(conn, db_Utils.hot_queries()).items():
+            self.assertTrue(ok, "%s: %s" % (name, plan))
+
+    def testFullScanDetected(self):
+        conn = self.setup()
+        plan = db_Schema.get_query_plan(conn, "SELECT * FROM gdc_data WHERE data=?", ["closed"])
+        self.assertFalse(db_Schema.uses_index(plan))
+
+#
+# python db_schema_test.py -v
+#
+if __name__ == '__main__':
+    unittest.main()
@@ -6,23 +6,73 @@ import json
 import datetime
 import utils as Utils
 import sqlite3
+import threading
+import metrics as Metrics
 from enum import Enum
 from datetime import timedelta
 from time import gmtime
-import requests
+import startup as Startup
+
+requests = Startup.LazyModule('requests')
+
+
+DB_PATH = '/home/pi/db/gdc'
+STATEMENT_CACHE_SIZE = 32
+
+ORDER_BY_COLUMNS = ("_time", "id")
+ORDER_BY_DIRECTIONS = ("", "asc", "desc")
+
+QUERY_SECONDS = Metrics.histogram('gdc_db_query_seconds', 'Time to run a query_db statement and fetch its rows')
+
+
+class ConnectionManager(object):
+    """Long lived sqlite connections, one per thread, each with a bounded prepared statement cache"""
+
+    def __init__(self, path, cached_statements=STATEMENT_CACHE_SIZE):
+        self.path = path
+        self.cached_statements = cached_statements
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.connections = []
+
+    def connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn == None:
+            conn = sqlite3.connect(self.path, cached_statements=self.cached_statements, check_same_thread=False)
+            self.local.conn = conn
+            with self.lock:
+                self.connections.append(conn)
+        return conn
+
+    def open(self, path):
+        self.close()
+        self.path = path
+
+    def close(self):
+        with self.lock:
+            connections, self.connections = self.connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except:
+                pass
+        self.local = threading.local()
+
+
+db = ConnectionManager(DB_PATH)
 
 
 def build_sql(eventNames, limit, orderby, desc_asc, days=0):
-    sql = ("SELECT * FROM gdc_data WHERE event=")
-    cnt = 0
-    for event in eventNames:
-        if cnt != 0:
-            sql += " or event="
-        cnt += 1
-        sql += "\'" + event + "\'"
-        
+    if orderby not in ORDER_BY_COLUMNS or desc_asc not in ORDER_BY_DIRECTIONS:
+        raise ValueError("build_sql: invalid order by %s %s" % (orderby, desc_asc))
+
+    # the sql text only depends on the number of events, so sqlite can reuse the statement
+    params = list(eventNames)
+    sql = "SELECT * FROM gdc_data WHERE event IN (%s)" % (",".join("?" * len(params)))
+
     if days != 0:
-        sql += "and _time >= date('now','-"+str(days)+" days')"
+        sql += " and _time >= date('now', ?)"
+        params.append("-%d days" % (days))
 
     sql += " ORDER BY " + orderby + " "
 
@@ -30,16 +80,87 @@ def build_sql(eventNames, limit, orderby, desc_asc, days=0):
         sql += desc_asc
 
     if limit > 0:
-        sql += " LIMIT %d" % (limit)
-
-    return sql
-
-
-def query_db(sql):
-    conn = sqlite3.connect('/home/pi/db/gdc')
+        sql += " LIMIT ?"
+        params.append(limit)
+
+    return sql, params
+
+
+def build_export_sql(eventNames, time_from, time_to):
+    """gdc_data rows in an order sqlite can stream without sorting, through the (event, _time) index when filtered by event"""
+    params = list(eventNames)
+    where = []
+    if params:
+        where.append("event IN (%s)" % (",".join("?" * len(params))))
+    if time_from:
+        where.append("_time >= ?")
+        params.append(time_from)
+    if time_to:
+        where.append("_time < ?")
+        params.append(time_to)
+
+    sql = "SELECT * FROM gdc_data"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY event, _time" if eventNames else " ORDER BY id"
+    return sql, params
+
+
+def build_hourly_export_sql(eventNames, time_from, time_to):
+    """gdc_hourly_temperature rows, the readings db.compact rolled up, in primary key order"""
+    params = list(eventNames)
+    where = []
+    if params:
+        where.append("event IN (%s)" % (",".join("?" * len(params))))
+    if time_from:
+        where.append("hour >= ?")
+        params.append(time_from)
+    if time_to:
+        where.append("hour < ?")
+        params.append(time_to)
+
+    sql = "SELECT event, hour, min, max, mean, count FROM gdc_hourly_temperature"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    return sql + " ORDER BY event, hour", params
+
+
+def build_door_sessions_sql(door, limit):
+    return ("SELECT opened_at, closed_at, duration FROM gdc_door_session WHERE door = ? ORDER BY opened_at DESC LIMIT ?",
+            [door, limit])
+
+
+def build_door_stats_sql(doors, days):
+    params = list(doors) + ["-%d days" % (days)]
+    sql = ("SELECT door, opened_at, duration FROM gdc_door_session WHERE door IN (%s) AND opened_at >= date('now', ?) "
+           "AND duration IS NOT NULL" % (",".join("?" * len(doors))))
+    return sql, params
+
+
+def build_daily_temperature_sql(eventNames, days):
+    params = list(eventNames)
+    sql = ("SELECT day, MIN(min), MAX(max) FROM gdc_daily_temperature WHERE event IN (%s)"
+           " and day >= date('now', ?) GROUP BY day ORDER BY day" % (",".join("?" * len(params))))
+    params.append("-%d days" % (days))
+    return sql, params
+
+
+def hot_queries():
+    """the queries behind /graph, /temps, /openclose and /export, see db_schema.check_query_plans"""
+    return {
+        "export": build_export_sql(["garage_temperature"], "2020-01-01", "2021-01-01"),
+        "export_hourly": build_hourly_export_sql(["garage_temperature"], "2020-01-01", "2021-01-01"),
+        "graph": build_daily_temperature_sql(["garage_temperature"], 180),
+        "temps": build_sql(["garage_temperature", "shed_temperature"], 75, "_time", "desc"),
+        "openclose": build_door_sessions_sql("2 Car", 15),
+        "doorstats": build_door_stats_sql(["1 Car", "2 Car"], 30),
+    }
+
+
+@Metrics.timed(QUERY_SECONDS)
+def query_db(sql, params=()):
     try:
-        c = conn.cursor()
-        c.execute(sql)
+        c = db.connection().execute(sql, params)
         return(c.fetchall())
     except:
         return ("ERROR: query_db: sql:%s -- %s", sql, sys.exc_info()[0])
@@ -47,9 +168,39 @@ def query_db(sql):
     return None
 
 
+def query_rows(sql, params=()):
+    """query_db that raises on an error instead of returning it"""
+    rows = query_db(sql, params)
+    if not isinstance(rows, list):
+        raise sqlite3.DatabaseError(rows[0] % (rows[1], rows[2]))
+    return rows
+
+
+def insert_event(event, data, value, t=None):
+    """one gdc_data row, the way the mqtt subscriber stores them"""
+    t = t if t != None else datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    conn = db.connection()
+    with conn:
+        conn.execute("INSERT INTO gdc_data VALUES (NULL, ?, ?, ?, ?)", [t, event, data, value])
+
+
+def get_weather_day(date_value):
+    """returns (day, fetched_at, final) for a stored weatherapi date, or None"""
+    rows = query_db("SELECT data, fetched_at, final FROM gdc_weather_day WHERE date=?", [date_value])
+    if not isinstance(rows, list) or rows == []:
+        return None
+    return (json.loads(rows[0][0]), rows[0][1], rows[0][2] == 1)
+
+
+def put_weather_day(date_value, day, fetched_at, final):
+    conn = db.connection()
+    with conn:
+        conn.execute("INSERT OR REPLACE INTO gdc_weather_day (date, data, fetched_at, final) VALUES (?, ?, ?, ?)",
+                     [date_value, json.dumps(day), fetched_at, 1 if final else 0])
+
+
 def query_temperatures(eventNames, limit):
-    sql = build_sql(eventNames, limit, "_time", "desc")
-    rows = query_db(sql)
+    rows = query_db(*build_sql(eventNames, limit, "_time", "desc"))
     try:
         data = ""
         for row in rows:
@@ -62,8 +213,7 @@ def query_temperatures(eventNames, limit):
 
 
 def query_day_temperature_data():
-    sql = build_sql(["day_temperature"], 20, "_time", "desc")
-    rows = query_db(sql)
+    rows = query_db(*build_sql(["day_temperature"], 20, "_time", "desc"))
 
     weather_info = {}
     weather_info["weather_temps"] = []
@@ -83,8 +233,7 @@ def query_day_temperature_data():
 
 
 def query_day_temp_data():
-    sql = build_sql(["day_temperature"], 0, "_time", "")
-    rows = query_db(sql)
+    rows = query_db(*build_sql(["day_temperature"], 0, "_time", ""))
 
     avg_temp = {}
     for row in rows:
@@ -103,30 +252,15 @@ def query_day_temp_data():
 
 
 def query_temperature_data(eventName, controller):
-    sql = build_sql(eventName, 0, "_time", "", 180)
-    #sql = "SELECT * FROM gdc_data WHERE event='shed_temperature' and _time >= date('now','-100 days') ORDER BY _time"
-    rows = query_db(sql)
+    rows = query_db(*build_daily_temperature_sql(eventName, 180))
 
     curr_date = Utils.get_date_time().strftime('%Y-%m-%d')
     avg_temp = query_day_temp_data()
 
+    # daily low/high from the rollup maintained by db_schema
     high_low = {}
     for row in rows:
-        hl_date = row[1].split(" ")[0]
-
-        if hl_date not in high_low.keys():
-            high_low[hl_date] = [0, 0]
-        try:
-            low_temp = float(high_low[hl_date][0])
-            high_temp = float(high_low[hl_date][1])
-            temperature = float(row[4])
-
-            if temperature < low_temp or low_temp == 0:
-                high_low[hl_date][0] = temperature
-            if temperature > high_temp or high_temp == 0:
-                high_low[hl_date][1] = temperature
-        except:
-            continue
+        high_low[row[0]] = [row[1], row[2]]
 
     # add todays avg temperature to db
     Utils.query_weather_API_by_date(requests, controller, curr_date)
@@ -145,25 +279,37 @@ def query_temperature_data(eventName, controller):
 
 
 
-def query_garage_open_close():
-    sql = build_sql(["2 Car"], 30, "id", "desc")
-    rows = query_db(sql)
-
+def query_garage_open_close(doors, limit=15):
+    """the last limit open/close cycles of each door, oldest first"""
     data = ""
-    open_time = ""
-    time_diff = ""
-
-    for row in reversed(rows):
-        time_diff = ""
-        if row[3] == "closed" and open_time != "":
-            dt1 = datetime.datetime.strptime(open_time, "%Y-%m-%d %H:%M:%S")
-            dt2 = datetime.datetime.strptime(row[1], "%Y-%m-%d %H:%M:%S")
-            tot_sec = (dt2-dt1).total_seconds()
-            time_diff = " (%s)" % (Utils.get_elapsed_time(int(tot_sec)))
-
-        open_time = ""
-        if row[3] == "opening":
-            open_time = row[1]
-
-        data += "%s %s%s\n" % (str(row[1]), str(row[3]), time_diff)
+    for door in doors:
+        if len(doors) > 1:
+            data += "%s\n" % (door)
+        for opened_at, closed_at, duration in reversed(query_rows(*build_door_sessions_sql(door, limit))):
+            data += "%s opening\n" % (opened_at)
+            if closed_at != None:
+                data += "%s closed (%s)\n" % (closed_at, Utils.get_elapsed_time(duration))
     return (data)
+
+
+def query_door_stats(doors, days, longest=5):
+    """per door: number of opens, average and longest open durations (secs) and opens per hour of the day"""
+    stats = dict((door, {"count": 0, "average": 0, "longest": [], "by_hour": [0] * 24, "average_by_hour": [0] * 24})
+                 for door in doors)
+    if doors == []:
+        return stats
+    for door, opened_at, duration in query_rows(*build_door_stats_sql(doors, days)):
+        s = stats[door]
+        hour = int(opened_at[11:13])
+        s["count"] += 1
+        s["average"] += duration
+        s["by_hour"][hour] += 1
+        s["average_by_hour"][hour] += duration
+        s["longest"].append((duration, opened_at))
+    for s in stats.values():
+        if s["count"] > 0:
+            s["average"] = s["average"] / float(s["count"])
+        s["average_by_hour"] = [total / float(n) if n > 0 else 0 for total, n in zip(s["average_by_hour"], s["by_hour"])]
+        s["longest"] = [{"opened_at": opened_at, "duration": duration}
+                        for duration, opened_at in sorted(s["longest"], reverse=True)[:longest]]
+    return stats
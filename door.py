@@ -1,7 +1,14 @@
+import collections
 import utils as Utils
 import controller as Controller
 import time as time
 
+# door states a checkpoint can resume from for each state pin level
+RESUMABLE_STATES = {
+    Utils.OPEN: (Utils.OPEN, Utils.OPENING),
+    Utils.CLOSED: (Utils.CLOSED, Utils.CLOSING)
+}
+
 
 class Door(object):
     def __init__(self, doorId, config):
@@ -18,6 +25,7 @@ class Door(object):
         self.send_open_im_debug = False
         self.send_open_mqtt = True
         self.send_close_mqtt = True
+        self.version = 0
         self.tis = {
             Utils.CLOSED: 0,
             Utils.OPEN: 0,
@@ -45,6 +53,28 @@ class Door(object):
         self.send_open_im = True
         self.send_open_im_debug = True
 
+    """everything a restart needs to carry on where it left off"""
+
+    def checkpoint(self):
+        return {'state': self.state, 'tis': dict(self.tis), 'tslo': self.tslo, 'send_open_im': self.send_open_im,
+                'send_open_im_debug': self.send_open_im_debug, 'send_open_mqtt': self.send_open_mqtt,
+                'send_close_mqtt': self.send_close_mqtt}
+
+    """resume from a checkpoint taken before the restart, unless the door moved while we were down;
+    call after setup, returns True if the checkpoint was used"""
+
+    def restore(self, saved):
+        if saved.get('state') not in RESUMABLE_STATES[self.get_state_pin()]:
+            return False
+        self.state = saved['state']
+        self.tis.update(saved['tis'])
+        self.tslo = saved['tslo']
+        self.send_open_im = saved['send_open_im']
+        self.send_open_im_debug = saved['send_open_im_debug']
+        self.send_open_mqtt = saved['send_open_mqtt']
+        self.send_close_mqtt = saved['send_close_mqtt']
+        return True
+
     def setup_gpio(self, gpio):
         if Utils.isDebugging:
             return
@@ -53,6 +83,13 @@ class Door(object):
         self.gpio.setup(self.state_pin, gpio.IN, pull_up_down=gpio.PUD_UP)
         self.gpio.output(self.relay_pin, True)
 
+    """call callback(pin) on every edge of the state pin, bouncetime is in ms"""
+
+    def setup_event_detect(self, callback, bouncetime):
+        if Utils.isDebugging:
+            return
+        self.gpio.add_event_detect(self.state_pin, self.gpio.BOTH, callback=callback, bouncetime=bouncetime)
+
     """returns OPEN or CLOSED for a given garages door state pin"""
 
     def get_state_pin(self):
@@ -75,3 +112,46 @@ class Door(object):
         self.gpio.output(self.relay_pin, False)
         time.sleep(1)
         self.gpio.output(self.relay_pin, True)
+
+
+class DoorRegistry(object):
+    """doors keyed by id, each state change is stamped with the next version"""
+
+    def __init__(self, doors):
+        self.by_id = {}
+        self.by_pin = {}
+        self.recent = collections.OrderedDict()  # door id -> door, least recently changed first
+        self.version = 0
+        for door in doors:
+            self.add(door)
+
+    def add(self, door):
+        self.by_id[door.id] = door
+        if door.state_pin != None:
+            self.by_pin[door.state_pin] = door
+        self.touch(door)
+
+    def get(self, door_id):
+        return self.by_id.get(door_id)
+
+    def get_by_pin(self, pin):
+        return self.by_pin.get(pin)
+
+    def touch(self, door):
+        self.version += 1
+        door.version = self.version
+        self.recent.pop(door.id, None)
+        self.recent[door.id] = door
+        return self.version
+
+    """doors changed after version, oldest change first, costs O(changed doors)"""
+
+    def changed_since(self, version):
+        changed = []
+        for door_id in reversed(self.recent):
+            door = self.recent[door_id]
+            if door.version <= version:
+                break
+            changed.append(door)
+        changed.reverse()
+        return changed
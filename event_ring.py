@@ -0,0 +1,32 @@
+#!/usr/bin/env python
+"""Fixed size, array backed ring buffer of recent controller events."""
+import collections
+import threading
+import time
+
+DOOR = 'door'
+ALERT = 'alert'
+MOTION = 'motion'
+MQTT = 'mqtt'
+
+Event = collections.namedtuple('Event', ['seq', 'time', 'kind', 'door', 'message'])
+
+
+class EventRing(object):
+
+    def __init__(self, size=1000):
+        self.size = size
+        self.events = [None] * size
+        self.seq = 0  # seq of the newest event, event n lives in events[n % size]
+        self.lock = threading.Lock()  # on_motion runs on the gpio thread
+
+    def add(self, kind, door, message, t=None):
+        with self.lock:
+            self.seq += 1
+            self.events[self.seq % self.size] = Event(self.seq, t if t != None else time.time(), kind, door, message)
+
+    """events newer than seq, oldest first, in O(k) for k events returned"""
+    def since(self, seq):
+        with self.lock:
+            first = max(seq + 1, self.seq - self.size + 1, 1)
+            return [self.events[n % self.size] for n in range(first, self.seq + 1)]
@@ -0,0 +1,27 @@
+import unittest
+import event_ring as EventRing
+
+
+class Test(unittest.TestCase):
+
+    def testSince(self):
+        ring = EventRing.EventRing(4)
+        self.assertEqual([], ring.since(0))
+        ring.add(EventRing.DOOR, "right", "opening", 1.0)
+        ring.add(EventRing.ALERT, "right", "2 Car is open", 2.0)
+        self.assertEqual([1, 2], [e.seq for e in ring.since(0)])
+        self.assertEqual([EventRing.Event(2, 2.0, EventRing.ALERT, "right", "2 Car is open")], ring.since(1))
+        self.assertEqual([], ring.since(2))
+
+    def testWrapAround(self):
+        ring = EventRing.EventRing(4)
+        for i in range(10):
+            ring.add(EventRing.MQTT, None, "msg %d" % i)
+        self.assertEqual([7, 8, 9, 10], [e.seq for e in ring.since(0)])
+        self.assertEqual(["msg 8", "msg 9"], [e.message for e in ring.since(8)])
+
+#
+# python event_ring_test.py -v
+#
+if __name__ == '__main__':
+    unittest.main()
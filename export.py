@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+"""Stream gdc_data as csv or ndjson, a chunk of rows at a time, paced by the client connection."""
+import csv
+import datetime
+import json
+import logging
+import sqlite3
+import StringIO
+
+from twisted.internet import defer
+from twisted.internet.interfaces import IPushProducer
+from zope.interface import implements
+
+CHUNK_ROWS = 500
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'  # gdc_data._time
+
+
+def parse_time(value):
+    """'YYYY-mm-dd[ HH:MM[:SS]]' -> the _time format, so the bound compares as text"""
+    if value == None or value == '':
+        return None
+    for fmt in (TIME_FORMAT, '%Y-%m-%d %H:%M', '%Y-%m-%d'):
+        try:
+            return datetime.datetime.strptime(value, fmt).strftime(TIME_FORMAT)
+        except ValueError:
+            continue
+    raise ValueError("invalid time %s" % (value))
+
+
+class CsvFormat(object):
+    content_type = 'text/csv'
+    extension = 'csv'
+
+    def write(self, rows):
+        out = StringIO.StringIO()
+        writer = csv.writer(out)
+        for row in rows:
+            writer.writerow([v.encode('utf-8') if isinstance(v, unicode) else v for v in row])
+        return out.getvalue()
+
+    def header(self, columns):
+        return self.write([columns])
+
+    def rows(self, columns, rows):
+        return self.write(rows)
+
+
+class NdjsonFormat(object):
+    content_type = 'application/x-ndjson'
+    extension = 'ndjson'
+
+    def header(self, columns):
+        return ''
+
+    def rows(self, columns, rows):
+        return ''.join(json.dumps(dict(zip(columns, row))) + '\n' for row in rows)
+
+
+FORMATS = {'csv': CsvFormat, 'ndjson': NdjsonFormat}
+
+
+class ExportProducer(object):
+    """writes the rows of sql to request as the transport asks for them; the cursor lives on
+    its own connection and every fetchmany runs on a worker thread"""
+    implements(IPushProducer)
+
+    def __init__(self, request, path, sql, params, format, workers, chunk_rows=CHUNK_ROWS):
+        self.request = request
+        self.path = path
+        self.sql = sql
+        self.params = params
+        self.format = format
+        self.workers = workers
+        self.chunk_rows = chunk_rows
+        self.conn = None
+        self.cursor = None
+        self.columns = None
+        self.paused = False
+        self.fetching = False
+        self.done = False
+        self.cancelled = False  # set on the reactor, checked by next_chunk on the worker
+        self.rows = 0
+
+    def start(self):
+        self.request.notifyFinish().addErrback(lambda f: self.stopProducing())
+        self.request.registerProducer(self, True)
+        if not self.fetching and not self.done:
+            self.fetch()
+
+    def fetch(self):
+        self.fetching = True
+        d = self.workers.run('export', self.next_chunk)
+        d.addCallbacks(self.write_chunk, self.failed)
+
+    """worker thread, a cancelled export reads nothing more and the worker closes its own connection"""
+    def next_chunk(self):
+        try:
+            if self.cancelled:
+                return []
+            if self.cursor == None:
+                self.conn = sqlite3.connect(self.path, check_same_thread=False)
+                self.cursor = self.conn.execute(self.sql, self.params)
+                self.columns = [d[0] for d in self.cursor.description]
+            return self.cursor.fetchmany(self.chunk_rows)
+        finally:
+            if self.cancelled:
+                self.close()
+
+    def write_chunk(self, rows):
+        self.fetching = False
+        if self.done:
+            self.close()
+            return
+        header = self.format.header(self.columns) if self.rows == 0 else ''
+        if header != '':
+            self.request.write(header)
+        if rows == []:
+            self.finish()
+            return
+        self.rows += len(rows)
+        self.request.write(self.format.rows(self.columns, rows))
+        if not self.paused:
+            self.fetch()
+
+    def failed(self, f):
+        self.fetching = False
+        logging.error("Error exporting %s: %s" % (self.sql, f.getErrorMessage()))
+        if not self.done:
+            self.done = True
+            self.request.unregisterProducer()
+            # no terminating chunk, the client sees a truncated response rather than a complete one
+            self.request.loseConnection()
+        if f.check(defer.TimeoutError, defer.CancelledError):
+            # the worker is still in next_chunk, it stops and closes the connection itself
+            self.cancel()
+        else:
+            self.close()
+
+    def finish(self):
+        self.done = True
+        self.request.unregisterProducer()
+        self.request.finish()
+        self.close()
+        logging.info("Exported %d rows" % (self.rows))
+
+    def cancel(self):
+        self.cancelled = True
+        conn = self.conn
+        if conn != None:
+            try:
+                conn.interrupt()  # aborts a fetchmany in progress on the worker
+            except sqlite3.ProgrammingError:
+                pass  # the worker closed it first
+
+    def close(self):
+        if self.conn != None:
+            self.conn.close()
+            self.conn = None
+            self.cursor = None
+
+    def pauseProducing(self):
+        self.paused = True
+
+    def resumeProducing(self):
+        self.paused = False
+        if not self.fetching and not self.done:
+            self.fetch()
+
+    """client went away, an in-flight fetch is interrupted and closes the connection when it returns"""
+    def stopProducing(self):
+        self.done = True
+        if self.fetching:
+            self.cancel()
+        else:
+            self.close()
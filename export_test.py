@@ -0,0 +1,155 @@
+import json
+import os
+import sqlite3
+import tempfile
+import unittest
+import db_schema as db_Schema
+import db_utils as db_Utils
+import export as Export
+
+from twisted.internet import defer
+from twisted.web.test.requesthelper import DummyRequest
+
+
+class FakeWorkers(object):
+    def run(self, name, f, *args, **kwargs):
+        return defer.maybeDeferred(f, *args, **kwargs)
+
+
+class SlowClientRequest(DummyRequest):
+    """pauses its producer after every write, like a transport with a full buffer"""
+
+    def registerProducer(self, producer, streaming):
+        self.producer = producer
+
+    def unregisterProducer(self):
+        self.producer = None
+
+    def write(self, data):
+        DummyRequest.write(self, data)
+        if self.producer != None:
+            self.producer.pauseProducing()
+
+
+class HeldWorkers(object):
+    """keeps each call for the test to run later, like a worker thread still busy when its Deferred times out"""
+
+    def __init__(self):
+        self.calls = []
+
+    def run(self, name, f, *args, **kwargs):
+        d = defer.Deferred()
+        self.calls.append((d, f))
+        return d
+
+
+class DroppedRequest(SlowClientRequest):
+    def loseConnection(self):
+        self.lost = True
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+        conn = sqlite3.connect(self.path)
+        db_Schema.create_gdc_data(conn)
+        rows = [("2020-01-01 %02d:00:00" % h, "garage_temperature", '{"t":%d}' % h, 60 + h) for h in range(10)]
+        rows += [("2020-01-01 %02d:30:00" % h, "shed_temperature", '{"t":%d}' % h, 50 + h) for h in range(10)]
+        with conn:
+            conn.executemany("INSERT INTO gdc_data (_time, event, data, value) VALUES (?, ?, ?, ?)", rows)
+        conn.close()
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def export(self, request, events, time_from, time_to, format, chunk_rows=3):
+        sql, params = db_Utils.build_export_sql(events, time_from, time_to)
+        producer = Export.ExportProducer(request, self.path, sql, params, format, FakeWorkers(), chunk_rows)
+        producer.start()
+        return producer
+
+    def testCsv(self):
+        request = DummyRequest(['export'])
+        self.export(request, ["garage_temperature"], "2020-01-01 02:00:00", "2020-01-01 06:00:00", Export.CsvFormat())
+        lines = "".join(request.written).splitlines()
+        self.assertEqual("id,_time,event,data,value", lines[0])
+        self.assertEqual(['2020-01-01 02:00:00', '2020-01-01 03:00:00', '2020-01-01 04:00:00', '2020-01-01 05:00:00'],
+                         [l.split(',')[1] for l in lines[1:]])
+        self.assertEqual(1, request.finished)
+
+    def testNdjsonAllEvents(self):
+        request = DummyRequest(['export'])
+        self.export(request, [], None, None, Export.NdjsonFormat())
+        rows = [json.loads(l) for l in "".join(request.written).splitlines()]
+        self.assertEqual(20, len(rows))
+        self.assertEqual(range(1, 21), [r['id'] for r in rows])
+
+    def testHourlyTier(self):
+        conn = sqlite3.connect(self.path)
+        db_Schema.create_hourly_temperature(conn)
+        with conn:
+            conn.executemany("INSERT INTO gdc_hourly_temperature VALUES (?, ?, 60, 70, 65, 12)",
+                             [("garage_temperature", "2019-06-01 %02d:00:00" % h) for h in range(5)] +
+                             [("shed_temperature", "2019-06-01 01:00:00")])
+        conn.close()
+        request = DummyRequest(['export'])
+        sql, params = db_Utils.build_hourly_export_sql(["garage_temperature"], "2019-06-01 01:00:00", "2019-06-01 03:00:00")
+        Export.ExportProducer(request, self.path, sql, params, Export.CsvFormat(), FakeWorkers(), 3).start()
+        lines = "".join(request.written).splitlines()
+        self.assertEqual("event,hour,min,max,mean,count", lines[0])
+        self.assertEqual(["garage_temperature,2019-06-01 01:00:00,60.0,70.0,65.0,12",
+                          "garage_temperature,2019-06-01 02:00:00,60.0,70.0,65.0,12"], lines[1:])
+
+    def testBackpressure(self):
+        request = SlowClientRequest(['export'])
+        producer = self.export(request, ["shed_temperature"], None, None, Export.NdjsonFormat())
+        self.assertEqual(1, len(request.written))  # first chunk, then paused
+        producer.resumeProducing()
+        self.assertEqual(2, len(request.written))
+        for i in range(3):
+            producer.resumeProducing()
+        self.assertEqual(10, len("".join(request.written).splitlines()))
+        self.assertEqual(1, request.finished)
+        self.assertEqual(None, producer.conn)
+
+    def testStopClosesConnection(self):
+        request = SlowClientRequest(['export'])
+        producer = self.export(request, [], None, None, Export.CsvFormat())
+        producer.stopProducing()
+        producer.resumeProducing()
+        self.assertEqual(None, producer.conn)
+        self.assertEqual(0, request.finished)
+
+    def testTimeoutCancelsWorker(self):
+        request = DroppedRequest(['export'])
+        workers = HeldWorkers()
+        sql, params = db_Utils.build_export_sql([], None, None)
+        producer = Export.ExportProducer(request, self.path, sql, params, Export.CsvFormat(), workers, 3)
+        producer.start()
+        d, f = workers.calls.pop()
+        d.callback(f())  # the first chunk opens the cursor
+        self.assertNotEqual(None, producer.conn)
+        producer.resumeProducing()
+
+        d, f = workers.calls.pop()
+        d.errback(defer.TimeoutError())
+        self.assertTrue(producer.cancelled)
+        self.assertTrue(request.lost)
+        self.assertNotEqual(None, producer.conn)  # still the worker's
+        self.assertEqual([], f())  # the worker reads nothing more and closes its connection
+        self.assertEqual(None, producer.conn)
+        self.assertEqual(0, request.finished)
+
+    def testParseTime(self):
+        self.assertEqual("2020-01-01 00:00:00", Export.parse_time("2020-01-01"))
+        self.assertEqual("2020-01-01 12:30:00", Export.parse_time("2020-01-01 12:30"))
+        self.assertEqual(None, Export.parse_time(""))
+        self.assertRaises(ValueError, Export.parse_time, "yesterday")
+
+#
+# python export_test.py -v
+#
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+"""Store the door and temperature messages from mqtt in gdc_data, in batched transactions on a WAL database."""
+import ast
+import collections
+import datetime
+import json
+import logging
+import sqlite3
+import threading
+
+import metrics as Metrics
+
+from twisted.internet import reactor, defer, task
+
+COMMIT_INTERVAL = 5.0
+MAX_BATCH = 500  # rows that trigger a commit before the interval is up
+MAX_QUEUE = 10000  # rows kept while the db is unwritable, oldest dropped first
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'  # gdc_data._time
+
+# how a topic's payload becomes a gdc_data row
+DOOR = 'door'  # "2 Car|opening"
+TEMPERATURE = 'temperature'  # { "date":..., "temperature_f":70.1, "humidity":40.0 }
+DAY_TEMPERATURE = 'day_temperature'  # str() of the weatherapi day dict
+
+BATCH_ROWS = Metrics.histogram('gdc_ingest_batch_rows', 'Rows per ingest transaction', buckets=(1, 5, 10, 50, 100, 500, 1000))
+COMMIT_SECONDS = Metrics.histogram('gdc_ingest_commit_seconds', 'Time to write and commit an ingest batch')
+DROPPED = Metrics.counter('gdc_ingest_dropped_total', 'Messages dropped, unparseable or over the queue limit')
+
+
+def parse_payload(payload):
+    try:
+        return json.loads(payload)
+    except ValueError:
+        return ast.literal_eval(payload)
+
+
+def to_row(kind, topic, payload, t):
+    """(_time, event, data, value) for a message, raises if the payload doesn't parse"""
+    event = topic.split('/')[0]
+    if kind == DOOR:
+        door, state = payload.split('|', 1)
+        return (t, door, state, 0)
+    if kind == TEMPERATURE:
+        return (t, event, payload, float(parse_payload(payload)['temperature_f']))
+    if kind == DAY_TEMPERATURE:
+        return (t, event, payload, float(parse_payload(payload)['avgtemp_f']))
+    raise ValueError("unknown topic kind %s" % (kind))
+
+
+class Ingestor(object):
+    def __init__(self, path, workers, topics, commit_interval=COMMIT_INTERVAL, max_batch=MAX_BATCH,
+                 max_queue=MAX_QUEUE, clock=reactor, call_from_thread=reactor.callFromThread):
+        self.path = path
+        self.workers = workers
+        self.topics = topics  # topic -> DOOR, TEMPERATURE or DAY_TEMPERATURE
+        self.commit_interval = commit_interval
+        self.max_batch = max_batch
+        self.clock = clock
+        self.call_from_thread = call_from_thread
+        self.queue = collections.deque(maxlen=max_queue)
+        self.lock = threading.Lock()
+        self.conn = None
+        self.data_columns = None
+        self.writing = False
+        self.in_flight = None
+        self.flush_scheduled = False
+        self.listeners = []  # called on the reactor thread with the set of events of every committed batch
+
+    def subscribe(self, mqtt):
+        for topic, kind in self.topics.items():
+            mqtt.subscribe(topic, self.on_message, 1)
+
+    def start(self):
+        self.committer = task.LoopingCall(self.flush)
+        self.committer.clock = self.clock
+        self.committer.start(self.commit_interval, now=False)
+
+    """paho's network thread"""
+    def on_message(self, topic, payload):
+        t = datetime.datetime.now().strftime(TIME_FORMAT)
+        try:
+            row = to_row(self.topics[topic], topic, payload, t)
+        except Exception as e:
+            DROPPED.inc()
+            logging.warning("Ingest dropped %s %r: %s" % (topic, payload, e))
+            return
+        with self.lock:
+            if len(self.queue) == self.queue.maxlen:
+                DROPPED.inc()
+            self.queue.append(row)
+            full = len(self.queue) >= self.max_batch and not self.flush_scheduled
+            if full:
+                self.flush_scheduled = True
+        if full:
+            self.call_from_thread(self.flush)
+
+    """write what is queued in one transaction on the db worker, one batch at a time"""
+    def flush(self):
+        self.flush_scheduled = False
+        if self.writing:
+            return defer.succeed(None)
+        with self.lock:
+            rows = list(self.queue)
+            self.queue.clear()
+        if rows == []:
+            return defer.succeed(None)
+        self.writing = True
+        # never timed out, writing stays set until the thread has returned and no two threads share self.conn
+        d = self.workers.run('ingest', self.write, rows)
+        d.addCallbacks(self.written, self.failed, errbackArgs=(rows,))
+        self.in_flight = d
+        return d
+
+    """worker thread, the only user of self.conn"""
+    def write(self, rows):
+        if self.conn == None:
+            self.conn = sqlite3.connect(self.path, check_same_thread=False)
+            # readers never wait on the writer, and only checkpoints fsync
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+        with COMMIT_SECONDS.time():
+            with self.conn:
+                self.conn.executemany("INSERT INTO gdc_data (_time, event, %s, %s) VALUES (?, ?, ?, ?)" % self.columns(), rows)
+        BATCH_ROWS.observe(len(rows))
+        return set(row[1] for row in rows)
+
+    def columns(self):
+        if self.data_columns == None:
+            cols = [row[1] for row in self.conn.execute("PRAGMA table_info(gdc_data)")]
+            self.data_columns = (cols[3], cols[4])
+        return self.data_columns
+
+    def written(self, events):
+        self.writing = False
+        for listener in self.listeners:
+            listener(events)
+
+    def failed(self, f, rows):
+        self.writing = False
+        logging.error("Error ingesting %d rows, kept for the next commit: %s" % (len(rows), f.getErrorMessage()))
+        with self.lock:
+            self.queue.extendleft(reversed(rows))
+
+    """commit what is left, for the shutdown trigger"""
+    def stop(self):
+        if self.committer.running:
+            self.committer.stop()
+        if self.writing:
+            d = defer.Deferred()
+            self.in_flight.addBoth(lambda x: d.callback(None))
+            return d.addCallback(lambda x: self.flush())
+        return self.flush()
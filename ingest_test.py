@@ -0,0 +1,100 @@
+import json
+import os
+import sqlite3
+import tempfile
+import unittest
+import db_schema as db_Schema
+import ingest as Ingest
+
+from twisted.internet import defer, task
+
+
+class FakeWorkers(object):
+    def __init__(self):
+        self.fail = False
+
+    def run(self, name, f, *args, **kwargs):
+        if self.fail:
+            return defer.fail(sqlite3.OperationalError("database is locked"))
+        return defer.maybeDeferred(f, *args, **kwargs)
+
+
+TOPICS = {"garage/action": Ingest.DOOR, "garage_temperature/action": Ingest.TEMPERATURE,
+          "day_temperature/action": Ingest.DAY_TEMPERATURE}
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+        conn = sqlite3.connect(self.path)
+        db_Schema.migrate(conn)
+        conn.close()
+        self.clock = task.Clock()
+        self.workers = FakeWorkers()
+        self.ingestor = Ingest.Ingestor(self.path, self.workers, TOPICS, commit_interval=5, max_batch=3,
+                                        clock=self.clock, call_from_thread=lambda f: f())
+        self.events = []
+        self.ingestor.listeners.append(self.events.append)
+        self.ingestor.start()
+
+    def tearDown(self):
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.path + suffix):
+                os.remove(self.path + suffix)
+
+    def rows(self):
+        conn = sqlite3.connect(self.path)
+        try:
+            return conn.execute("SELECT event, data, value FROM gdc_data ORDER BY id").fetchall()
+        finally:
+            conn.close()
+
+    def testToRow(self):
+        t = "2020-10-10 10:00:00"
+        self.assertEqual((t, "2 Car", "opening", 0), Ingest.to_row(Ingest.DOOR, "garage/action", "2 Car|opening", t))
+        payload = '{ "date":"10-10-2020 10:00:00", "temperature_f":70.1, "humidity":40.0 }'
+        self.assertEqual((t, "garage_temperature", payload, 70.1),
+                         Ingest.to_row(Ingest.TEMPERATURE, "garage_temperature/action", payload, t))
+        payload = str({'date': '2020-10-10', 'avgtemp_f': 55.5})
+        self.assertEqual(55.5, Ingest.to_row(Ingest.DAY_TEMPERATURE, "day_temperature/action", payload, t)[3])
+        self.assertRaises(ValueError, Ingest.to_row, Ingest.DOOR, "garage/action", "2 Car", t)
+
+    def testBatchedOnInterval(self):
+        self.ingestor.on_message("garage/action", "2 Car|opening")
+        self.ingestor.on_message("garage_temperature/action", json.dumps({"temperature_f": 70.0}))
+        self.assertEqual([], self.rows())
+        self.clock.advance(5)
+        self.assertEqual([("2 Car", "opening", 0), ("garage_temperature", '{"temperature_f": 70.0}', 70.0)], self.rows())
+        self.assertEqual([{"2 Car", "garage_temperature"}], self.events)
+        # the triggers saw the rows
+        conn = sqlite3.connect(self.path)
+        self.assertEqual(1, conn.execute("SELECT COUNT(*) FROM gdc_door_session").fetchone()[0])
+        self.assertEqual("wal", conn.execute("PRAGMA journal_mode").fetchone()[0])
+        conn.close()
+
+    def testFullBatchCommitsEarly(self):
+        for state in ("opening", "open", "closing"):
+            self.ingestor.on_message("garage/action", "2 Car|" + state)
+        self.assertEqual(3, len(self.rows()))
+
+    def testBadPayloadDropped(self):
+        self.ingestor.on_message("garage_temperature/action", "Error get_temperature")
+        self.clock.advance(5)
+        self.assertEqual([], self.rows())
+
+    def testFailedBatchKept(self):
+        self.workers.fail = True
+        self.ingestor.on_message("garage/action", "2 Car|opening")
+        self.clock.advance(5)
+        self.ingestor.on_message("garage/action", "2 Car|closed")
+        self.workers.fail = False
+        self.ingestor.stop()
+        self.assertEqual([("2 Car", "opening", 0), ("2 Car", "closed", 0)], self.rows())
+
+#
+# python ingest_test.py -v
+#
+if __name__ == '__main__':
+    unittest.main()
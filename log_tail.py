@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+"""Read a log backwards from EOF in blocks, following into the rotated .1/.2/.3 files."""
+import datetime
+import logging
+import os
+import re
+import time
+
+BLOCK_SIZE = 8192
+BACKUP_COUNT = 3
+MAX_LINES = 1000  # per page, the whole tail is read on the reactor thread
+
+# '%(asctime)s %(levelname)-8s %(message)s' with datefmt '%a, %m/%d/%y %H:%M:%S'
+LINE_RE = re.compile(r'^\w{3}, (\d\d/\d\d/\d\d \d\d:\d\d:\d\d) (\w+)\s')
+LINE_TIMEFORMAT = '%m/%d/%y %H:%M:%S'
+
+
+def log_path(path, index):
+    return path if index == 0 else "%s.%d" % (path, index)
+
+
+def lines_backwards(f, end, block_size=BLOCK_SIZE):
+    """yields (offset, line) for the lines of f that end before offset end, last line first"""
+    pos = end
+    tail = ''  # start of the line being assembled, continues into the next block
+    while pos > 0:
+        n = min(block_size, pos)
+        pos -= n
+        f.seek(pos)
+        parts = (f.read(n) + tail).split('\n')
+        tail = parts[0]
+
+        starts = []
+        start = pos + len(parts[0]) + 1
+        for part in parts[1:]:
+            starts.append(start)
+            start += len(part) + 1
+        for i in range(len(parts) - 1, 0, -1):
+            if parts[i] != '':
+                yield starts[i - 1], parts[i]
+    if tail != '':
+        yield 0, tail
+
+
+def parse_lines(lines, max_lines=MAX_LINES):
+    """?lines= as a positive count, capped at max_lines"""
+    n = int(lines)
+    if n <= 0:
+        raise ValueError("lines must be positive, not %d" % (n))
+    return min(n, max_lines)
+
+
+def parse_cursor(cursor):
+    """'<file index>:<offset>' -> (index, offset), None starts at the end of the current log"""
+    if cursor == None or cursor == '':
+        return (0, None)
+    index, offset = cursor.split(':')
+    return (int(index), int(offset))
+
+
+def parse_since(since):
+    """epoch seconds or 'YYYY-mm-dd HH:MM[:SS]'"""
+    if since == None or since == '':
+        return None
+    try:
+        return float(since)
+    except ValueError:
+        pass
+    for fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d'):
+        try:
+            return time.mktime(datetime.datetime.strptime(since, fmt).timetuple())
+        except ValueError:
+            continue
+    raise ValueError("invalid since %s" % (since))
+
+
+def parse_line(line):
+    """returns (epoch, levelno) of a log line, None for continuation lines (tracebacks)"""
+    m = LINE_RE.match(line)
+    if m == None:
+        return None
+    try:
+        t = time.mktime(datetime.datetime.strptime(m.group(1), LINE_TIMEFORMAT).timetuple())
+    except ValueError:
+        return None
+    level = logging.getLevelName(m.group(2))
+    return (t, level if isinstance(level, int) else logging.NOTSET)
+
+
+def entries_backwards(path, cursor=None, backups=BACKUP_COUNT, block_size=BLOCK_SIZE):
+    """yields (cursor, lines, parsed) per log record, newest first; cursor points at the record's first line"""
+    index, offset = parse_cursor(cursor)
+    continuation = []
+    while index <= backups:
+        try:
+            f = open(log_path(path, index), 'rb')
+        except IOError:
+            if index == 0:
+                raise
+            return
+        with f:
+            if offset == None:
+                f.seek(0, os.SEEK_END)
+                offset = f.tell()
+            for start, line in lines_backwards(f, offset, block_size):
+                parsed = parse_line(line)
+                if parsed == None:
+                    continuation.insert(0, line)
+                    continue
+                yield "%d:%d" % (index, start), [line] + continuation, parsed
+                continuation = []
+        index += 1
+        offset = None
+
+
+def tail(path, lines=60, before=None, level=None, since=None, backups=BACKUP_COUNT):
+    """yields (cursor, record) for up to lines records, newest first; pass the last cursor as before for the next page"""
+    min_level = logging.getLevelName(level.upper()) if level else logging.NOTSET
+    if not isinstance(min_level, int):
+        raise ValueError("invalid level %s" % (level))
+    since = parse_since(since)
+
+    count = 0
+    for cursor, record, (t, levelno) in entries_backwards(path, before, backups):
+        if count == lines or (since != None and t < since):
+            return
+        if levelno < min_level:
+            continue
+        count += 1
+        yield cursor, record
@@ -0,0 +1,67 @@
+import os
+import shutil
+import tempfile
+import unittest
+import log_tail as LogTail
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "gdc.log")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, path, lines):
+        with open(path, "wb") as f:
+            f.write("".join(line + "\n" for line in lines))
+
+    def line(self, minute, level, msg):
+        return "Sun, 10/18/20 10:%02d:00 %-8s %s" % (minute, level, msg)
+
+    def messages(self, records):
+        return [record[0].split()[-1] for cursor, record in records]
+
+    def testLinesBackwardsSmallBlocks(self):
+        self.write(self.path, ["one", "two", "", "three"])
+        with open(self.path, "rb") as f:
+            lines = list(LogTail.lines_backwards(f, os.path.getsize(self.path), 3))
+        self.assertEqual([(9, "three"), (4, "two"), (0, "one")], lines)
+
+    def testTailFollowsRotatedFiles(self):
+        self.write(self.path + ".1", [self.line(i, "INFO", "m%d" % i) for i in range(0, 5)])
+        self.write(self.path, [self.line(i, "INFO", "m%d" % i) for i in range(5, 8)])
+        records = list(LogTail.tail(self.path, 5))
+        self.assertEqual(["m7", "m6", "m5", "m4", "m3"], self.messages(records))
+
+        # next page starts before the last record returned
+        records = list(LogTail.tail(self.path, 5, records[-1][0]))
+        self.assertEqual(["m2", "m1", "m0"], self.messages(records))
+
+    def testTailLevelAndSince(self):
+        self.write(self.path, [self.line(1, "INFO", "m1"), self.line(2, "ERROR", "m2"),
+                               "Traceback (most recent call last):", self.line(3, "INFO", "m3"),
+                               self.line(4, "WARNING", "m4")])
+        records = list(LogTail.tail(self.path, 60, level="warning"))
+        self.assertEqual(["m4", "m2"], self.messages(records))
+        self.assertEqual(["Traceback (most recent call last):"], records[1][1][1:])
+
+        since = LogTail.parse_since("2020-10-18 10:03")
+        self.assertEqual(["m4", "m3"], self.messages(LogTail.tail(self.path, 60, since=since)))
+
+    def testParseLines(self):
+        self.assertEqual(60, LogTail.parse_lines('60'))
+        self.assertEqual(LogTail.MAX_LINES, LogTail.parse_lines('1000000'))
+        for bad in ('abc', '0', '-1', ''):
+            self.assertRaises(ValueError, LogTail.parse_lines, bad)
+
+    def testNoLogFile(self):
+        self.assertRaises(IOError, list, LogTail.tail(self.path))
+
+#
+# python log_tail_test.py -v
+#
+if __name__ == '__main__':
+    unittest.main()
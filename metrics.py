@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+"""Counters and histograms kept in memory, rendered for /metrics in the Prometheus text format."""
+import bisect
+import functools
+import threading
+import timeit
+
+# seconds, from a sqlite point lookup to a blocking DHT read or weatherapi call
+DEFAULT_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_labels(names, values, extra=()):
+    pairs = ['%s="%s"' % (n, escape(v)) for n, v in zip(names, values) + list(extra)]
+    return '{%s}' % ','.join(pairs) if pairs else ''
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter(object):
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}  # label values tuple -> count
+        self.lock = threading.Lock()
+
+    def inc(self, *labels):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + 1
+
+    def samples(self):
+        with self.lock:
+            values = sorted(self.values.items())
+        for labels, value in values:
+            yield self.name, format_labels(self.labels, labels), value
+
+
+class Histogram(object):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self.values = {}  # label values tuple -> [count per bucket..., +Inf count, sum]
+        self.lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            v = self.values.get(labels)
+            if v == None:
+                v = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            v[i] += 1
+            v[-1] += value
+
+    def time(self, *labels):
+        return Timer(self, labels)
+
+    def samples(self):
+        with self.lock:
+            values = sorted((labels, list(v)) for labels, v in self.values.items())
+        for labels, v in values:
+            total = 0
+            for le, count in zip(self.buckets + (float('inf'),), v[:-1]):
+                total += count
+                yield self.name + '_bucket', format_labels(self.labels, labels, [('le', format_value(le))]), total
+            yield self.name + '_sum', format_labels(self.labels, labels), v[-1]
+            yield self.name + '_count', format_labels(self.labels, labels), total
+
+
+class Timer(object):
+    """with histogram.time(*labels): ..."""
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = timeit.default_timer()
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(timeit.default_timer() - self.start, *self.labels)
+
+
+class Registry(object):
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        with self.lock:
+            existing = self.metrics.get(metric.name)
+            if existing != None:
+                if existing.kind != metric.kind:
+                    raise ValueError("metric %s already registered as a %s" % (metric.name, existing.kind))
+                return existing
+            self.metrics[metric.name] = metric
+            return metric
+
+    def render(self):
+        lines = []
+        for name, metric in sorted(self.metrics.items()):
+            lines.append('# HELP %s %s' % (name, metric.help))
+            lines.append('# TYPE %s %s' % (name, metric.kind))
+            for sample, labels, value in metric.samples():
+                lines.append('%s%s %s' % (sample, labels, format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+def counter(name, help, labels=()):
+    return REGISTRY.register(Counter(name, help, labels))
+
+
+def histogram(name, help, labels=(), buckets=DEFAULT_BUCKETS):
+    return REGISTRY.register(Histogram(name, help, labels, buckets))
+
+
+def timed(histogram, *labels):
+    """decorator, observes the run time of every call"""
+    def decorate(f):
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            start = timeit.default_timer()
+            try:
+                return f(*args, **kwargs)
+            finally:
+                histogram.observe(timeit.default_timer() - start, *labels)
+        return wrapper
+    return decorate
+
+
+RENDER_SECONDS = histogram('gdc_http_render_seconds', 'Time spent in Resource.render, blocking the reactor', ('handler',))
+REQUEST_SECONDS = histogram('gdc_http_request_seconds', 'Time from render until the request finished', ('handler',))
+REQUESTS = counter('gdc_http_requests_total', 'Requests rendered', ('handler',))
+
+
+def timed_render(render):
+    """decorator for Resource.render, labelled with the resource class; requests left
+    open with NOT_DONE_YET are also timed until they finish"""
+    @functools.wraps(render)
+    def wrapper(self, request):
+        handler = self.__class__.__name__
+        start = timeit.default_timer()
+        try:
+            result = render(self, request)
+        finally:
+            elapsed = timeit.default_timer() - start
+            RENDER_SECONDS.observe(elapsed, handler)
+            REQUESTS.inc(handler)
+        if isinstance(result, basestring):
+            REQUEST_SECONDS.observe(elapsed, handler)
+        else:
+            request.notifyFinish().addBoth(
+                lambda x: REQUEST_SECONDS.observe(timeit.default_timer() - start, handler))
+        return result
+    return wrapper
@@ -0,0 +1,72 @@
+import unittest
+import metrics as Metrics
+
+from twisted.web import server
+from twisted.web.resource import Resource
+from twisted.web.test.requesthelper import DummyRequest
+
+
+class FastHandler(Resource):
+    @Metrics.timed_render
+    def render(self, request):
+        return "ok"
+
+
+class LongPollHandler(Resource):
+    @Metrics.timed_render
+    def render(self, request):
+        return server.NOT_DONE_YET
+
+
+class Test(unittest.TestCase):
+
+    def testCounter(self):
+        c = Metrics.Counter('gdc_test_total', 'test', ('door',))
+        c.inc('left')
+        c.inc('left')
+        c.inc('right')
+        self.assertEqual([('gdc_test_total', '{door="left"}', 2), ('gdc_test_total', '{door="right"}', 1)],
+                         list(c.samples()))
+
+    def testHistogramCumulativeBuckets(self):
+        h = Metrics.Histogram('gdc_test_seconds', 'test', buckets=(0.1, 1))
+        h.observe(0.05)
+        h.observe(0.1)
+        h.observe(0.5)
+        h.observe(3)
+        samples = list(h.samples())
+        self.assertEqual([('gdc_test_seconds_bucket', '{le="0.1"}', 2),
+                          ('gdc_test_seconds_bucket', '{le="1"}', 3),
+                          ('gdc_test_seconds_bucket', '{le="+Inf"}', 4)], samples[:3])
+        self.assertEqual(('gdc_test_seconds_count', '', 4), samples[-1])
+        self.assertAlmostEqual(3.65, samples[-2][2])
+
+    def testRegisterSameNameReturnsExisting(self):
+        registry = Metrics.Registry()
+        c = registry.register(Metrics.Counter('gdc_test_total', 'test'))
+        self.assertTrue(c is registry.register(Metrics.Counter('gdc_test_total', 'test')))
+        self.assertRaises(ValueError, registry.register, Metrics.Histogram('gdc_test_total', 'test'))
+
+    def testRenderExposition(self):
+        registry = Metrics.Registry()
+        c = registry.register(Metrics.Counter('gdc_test_total', 'A "test"', ('path',)))
+        c.inc('a"b')
+        self.assertEqual('# HELP gdc_test_total A "test"\n# TYPE gdc_test_total counter\ngdc_test_total{path="a\\"b"} 1\n',
+                         registry.render())
+
+    def testTimedRender(self):
+        FastHandler().render(DummyRequest(['fast']))
+        request = DummyRequest(['upd'])
+        LongPollHandler().render(request)
+        count = lambda h, handler: sum(h.values[(handler,)][:-1])
+        self.assertEqual(1, count(Metrics.REQUEST_SECONDS, 'FastHandler'))
+        self.assertFalse(('LongPollHandler',) in Metrics.REQUEST_SECONDS.values)
+        request.finish()
+        self.assertEqual(1, count(Metrics.REQUEST_SECONDS, 'LongPollHandler'))
+        self.assertTrue('gdc_http_requests_total{handler="FastHandler"}' in Metrics.REGISTRY.render())
+
+#
+# python metrics_test.py -v
+#
+if __name__ == '__main__':
+    unittest.main()
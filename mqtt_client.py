@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+"""Long lived MQTT client, messages published while the broker is unreachable wait in a bounded on-disk queue."""
+import logging
+import os
+import sqlite3
+import threading
+
+QUEUE_PATH = 'mqttQueue'
+QUEUE_SIZE = 10000
+FLUSH_BATCH = 100
+MQTT_ERR_SUCCESS = 0
+
+
+def paho_client(client_id):
+    import paho.mqtt.client as mqtt
+    return mqtt.Client(client_id=client_id)
+
+
+class OfflineQueue(object):
+    """bounded FIFO of (topic, payload, qos), the oldest messages are dropped when it is full"""
+
+    def __init__(self, path, size=QUEUE_SIZE):
+        self.size = size
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS queue (id INTEGER PRIMARY KEY AUTOINCREMENT, topic TEXT, payload TEXT, qos INTEGER)")
+        self.count = self.conn.execute("SELECT COUNT(*) FROM queue").fetchone()[0]
+
+    def __len__(self):
+        return self.count
+
+    def put(self, topic, payload, qos):
+        with self.conn:
+            self.conn.execute("INSERT INTO queue (topic, payload, qos) VALUES (?, ?, ?)", (topic, payload, qos))
+            self.count += 1
+            if self.count > self.size:
+                dropped = self.conn.execute("DELETE FROM queue WHERE id IN (SELECT id FROM queue ORDER BY id LIMIT ?)",
+                                            (self.count - self.size,)).rowcount
+                self.count -= dropped
+                logging.warning("MQTT offline queue full, dropped %d message(s)" % (dropped))
+
+    def peek(self, limit):
+        return self.conn.execute("SELECT id, topic, payload, qos FROM queue ORDER BY id LIMIT ?", (limit,)).fetchall()
+
+    def remove(self, ids):
+        with self.conn:
+            self.conn.executemany("DELETE FROM queue WHERE id=?", [(i,) for i in ids])
+        self.count -= len(ids)
+
+
+class MqttClient(object):
+
+    def __init__(self, server, username, password, qos=None, port=1883, keepalive=60,
+                 queue_path=QUEUE_PATH, queue_size=QUEUE_SIZE, client_factory=paho_client):
+        self.server = server
+        self.port = port
+        self.keepalive = keepalive
+        self.qos = qos or {}  # topic -> qos, default 0
+        self.queue = OfflineQueue(queue_path, queue_size)
+        self.connected = False
+        self.lock = threading.Lock()
+        self.username = username
+        self.password = password
+        self.client_factory = client_factory
+        self.paho = None
+        self.started = False
+        self.subscriptions = {}  # topic -> qos, subscribed again on every connect
+
+    """the paho client, created (and paho imported) on first use, so publishing into the queue before start() is cheap"""
+    @property
+    def client(self):
+        if self.paho == None:
+            client = self.client_factory("gdc-%d" % (os.getpid()))
+            client.username_pw_set(self.username, self.password)
+            client.reconnect_delay_set(1, 120)
+            client.on_connect = self.on_connect
+            client.on_disconnect = self.on_disconnect
+            self.paho = client
+        return self.paho
+
+    """returns False if there is no usable broker, publishes then just wait in the queue"""
+    def start(self):
+        if not self.server:
+            logging.warning("No MQTT server configured, messages are only queued")
+            return False
+        try:
+            # paho's network thread connects, and reconnects whenever the broker goes away
+            self.client.connect_async(self.server, self.port, self.keepalive)
+            self.client.loop_start()
+        except Exception as e:
+            logging.error("MQTT not started for %s:%s: %s" % (self.server, self.port, e))
+            return False
+        self.started = True
+        return True
+
+    def stop(self):
+        if not self.started:
+            return
+        self.started = False
+        self.client.disconnect()
+        self.client.loop_stop()
+
+    def on_connect(self, client, userdata, flags, rc):
+        if rc != MQTT_ERR_SUCCESS:
+            logging.error("MQTT connect to %s refused (rc=%s)" % (self.server, rc))
+            return
+        logging.info("MQTT connected to %s, %d queued message(s)" % (self.server, len(self.queue)))
+        with self.lock:
+            self.connected = True
+            for topic, qos in self.subscriptions.items():
+                self.client.subscribe(topic, qos)
+            self.flush()
+
+    def on_disconnect(self, client, userdata, rc):
+        with self.lock:
+            self.connected = False
+        if rc != MQTT_ERR_SUCCESS:
+            logging.warning("MQTT lost connection to %s (rc=%s)" % (self.server, rc))
+
+    def flush(self):
+        while self.connected and len(self.queue) > 0:
+            sent = []
+            for (id, topic, payload, qos) in self.queue.peek(FLUSH_BATCH):
+                if self.client.publish(topic, payload, qos).rc != MQTT_ERR_SUCCESS:
+                    break
+                sent.append(id)
+            self.queue.remove(sent)
+            if len(sent) < FLUSH_BATCH:
+                break
+
+    """callback(topic, payload) on paho's network thread for every message on topic"""
+    def subscribe(self, topic, callback, qos=0):
+        self.client.message_callback_add(topic, lambda client, userdata, message: callback(message.topic, message.payload))
+        with self.lock:
+            self.subscriptions[topic] = qos
+            if self.connected:
+                self.client.subscribe(topic, qos)
+
+    """publish msg, or queue it until the broker is back; safe to call from any thread"""
+    def publish(self, topic, msg):
+        payload = str(msg)
+        qos = self.qos.get(topic, 0)
+        with self.lock:
+            # anything already queued has to go first, a publish refused while connected is retried here
+            # rather than waiting for the next reconnect
+            if self.connected and len(self.queue) > 0:
+                self.flush()
+            if self.connected and len(self.queue) == 0:
+                if self.client.publish(topic, payload, qos).rc == MQTT_ERR_SUCCESS:
+                    return True
+            self.queue.put(topic, payload, qos)
+        return False
@@ -0,0 +1,176 @@
+import os
+import tempfile
+import unittest
+import mqtt_client as MqttClient
+
+
+class FakeBroker(object):
+    """in-process stand-in for the mqtt broker"""
+
+    def __init__(self):
+        self.up = True
+        self.full = False  # connected, but refusing publishes
+        self.messages = []
+        self.clients = []
+
+    def go_down(self):
+        self.up = False
+        for c in self.clients:
+            c.on_disconnect(c, None, 1)
+
+    def go_up(self):
+        self.up = True
+        for c in self.clients:
+            c.on_connect(c, None, {}, 0)
+
+
+class Message(object):
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+
+
+class PublishInfo(object):
+    def __init__(self, rc):
+        self.rc = rc
+
+
+class FakeClient(object):
+    def __init__(self, broker):
+        self.broker = broker
+        self.callbacks = {}
+        self.subscribed = []
+
+    def username_pw_set(self, username, password):
+        pass
+
+    def reconnect_delay_set(self, min_delay, max_delay):
+        pass
+
+    def connect_async(self, host, port, keepalive):
+        self.broker.clients.append(self)
+
+    def loop_start(self):
+        if self.broker.up:
+            self.on_connect(self, None, {}, 0)
+
+    def loop_stop(self):
+        pass
+
+    def disconnect(self):
+        self.broker.clients.remove(self)
+
+    def publish(self, topic, payload, qos):
+        if not self.broker.up:
+            return PublishInfo(4)  # MQTT_ERR_NO_CONN
+        if self.broker.full:
+            return PublishInfo(15)  # MQTT_ERR_QUEUE_SIZE
+        self.broker.messages.append((topic, payload, qos))
+        for c in self.broker.clients:
+            if topic in c.subscribed:
+                c.callbacks[topic](c, None, Message(topic, payload))
+        return PublishInfo(0)
+
+    def message_callback_add(self, topic, callback):
+        self.callbacks[topic] = callback
+
+    def subscribe(self, topic, qos):
+        self.subscribed.append(topic)
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.queue_path = tempfile.mkstemp()
+        os.close(fd)
+        self.broker = FakeBroker()
+
+    def tearDown(self):
+        os.remove(self.queue_path)
+
+    def client(self, queue_size=10):
+        return MqttClient.MqttClient("broker", "user", "password", {"garage/action": 1}, queue_path=self.queue_path,
+                                     queue_size=queue_size, client_factory=lambda client_id: FakeClient(self.broker))
+
+    def testBlankServer(self):
+        c = MqttClient.MqttClient("", "user", "password", queue_path=self.queue_path,
+                                  client_factory=lambda client_id: FakeClient(self.broker))
+        self.assertFalse(c.start())
+        self.assertEqual([], self.broker.clients)
+        self.assertFalse(c.publish("garage/action", "2 Car|opening"))
+        self.assertEqual(1, len(c.queue))
+        c.stop()
+
+    def testInvalidServer(self):
+        def connect_async(host, port, keepalive):
+            raise ValueError('Invalid host.')
+        c = self.client()
+        c.client.connect_async = connect_async
+        self.assertFalse(c.start())
+        c.stop()
+
+    def testRefusedWhileConnectedRetriedOnNextPublish(self):
+        c = self.client()
+        c.start()
+        self.broker.full = True
+        self.assertFalse(c.publish("garage/action", "2 Car|opening"))
+        self.assertEqual(1, len(c.queue))
+        self.broker.full = False
+        self.assertTrue(c.publish("garage/action", "2 Car|open"))
+        self.assertEqual(0, len(c.queue))
+        self.assertEqual(["2 Car|opening", "2 Car|open"], [m[1] for m in self.broker.messages])
+
+    def testPublishQos(self):
+        c = self.client()
+        c.start()
+        self.assertTrue(c.publish("garage/action", "2 Car|opening"))
+        self.assertTrue(c.publish("garage_temperature/action", 70))
+        self.assertEqual([("garage/action", "2 Car|opening", 1), ("garage_temperature/action", "70", 0)], self.broker.messages)
+
+    def testOfflineQueueFlushedInOrder(self):
+        c = self.client()
+        c.start()
+        self.broker.go_down()
+        self.assertFalse(c.publish("garage/action", "2 Car|opening"))
+        self.assertFalse(c.publish("garage/action", "2 Car|closed"))
+        self.assertEqual([], self.broker.messages)
+        self.broker.go_up()
+        self.assertEqual(["2 Car|opening", "2 Car|closed"], [m[1] for m in self.broker.messages])
+        self.assertEqual(0, len(c.queue))
+
+    def testOfflineQueueBounded(self):
+        c = self.client(queue_size=3)
+        self.broker.up = False
+        c.start()
+        for i in range(5):
+            c.publish("garage_temperature/action", i)
+        self.assertEqual(3, len(c.queue))
+        self.broker.go_up()
+        self.assertEqual(["2", "3", "4"], [m[1] for m in self.broker.messages])
+
+    def testQueueSurvivesRestart(self):
+        c = self.client()
+        self.broker.up = False
+        c.start()
+        c.publish("garage/action", "2 Car|opening")
+        c.stop()
+        self.broker.up = True
+        self.client().start()
+        self.assertEqual(["2 Car|opening"], [m[1] for m in self.broker.messages])
+
+    def testSubscriptionRenewedOnReconnect(self):
+        c = self.client()
+        received = []
+        c.subscribe("garage/action", lambda topic, payload: received.append((topic, payload)), 1)
+        c.start()
+        self.broker.go_down()
+        self.broker.go_up()
+        c.publish("garage/action", "2 Car|opening")
+        self.assertEqual([("garage/action", "2 Car|opening")], received)
+        self.assertEqual(["garage/action", "garage/action"], c.client.subscribed)
+
+#
+# python mqtt_client_test.py -v
+#
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+"""Sample the stacks of every thread for a few seconds and write them as folded stacks.
+
+The output is one line per distinct stack, 'thread;outer frame;...;inner frame count', which
+flamegraph.pl and https://www.speedscope.app open as is. Nothing runs between sessions.
+"""
+import collections
+import logging
+import os
+import sys
+import threading
+import time
+
+INTERVAL = 0.01
+MAX_SECONDS = 300
+PROFILE_DIR = '/tmp/gdc-profiles'
+KEEP = 10  # profiles kept in the directory
+
+
+def frame_label(frame):
+    code = frame.f_code
+    return "%s (%s:%d)" % (code.co_name, os.path.basename(code.co_filename), code.co_firstlineno)
+
+
+def folded_stack(thread_name, frame):
+    labels = []
+    while frame != None:
+        labels.append(frame_label(frame))
+        frame = frame.f_back
+    labels.append(thread_name)
+    labels.reverse()
+    return ';'.join(l.replace(';', ':') for l in labels)
+
+
+class SamplingProfiler(object):
+    def __init__(self, path=PROFILE_DIR, interval=INTERVAL, max_seconds=MAX_SECONDS, clock=time.time):
+        self.path = path
+        self.interval = interval
+        self.max_seconds = max_seconds
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.thread = None
+        self.current = None  # file name of the running session
+
+    def running(self):
+        return self.thread != None and self.thread.is_alive()
+
+    """start a session of seconds in its own thread, returns the file name it will be written to"""
+    def start(self, seconds, on_done=None):
+        seconds = max(0.1, min(float(seconds), self.max_seconds))
+        with self.lock:
+            if self.running():
+                raise RuntimeError("profile %s already running" % (self.current))
+            if not os.path.isdir(self.path):
+                os.makedirs(self.path)
+            self.current = "gdc-%s.folded" % (time.strftime('%Y%m%d-%H%M%S', time.localtime(self.clock())))
+            self.thread = threading.Thread(target=self.run, args=(seconds, self.current, on_done), name='profiler')
+            self.thread.daemon = True
+            self.thread.start()
+            return self.current
+
+    def sample(self, stacks):
+        names = dict((t.ident, t.name) for t in threading.enumerate())
+        me = threading.current_thread().ident
+        for ident, frame in sys._current_frames().items():
+            if ident != me:
+                stacks[folded_stack(names.get(ident, str(ident)), frame)] += 1
+
+    def run(self, seconds, name, on_done):
+        stacks = collections.Counter()
+        end = time.time() + seconds
+        samples = 0
+        while time.time() < end:
+            self.sample(stacks)
+            samples += 1
+            time.sleep(self.interval)
+
+        path = os.path.join(self.path, name)
+        with open(path + '.tmp', 'w') as f:
+            for stack, count in sorted(stacks.items()):
+                f.write("%s %d\n" % (stack, count))
+        os.rename(path + '.tmp', path)
+        self.prune()
+        logging.info("Profile written to %s: %d samples over %.1fs" % (path, samples, seconds))
+        if on_done != None:
+            on_done(name)
+
+    def prune(self):
+        for name in self.profiles()[KEEP:]:
+            os.remove(os.path.join(self.path, name))
+
+    """finished profiles, newest first"""
+    def profiles(self):
+        if not os.path.isdir(self.path):
+            return []
+        return sorted([n for n in os.listdir(self.path) if n.endswith('.folded')], reverse=True)
@@ -0,0 +1,60 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import profiler as Profiler
+
+
+def busy(stop):
+    while not stop.is_set():
+        sum(range(100))
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def testFoldedStack(self):
+        def inner():
+            return Profiler.folded_stack("worker", __import__('sys')._getframe())
+        stack = inner().split(';')
+        self.assertEqual("worker", stack[0])
+        self.assertTrue(stack[-1].startswith("inner (profiler_test.py:"))
+        self.assertTrue(stack[-2].startswith("testFoldedStack (profiler_test.py:"))
+
+    def testSamplesOtherThreads(self):
+        stop = threading.Event()
+        worker = threading.Thread(target=busy, args=(stop,), name='busy-worker')
+        worker.start()
+        done = []
+        profiler = Profiler.SamplingProfiler(self.path, interval=0.001)
+        name = profiler.start(0.2, done.append)
+        self.assertRaises(RuntimeError, profiler.start, 1)
+        profiler.thread.join()
+        stop.set()
+        worker.join()
+
+        self.assertEqual([name], done)
+        self.assertEqual([name], profiler.profiles())
+        with open(os.path.join(self.path, name)) as f:
+            lines = f.read().splitlines()
+        self.assertTrue(any(l.startswith("busy-worker;") and "busy (profiler_test.py:" in l for l in lines))
+        self.assertFalse(any(l.startswith("profiler;") for l in lines))
+        self.assertTrue(all(int(l.rsplit(' ', 1)[1]) > 0 for l in lines))
+
+    def testSecondsCapped(self):
+        profiler = Profiler.SamplingProfiler(self.path, max_seconds=0.1)
+        profiler.start(3600)
+        profiler.thread.join(5)
+        self.assertFalse(profiler.running())
+
+#
+# python profiler_test.py -v
+#
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+"""TTL cache for rendered responses, concurrent requests for a key share one computation."""
+from twisted.internet import defer, reactor
+from twisted.python import failure
+
+
+class ResponseCache(object):
+
+    def __init__(self, clock=reactor):
+        self.clock = clock
+        self.entries = {}   # key -> (expires, value)
+        self.inflight = {}  # key -> deferreds waiting on the computation
+        self.stale = set()  # keys invalidated while being computed
+        self.events = {}    # event name -> keys built from it
+
+    """returns a Deferred firing with the cached value, or with compute() once it is done"""
+    def get(self, key, ttl, compute, events=()):
+        entry = self.entries.get(key)
+        if entry != None and entry[0] > self.clock.seconds():
+            return defer.succeed(entry[1])
+
+        d = defer.Deferred()
+        if key in self.inflight:
+            self.inflight[key].append(d)
+            return d
+
+        self.inflight[key] = [d]
+        for event in events:
+            self.events.setdefault(event, set()).add(key)
+        defer.maybeDeferred(compute).addBoth(self.computed, key, ttl)
+        return d
+
+    def computed(self, result, key, ttl):
+        waiting = self.inflight.pop(key, [])
+        if not isinstance(result, failure.Failure) and ttl > 0 and key not in self.stale:
+            self.entries[key] = (self.clock.seconds() + ttl, result)
+        self.stale.discard(key)
+
+        for d in waiting:
+            if isinstance(result, failure.Failure):
+                d.errback(result)
+            else:
+                d.callback(result)
+
+    def invalidate(self, key):
+        self.entries.pop(key, None)
+        if key in self.inflight:
+            self.stale.add(key)
+
+    """drop every response built from event, call from the reactor thread"""
+    def invalidate_event(self, event):
+        for key in self.events.get(event, ()):
+            self.invalidate(key)
@@ -0,0 +1,67 @@
+import unittest
+import response_cache as ResponseCache
+
+from twisted.internet import defer, task
+
+
+class Test(unittest.TestCase):
+
+    def setup(self):
+        self.calls = 0
+        self.clock = task.Clock()
+        return ResponseCache.ResponseCache(self.clock)
+
+    def compute(self):
+        self.calls += 1
+        return "body %d" % (self.calls)
+
+    def result(self, d):
+        results = []
+        d.addBoth(results.append)
+        return results[0]
+
+    def testTTL(self):
+        cache = self.setup()
+        self.assertEqual("body 1", self.result(cache.get("graph", 60, self.compute)))
+        self.clock.advance(30)
+        self.assertEqual("body 1", self.result(cache.get("graph", 60, self.compute)))
+        self.clock.advance(31)
+        self.assertEqual("body 2", self.result(cache.get("graph", 60, self.compute)))
+
+    def testSingleFlight(self):
+        cache = self.setup()
+        pending = defer.Deferred()
+        d1 = cache.get("weather", 60, lambda: pending)
+        d2 = cache.get("weather", 60, self.compute)
+        self.assertEqual(0, self.calls)
+        pending.callback("weather")
+        self.assertEqual("weather", self.result(d1))
+        self.assertEqual("weather", self.result(d2))
+
+    def testInvalidateEvent(self):
+        cache = self.setup()
+        cache.get("graph", 60, self.compute, ["garage_temperature"])
+        cache.invalidate_event("shed_temperature")
+        self.assertEqual("body 1", self.result(cache.get("graph", 60, self.compute)))
+        cache.invalidate_event("garage_temperature")
+        self.assertEqual("body 2", self.result(cache.get("graph", 60, self.compute)))
+
+    def testInvalidateWhileComputing(self):
+        cache = self.setup()
+        pending = defer.Deferred()
+        cache.get("graph", 60, lambda: pending, ["garage_temperature"])
+        cache.invalidate_event("garage_temperature")
+        pending.callback("old")
+        self.assertEqual("body 1", self.result(cache.get("graph", 60, self.compute)))
+
+    def testFailureNotCached(self):
+        cache = self.setup()
+        f = self.result(cache.get("graph", 60, lambda: 1 / 0))
+        self.assertTrue(f.check(ZeroDivisionError))
+        self.assertEqual("body 1", self.result(cache.get("graph", 60, self.compute)))
+
+#
+# python response_cache_test.py -v
+#
+if __name__ == '__main__':
+    unittest.main()
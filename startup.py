@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+"""Fast startup helpers, modules imported on first use and a log line of where the startup time went."""
+import importlib
+import logging
+import time
+
+STARTED = time.time()  # when this module was first imported, controller.py imports it first
+
+
+class LazyModule(object):
+    """stands in for the module name, which is only imported when one of its attributes is first used"""
+
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+
+    def __getattr__(self, attr):
+        module = self.__dict__['_module']
+        if module == None:
+            start = time.time()
+            module = importlib.import_module(self.__dict__['_name'])
+            self.__dict__['_module'] = module
+            logging.info("Imported %s in %.2fs" % (self.__dict__['_name'], time.time() - start))
+        return getattr(module, attr)
+
+
+class StartupTimer(object):
+    def __init__(self, started=STARTED, clock=time.time):
+        self.clock = clock
+        self.started = started
+        self.last = started
+        self.phases = []  # (name, secs) in the order they finished
+
+    """the phase name ended now"""
+    def phase(self, name):
+        now = self.clock()
+        self.phases.append((name, now - self.last))
+        self.last = now
+
+    def total(self):
+        return self.last - self.started
+
+    def report(self):
+        msg = "Startup took %.2fs: %s" % (self.total(), ", ".join("%s %.2fs" % (name, secs) for name, secs in self.phases))
+        logging.info(msg)
+        return msg
@@ -0,0 +1,33 @@
+import sys
+import unittest
+import startup as Startup
+
+
+class Test(unittest.TestCase):
+
+    def testLazyModuleImportsOnFirstUse(self):
+        sys.modules.pop('colorsys', None)
+        colorsys = Startup.LazyModule('colorsys')
+        self.assertFalse('colorsys' in sys.modules)
+        self.assertEqual((0.0, 0.0, 1.0), colorsys.rgb_to_hsv(1.0, 1.0, 1.0))
+        self.assertTrue('colorsys' in sys.modules)
+
+    def testLazySubmodule(self):
+        path = Startup.LazyModule('os.path')
+        self.assertEqual('b', path.basename('a/b'))
+
+    def testPhases(self):
+        now = [10.0]
+        timer = Startup.StartupTimer(9.0, lambda: now[0])
+        timer.phase('imports')
+        now[0] = 10.5
+        timer.phase('listen')
+        self.assertEqual([('imports', 1.0), ('listen', 0.5)], timer.phases)
+        self.assertEqual(1.5, timer.total())
+        self.assertEqual("Startup took 1.50s: imports 1.00s, listen 0.50s", timer.report())
+
+#
+# python startup_test.py -v
+#
+if __name__ == '__main__':
+    unittest.main()
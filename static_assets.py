@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+"""Serve www/ from memory with precompressed variants, ETags and fingerprinted immutable URLs."""
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+import re
+import StringIO
+
+from twisted.web import http, resource
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'no-cache'
+FINGERPRINT_EXTENSIONS = ('.js', '.css', '.png', '.jpg', '.gif', '.ico')
+COMPRESS_TYPES = ('text/', 'application/javascript', 'application/json', 'image/svg+xml')
+# src/href attributes in html pointing at local files
+REFERENCE_RE = re.compile(r'''((?:src|href)=["'])([^"':]+)(["'])''')
+
+
+def gzip_compress(body):
+    out = StringIO.StringIO()
+    f = gzip.GzipFile(fileobj=out, mode='wb', compresslevel=9, mtime=0)
+    f.write(body)
+    f.close()
+    return out.getvalue()
+
+
+def accepted_encodings(header):
+    """encodings from an Accept-Encoding header, without the q=0 ones"""
+    encodings = set()
+    for part in (header or "").split(","):
+        fields = [f.strip() for f in part.split(";")]
+        if fields[0] == "":
+            continue
+        if any(f.replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000") for f in fields[1:]):
+            continue
+        encodings.add(fields[0].lower())
+    return encodings
+
+
+def fingerprint_name(name, digest):
+    root, ext = os.path.splitext(name)
+    return "%s.%s%s" % (root, digest[:10], ext)
+
+
+class Asset(resource.Resource):
+    isLeaf = True
+
+    def __init__(self, body, content_type, cache_control):
+        resource.Resource.__init__(self)
+        self.content_type = content_type
+        self.cache_control = cache_control
+        self.etag = '"%s"' % (hashlib.sha1(body).hexdigest()[:16])
+
+        # precompressed variants, only kept when they are smaller
+        self.variants = {'identity': body}
+        if content_type.startswith(COMPRESS_TYPES):
+            compressed = gzip_compress(body)
+            if len(compressed) < len(body):
+                self.variants['gzip'] = compressed
+            if brotli != None:
+                compressed = brotli.compress(body)
+                if len(compressed) < len(body):
+                    self.variants['br'] = compressed
+
+    def choose_encoding(self, accept_encoding):
+        accepted = accepted_encodings(accept_encoding)
+        for encoding in ('br', 'gzip'):
+            if encoding in self.variants and encoding in accepted:
+                return encoding
+        return 'identity'
+
+    def render_GET(self, request):
+        request.setHeader('Content-Type', self.content_type)
+        request.setHeader('Cache-Control', self.cache_control)
+        request.setHeader('ETag', self.etag)
+        if len(self.variants) > 1:
+            request.setHeader('Vary', 'Accept-Encoding')
+
+        if request.getHeader('If-None-Match') == self.etag:
+            request.setResponseCode(http.NOT_MODIFIED)
+            return ''
+
+        encoding = self.choose_encoding(request.getHeader('Accept-Encoding'))
+        if encoding != 'identity':
+            request.setHeader('Content-Encoding', encoding)
+        body = self.variants[encoding]
+        request.setHeader('Content-Length', str(len(body)))
+        return body
+
+
+class StaticAssets(resource.Resource):
+    """root resource, handlers added with putChild take precedence over the files"""
+
+    def __init__(self, path, index='index.html'):
+        resource.Resource.__init__(self)
+        self.index = index
+        self.assets = {}
+        self.fingerprints = {}  # 'client.js' -> 'client.<hash>.js'
+        self.load(path)
+
+    def load(self, path):
+        files = {}
+        for root, dirs, names in os.walk(path):
+            for name in names:
+                full = os.path.join(root, name)
+                with open(full, 'rb') as f:
+                    files[os.path.relpath(full, path).replace(os.sep, '/')] = f.read()
+
+        for name, body in files.items():
+            if name.endswith(FINGERPRINT_EXTENSIONS):
+                self.fingerprints[name] = fingerprint_name(name, hashlib.sha1(body).hexdigest())
+
+        total = 0
+        for name, body in files.items():
+            content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+            if content_type == 'text/html':
+                body = REFERENCE_RE.sub(self.fingerprint_reference, body)
+            # plain names stay available (client.js builds img/<state>.png urls), but must revalidate
+            self.assets[name] = Asset(body, content_type, REVALIDATE)
+            if name in self.fingerprints:
+                self.assets[self.fingerprints[name]] = Asset(body, content_type, IMMUTABLE)
+            total += sum(len(v) for v in self.assets[name].variants.values())
+        logging.info("Static assets loaded from %s: %d files, %d bytes with compressed variants" % (path, len(files), total))
+
+    def fingerprint_reference(self, m):
+        return m.group(1) + self.fingerprints.get(m.group(2), m.group(2)) + m.group(3)
+
+    def getChild(self, path, request):
+        name = '/'.join([path] + request.postpath)
+        if name == '':
+            name = self.index
+        if name in self.assets:
+            return self.assets[name]
+        return resource.NoResource()
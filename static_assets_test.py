@@ -0,0 +1,57 @@
+import gzip
+import StringIO
+import unittest
+import static_assets as StaticAssets
+
+from twisted.web.test.requesthelper import DummyRequest
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self.assets = StaticAssets.StaticAssets('www')
+
+    def get(self, path, headers=None):
+        request = DummyRequest(path.split('/'))
+        for name, value in (headers or {}).items():
+            request.requestHeaders.setRawHeaders(name, [value])
+        asset = self.assets.getChild(request.postpath.pop(0), request)
+        body = asset.render(request)
+        return request, body
+
+    def header(self, request, name):
+        return request.responseHeaders.getRawHeaders(name, [None])[0]
+
+    def testIndexUsesFingerprintedUrls(self):
+        request, body = self.get('')
+        fingerprinted = self.assets.fingerprints['client.js']
+        self.assertTrue('src="%s"' % (fingerprinted) in body)
+        self.assertEqual(StaticAssets.REVALIDATE, self.header(request, 'Cache-Control'))
+
+        request, body = self.get(fingerprinted)
+        self.assertEqual(StaticAssets.IMMUTABLE, self.header(request, 'Cache-Control'))
+
+    def testGzipNegotiation(self):
+        request, plain = self.get('jquery.timepicker.js')
+        self.assertEqual(None, self.header(request, 'Content-Encoding'))
+
+        request, body = self.get('jquery.timepicker.js', {'Accept-Encoding': 'deflate, gzip'})
+        self.assertEqual('gzip', self.header(request, 'Content-Encoding'))
+        self.assertTrue(len(body) < len(plain))
+        self.assertEqual(plain, gzip.GzipFile(fileobj=StringIO.StringIO(body)).read())
+
+        request, body = self.get('jquery.timepicker.js', {'Accept-Encoding': 'gzip;q=0'})
+        self.assertEqual(None, self.header(request, 'Content-Encoding'))
+
+    def testNotModified(self):
+        request, body = self.get('img/closed.png')
+        etag = self.header(request, 'ETag')
+        request, body = self.get('img/closed.png', {'If-None-Match': etag})
+        self.assertEqual(304, request.responseCode)
+        self.assertEqual('', body)
+
+#
+# python static_assets_test.py -v
+#
+if __name__ == '__main__':
+    unittest.main()
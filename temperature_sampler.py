@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+"""Sample the DHT22 on a fast cadence, filter the samples and emit one aggregated reading per slow cadence."""
+import collections
+import json
+import logging
+import time
+
+import utils as Utils
+
+from twisted.internet import reactor, task
+
+WINDOW = 15  # samples the median and outlier check look at
+SAMPLE_INTERVAL = 60
+EMIT_INTERVAL = 3600
+MAX_TEMPERATURE_DEVIATION = 5.0  # F from the window median
+MAX_HUMIDITY_DEVIATION = 10.0  # % from the window median
+TEMPERATURE_RANGE = (-40.0, 176.0)  # F the DHT22 can measure
+HUMIDITY_RANGE = (0.0, 100.0)
+
+
+def median(values):
+    values = sorted(values)
+    n = len(values)
+    if n % 2 == 1:
+        return values[n // 2]
+    return (values[n // 2 - 1] + values[n // 2]) / 2.0
+
+
+class Reading(collections.namedtuple('Reading', ['time', 'temperature_f', 'humidity', 'samples', 'rejected'])):
+    """filtered temperature and humidity from samples accepted samples, rejected ones were dropped"""
+
+    def to_json(self):
+        # the payload stored readings have always had
+        return json.dumps({"date": time.strftime(Utils.DATEFORMAT, time.localtime(self.time)),
+                           "temperature_f": round(self.temperature_f, 1), "humidity": round(self.humidity, 1)})
+
+
+class TemperatureSampler(object):
+    def __init__(self, read, workers, window=WINDOW, sample_interval=SAMPLE_INTERVAL, emit_interval=EMIT_INTERVAL,
+                 max_temperature_deviation=MAX_TEMPERATURE_DEVIATION, max_humidity_deviation=MAX_HUMIDITY_DEVIATION,
+                 clock=reactor):
+        self.read = read  # blocking, returns (temperature_f, humidity) or None, runs on the 'dht' worker
+        self.workers = workers
+        self.sample_interval = sample_interval
+        self.emit_interval = emit_interval
+        self.max_temperature_deviation = max_temperature_deviation
+        self.max_humidity_deviation = max_humidity_deviation
+        self.clock = clock
+        self.window = collections.deque(maxlen=window)  # (time, temperature_f, humidity) of accepted samples
+        self.pending = []  # accepted since the last emit
+        self.rejected = 0  # since the last emit
+        self.consecutive_rejects = 0
+        self.misses = 0
+        self.latest = None
+        self.listeners = []  # called with every emitted Reading
+
+    def start(self):
+        self.sampling = task.LoopingCall(self.sample)
+        self.sampling.clock = self.clock
+        self.sampling.start(self.sample_interval)
+        self.emitting = task.LoopingCall(self.emit)
+        self.emitting.clock = self.clock
+        self.emitting.start(self.emit_interval, now=False)
+
+    def stop(self):
+        for loop in (self.sampling, self.emitting):
+            if loop.running:
+                loop.stop()
+
+    def sample(self):
+        d = self.workers.run('dht', self.read)
+        d.addCallback(self.add)
+        d.addErrback(lambda f: logging.warning("Error reading temperature: %s" % f.getErrorMessage()))
+        return d
+
+    def is_outlier(self, temperature_f, humidity):
+        if len(self.window) < 3:
+            return False
+        return (abs(temperature_f - median(s[1] for s in self.window)) > self.max_temperature_deviation or
+                abs(humidity - median(s[2] for s in self.window)) > self.max_humidity_deviation)
+
+    """filter one (temperature_f, humidity) sample, returns True if it was accepted"""
+    def add(self, sample, t=None):
+        t = t if t != None else self.clock.seconds()
+        if sample == None:
+            self.misses += 1
+            return False
+        temperature_f, humidity = sample
+        if (not TEMPERATURE_RANGE[0] <= temperature_f <= TEMPERATURE_RANGE[1] or
+                not HUMIDITY_RANGE[0] <= humidity <= HUMIDITY_RANGE[1]):
+            self.rejected += 1
+            return False
+        if self.is_outlier(temperature_f, humidity):
+            self.consecutive_rejects += 1
+            self.rejected += 1
+            if self.consecutive_rejects < self.window.maxlen // 2:
+                return False
+            # not a glitch, the temperature really moved, start over from here
+            logging.info("Temperature moved to %.1fF, resetting the sample window" % (temperature_f))
+            self.window.clear()
+            self.rejected -= 1
+        self.consecutive_rejects = 0
+        self.window.append((t, temperature_f, humidity))
+        self.pending.append((t, temperature_f, humidity))
+        self.latest = Reading(t, median(s[1] for s in self.window), median(s[2] for s in self.window), len(self.window), 0)
+        return True
+
+    """the median of the samples accepted since the last emit, None if there were none"""
+    def emit(self):
+        pending, self.pending = self.pending, []
+        rejected, self.rejected = self.rejected, 0
+        misses, self.misses = self.misses, 0
+        if pending == []:
+            logging.warning("No temperature samples to emit, %d rejected, %d failed reads" % (rejected, misses))
+            return None
+        reading = Reading(pending[-1][0], median(s[1] for s in pending), median(s[2] for s in pending), len(pending), rejected)
+        for listener in self.listeners:
+            try:
+                listener(reading)
+            except Exception as e:
+                logging.error("Error emitting temperature reading: %s" % e)
+        return reading
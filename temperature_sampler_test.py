@@ -0,0 +1,80 @@
+import json
+import unittest
+import temperature_sampler as TemperatureSampler
+
+from twisted.internet import defer, task
+
+
+class FakeWorkers(object):
+    def run(self, name, f, *args, **kwargs):
+        return defer.maybeDeferred(f, *args, **kwargs)
+
+
+class FakeSensor(object):
+    def __init__(self, samples):
+        self.samples = list(samples)
+
+    def read(self):
+        return self.samples.pop(0)
+
+
+class Test(unittest.TestCase):
+
+    def setup(self, samples=(), **kwargs):
+        self.clock = task.Clock()
+        self.sensor = FakeSensor(samples)
+        sampler = TemperatureSampler.TemperatureSampler(self.sensor.read, FakeWorkers(), clock=self.clock, **kwargs)
+        self.emitted = []
+        sampler.listeners.append(self.emitted.append)
+        return sampler
+
+    def testMedian(self):
+        self.assertEqual(2, TemperatureSampler.median([3, 1, 2]))
+        self.assertEqual(2.5, TemperatureSampler.median([4, 1, 2, 3]))
+
+    def testOutlierRejected(self):
+        sampler = self.setup()
+        for sample in [(70.0, 40.0), (70.4, 41.0), (69.8, 40.0), (120.0, 40.0), (70.2, 40.5), (70.0, 95.0)]:
+            sampler.add(sample)
+        self.assertEqual(70.1, sampler.latest.temperature_f)
+        reading = sampler.emit()
+        self.assertEqual(4, reading.samples)
+        self.assertEqual(2, reading.rejected)
+
+    def testOutOfRangeAndMissedReads(self):
+        sampler = self.setup()
+        self.assertFalse(sampler.add(None))
+        self.assertFalse(sampler.add((-300.0, 40.0)))
+        self.assertFalse(sampler.add((70.0, 140.0)))
+        self.assertEqual(None, sampler.latest)
+        self.assertEqual(None, sampler.emit())
+        self.assertEqual([], self.emitted)
+
+    def testRealChangeAccepted(self):
+        sampler = self.setup(window=6)
+        for i in range(6):
+            sampler.add((50.0, 40.0))
+        # a door left open, the garage really cools down
+        self.assertFalse(sampler.add((30.0, 40.0)))
+        self.assertFalse(sampler.add((30.0, 40.0)))
+        self.assertTrue(sampler.add((30.0, 40.0)))
+        self.assertEqual(30.0, sampler.latest.temperature_f)
+
+    def testCadence(self):
+        sampler = self.setup([(70.0, 40.0), None, (71.0, 42.0), (72.0, 44.0)], sample_interval=60, emit_interval=150)
+        sampler.start()
+        self.clock.advance(60)
+        self.clock.advance(60)
+        self.assertEqual([], self.emitted)
+        self.clock.advance(30)
+        self.assertEqual(1, len(self.emitted))
+        reading = self.emitted[0]
+        self.assertEqual((70.5, 41.0, 2), (reading.temperature_f, reading.humidity, reading.samples))
+        self.assertEqual({"date", "temperature_f", "humidity"}, set(json.loads(reading.to_json())))
+        sampler.stop()
+
+#
+# python temperature_sampler_test.py -v
+#
+if __name__ == '__main__':
+    unittest.main()
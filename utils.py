@@ -4,19 +4,26 @@ import sys
 import time
 import json
 import datetime
+import logging
 import utils as Utils
-import paho.mqtt.publish as publish
-import Adafruit_DHT as dht
 import sqlite3
 from enum import Enum
 from datetime import timedelta
 from time import gmtime
 import db_utils as db_Utils
+import metrics as Metrics
+import startup as Startup
+
+dht = Startup.LazyModule('Adafruit_DHT')  # imported by the first read, on the dht worker
 
 """global"""
 gfileCache = 'garageCache'
 isDebugging = False
 temperature_pin = ""
+weather_timeout = 15
+
+DHT_READ_SECONDS = Metrics.histogram('gdc_dht_read_seconds', 'Time to read the DHT22')
+WEATHER_API_SECONDS = Metrics.histogram('gdc_weatherapi_seconds', 'Time waiting on api.weatherapi.com')
 
 global WAITING
 WAITING = False
@@ -218,45 +225,46 @@ def round_up_datetime(dt):
     return dt + ft
 
 
-def publish_MQTT(server, topic, msg, username, password):
-    try:
-        #if isDebugging:
-        print "will call MQTT - topic: {}, msg: {}, server: {}, username: {}".format(topic, str(msg), server, username)
-        #return
-        publish.single(topic, str(msg), hostname=server, auth={ 'username': username, 'password': password})
-    except:
-        print("Error publish_MQTT")
-    
-
 def get_current_temperature_from_weatherapi(requests, controller, city):
     url = '{}?key={}&q={}'.format(
         "http://api.weatherapi.com/v1/current.json", controller.weather_key, city)
-    data = requests.get(url)
+    with WEATHER_API_SECONDS.time():
+        data = requests.get(url, timeout=weather_timeout)
     return data.json()
 
 
-def get_temperature(gpio):
-    try:
-        h, t = dht.read_retry(dht.DHT22, gpio)
-        if t is not None:
-            t = t * (9/5.0) + 32  # convert to fahrenheit
-        if h is not None and t is not None:
-            date_str = Utils.get_date_time().strftime(DATEFORMAT)
-            return "{{ \"date\":\"{0}\", \"temperature_f\":{1:0.1f}, \"humidity\":{2:0.1f} }}".format(date_str, t, h)
-    except:
-        return("Error get_temperature")
+@Metrics.timed(DHT_READ_SECONDS)
+def read_dht(gpio):
+    """one DHT22 read, (temperature_f, humidity) or None, the sampler retries on its own cadence"""
+    h, t = dht.read(dht.DHT22, gpio)
+    if h is None or t is None:
+        return None
+    return (t * (9/5.0) + 32, h)  # convert to fahrenheit
 
-    return ""
+
+def is_weather_day_fresh(stored, max_age, curr_time):
+    day, fetched_at, final = stored
+    return final or curr_time - fetched_at < max_age
 
 
 def query_weather_API_by_date(requests, controller, date_value):
     if date_value == None or date_value == "":
         return "invalid date"
+
+    # past dates never change, only today is fetched again once it is older than weather_max_age
+    try:
+        stored = db_Utils.get_weather_day(date_value)
+        if stored != None and is_weather_day_fresh(stored, controller.weather_max_age, get_time()):
+            return stored[0]
+    except Exception as e:
+        logging.error("Error reading stored weather day %s, fetching it: %s" % (date_value, e))
+
     try:
         url = '{}?key={}&q={}&dt={}'.format(
             controller.weather_url, controller.weather_key, "Riverton", date_value)
         #print url
-        data = requests.get(url)
+        with WEATHER_API_SECONDS.time():
+            data = requests.get(url, timeout=weather_timeout)
         json_data = data.json()
 
         # get todays weather section
@@ -264,10 +272,15 @@ def query_weather_API_by_date(requests, controller, date_value):
         day = {"date": date_value, "avghumidity": y["avghumidity"], "avgtemp_f": y["avgtemp_f"],
                "mintemp_f": y["mintemp_f"], "maxtemp_f": y["maxtemp_f"]}
 
+        final = date_value < get_date_time().strftime('%Y-%m-%d')
+        try:
+            db_Utils.put_weather_day(date_value, day, get_time(), final)
+        except Exception as e:
+            logging.error("Error storing weather day %s: %s" % (date_value, e))
+
         # save historic temperatures in sqlite3
         try:
-            Utils.publish_MQTT(controller.mqtt_server, controller.mqtt_topic_day_temperature, str(
-                day), controller.mqtt_username, controller.mqtt_password)
+            controller.publish_MQTT(controller.mqtt_topic_day_temperature, str(day))
         except Exception as e:
             return("Error publish_MQTT: %s", e)
 
@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+"""Bounded thread pool for blocking sensor and network calls, results come back to the reactor as Deferreds."""
+import logging
+
+from twisted.internet import reactor, threads
+from twisted.python import threadpool
+
+DEFAULT_TIMEOUT = 30
+# a timeout only cancels the Deferred, the thread carries on; work under these names must not be abandoned half way
+UNBOUNDED = ('compact', 'ingest', 'migrate')
+
+
+class WorkerPool(object):
+
+    def __init__(self, max_threads=4, timeouts=None, default_timeout=DEFAULT_TIMEOUT):
+        self.pool = threadpool.ThreadPool(0, max_threads, name="gdc-workers")
+        self.timeouts = timeouts or {}
+        self.default_timeout = default_timeout
+
+    def start(self):
+        if self.pool.started:
+            return
+        self.pool.start()
+        reactor.addSystemEventTrigger('during', 'shutdown', self.stop)  # @UndefinedVariable
+        logging.info("Worker pool started (max_threads=%d)" % (self.pool.max))
+
+    def stop(self):
+        if self.pool.started:
+            self.pool.stop()
+
+    """run f(*args, **kwargs) on a worker thread, the Deferred is cancelled after the timeout configured for name
+    unless name is UNBOUNDED"""
+    def run(self, name, f, *args, **kwargs):
+        d = threads.deferToThreadPool(reactor, self.pool, f, *args, **kwargs)
+        timeout = 0 if name in UNBOUNDED else self.timeouts.get(name, self.default_timeout)
+        if timeout > 0:
+            d.addTimeout(timeout, reactor)
+        return d
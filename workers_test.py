@@ -0,0 +1,58 @@
+import threading
+import workers as Workers
+
+from twisted.internet import defer, reactor
+from twisted.trial import unittest
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self.release = threading.Event()
+        self.pool = Workers.WorkerPool(2, {'slow': 0.05, 'unbounded': 0, 'ingest': 0.05}, default_timeout=0.05)
+        self.pool.start()
+
+    def tearDown(self):
+        self.release.set()
+        self.pool.stop()
+
+    def wait(self, result):
+        self.release.wait(5)
+        return result
+
+    @defer.inlineCallbacks
+    def testResult(self):
+        result = yield self.pool.run('db', lambda a, b=0: a + b, 40, b=2)
+        self.assertEqual(42, result)
+
+    def testError(self):
+        return self.assertFailure(self.pool.run('db', int, 'abc'), ValueError)
+
+    def testTimeout(self):
+        return self.assertFailure(self.pool.run('slow', self.wait, 1), defer.TimeoutError)
+
+    @defer.inlineCallbacks
+    def testNoTimeout(self):
+        reactor.callLater(0.2, self.release.set)  # well past the default timeout
+        result = yield self.pool.run('unbounded', self.wait, 1)
+        self.assertEqual(1, result)
+
+    @defer.inlineCallbacks
+    def testIngestNeverTimesOut(self):
+        reactor.callLater(0.2, self.release.set)
+        result = yield self.pool.run('ingest', self.wait, 2)
+        self.assertEqual(2, result)
+
+    def testStartStopIdempotent(self):
+        self.pool.start()
+        self.assertTrue(self.pool.pool.started)
+        self.pool.stop()
+        self.pool.stop()
+        self.assertFalse(self.pool.pool.started)
+
+#
+# python workers_test.py -v
+#
+if __name__ == '__main__':
+    import unittest as pyunit
+    pyunit.main()
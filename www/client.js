@@ -1,4 +1,5 @@
 var lastupdate = 0;
+var cursor = 0;
 var dps = []; // dataPoints
 var dps2 = []; // dataPoints
 
@@ -247,22 +248,27 @@ function uptime() {
 }
 
 
+function showUpdates(update) {
+    for (var i = 0; i < update.length; i++) {
+        var id = update[i][0];
+        var state = update[i][1];
+        var time = update[i][2];
+        $("#" + id + " p").html(formatState(state, time));
+        $("#" + id + " img").attr("src", "img/" + state + ".png")
+        $("#doorlist").listview('refresh');
+    }
+};
+
 function poll() {
     $.ajax({
         url: "upd",
         data: {
-            'lastupdate': lastupdate
+            'cursor': cursor
         },
         success: function (response, status) {
             lastupdate = response.timestamp;
-            for (var i = 0; i < response.update.length; i++) {
-                var id = response.update[i][0];
-                var state = response.update[i][1];
-                var time = response.update[i][2];
-                $("#" + id + " p").html(formatState(state, time));
-                $("#" + id + " img").attr("src", "img/" + state + ".png")
-                $("#doorlist").listview('refresh');
-            }
+            cursor = response.version;
+            showUpdates(response.update);
             setTimeout('poll()', 1000);
         },
         // handle error
@@ -276,9 +282,24 @@ function poll() {
     });
 };
 
+// server pushes door updates, the browser reconnects on its own
+function stream() {
+    if (typeof (EventSource) === "undefined") {
+        poll();
+        return;
+    }
+    var source = new EventSource("stream");
+    source.onmessage = function (e) {
+        var response = JSON.parse(e.data);
+        lastupdate = response.timestamp;
+        cursor = response.version;
+        showUpdates(response.update);
+    };
+};
+
 function init() {
     uptime()
-    poll()
+    stream()
 }
 
 $.ajax({